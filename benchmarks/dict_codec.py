@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare the per-dictionary cost of ``boson.utils.dict_serialize()``
+and ``dict_deserialize()`` against the original regular expression
+based codec, reproduced here for reference.  Each dictionary looks
+like the authentication data of a request.  Encoded and decoded
+values are memoized, so the number of distinct dictionaries matters;
+use ``--distinct`` equal to ``--rows`` to measure the cost with no
+repeated values.
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from boson import utils
+
+
+serialize_re = re.compile(r"""[/%="']""")
+deserialize_re = re.compile(r'%([0-9A-Fa-f]{2})')
+
+
+def ref_serialize(value):
+    """Serialize a single value using the reference codec."""
+
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, (int, long)):
+        return str(value)
+    return '"%s"' % serialize_re.sub(lambda x: '%%%02X' % ord(x.group(0)),
+                                     value)
+
+
+def ref_deserialize(value):
+    """Deserialize a single value using the reference codec."""
+
+    if (value[:1], value[-1:]) in [('"', '"'), ("'", "'")]:
+        return deserialize_re.sub(lambda x: chr(int(x.group(1), 16)),
+                                  value[1:-1])
+    elif value.isdigit():
+        return int(value)
+    return dict(null=None, true=True, false=False)[value.lower()]
+
+
+def ref_dict_serialize(data):
+    """Serialize a dictionary using the reference codec."""
+
+    return '/'.join(['%s=%s' % (k, ref_serialize(v)) for k, v in
+                     sorted(data.items(), key=lambda x: x[0])])
+
+
+def ref_dict_deserialize(data):
+    """Deserialize a dictionary using the reference codec."""
+
+    result = {}
+    if data:
+        for comp in data.split('/'):
+            key, value = comp.split('=')
+            result[key] = ref_deserialize(value)
+
+    return result
+
+
+def make_rows(count, distinct):
+    """
+    Build ``count`` authentication data dictionaries and their
+    serialized forms, cycling through ``distinct`` different
+    dictionaries.
+    """
+
+    dicts = []
+    for i in range(distinct):
+        dicts.append(dict(tenant_id='tenant-%08x' % i,
+                          user_id='user/%d' % i,
+                          quota_class=None if i % 2 else 'default',
+                          roles='admin' if i % 3 else 'member'))
+
+    rows = [dicts[i % distinct] for i in range(count)]
+    serialized = [ref_dict_serialize(data) for data in rows]
+
+    # The codec must produce exactly the same strings
+    for data, text in zip(rows, serialized)[:distinct]:
+        assert utils.dict_serialize(data) == text
+        assert utils.dict_deserialize(text) == data
+
+    return rows, serialized
+
+
+def bench(func, rows, repeat):
+    """
+    Return the best time per row, in microseconds, of ``repeat`` runs
+    of ``func`` over ``rows``.
+    """
+
+    best = None
+    for _i in range(repeat):
+        # Start each run with empty memoization caches
+        utils._serialize_cache.clear()
+        utils._deserialize_cache.clear()
+
+        start = time.time()
+        for row in rows:
+            func(row)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best * 1e6 / len(rows)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--rows', type='int', default=100000,
+                      help='Number of dictionaries to encode and decode')
+    parser.add_option('-d', '--distinct', type='int', default=100,
+                      help='Number of distinct dictionaries in the rows')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='Number of runs; the best run is reported')
+    opts, _args = parser.parse_args()
+
+    rows, serialized = make_rows(opts.rows, opts.distinct)
+
+    for name, ref_func, func, data in [
+            ('Serialize', ref_dict_serialize, utils.dict_serialize, rows),
+            ('Deserialize', ref_dict_deserialize, utils.dict_deserialize,
+             serialized)]:
+        ref_us = bench(ref_func, data, opts.repeat)
+        new_us = bench(func, data, opts.repeat)
+
+        print '%s cost (usec/row): reference %.2f, utils %.2f (%.1fx)' % (
+            name, ref_us, new_us, ref_us / new_us)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare the per-row cost of decoding field sets stored with the old
+pickle encoding against the JSON encoding used by the ``FieldSet``
+and ``FieldSetList`` column types.  Each row holds a field set and a list
+of field sets, as for the categories of a registry.  Decoded JSON
+values are memoized, so the number of distinct field sets in the rows
+matters; use ``--distinct`` equal to ``--rows`` to measure the cost
+of decoding with no repeated values.
+"""
+
+import cPickle
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from boson.db.sqlalchemy import models as sa_models
+
+
+def make_rows(count, width, distinct):
+    """
+    Build the encoded column values for ``count`` registry rows, each
+    with field sets containing ``width`` field names.  The rows cycle
+    through ``distinct`` different sets of field names.
+    """
+
+    fs_type = sa_models.FieldSet()
+    fsl_type = sa_models.FieldSetList()
+
+    pickled = []
+    encoded = []
+    for i in range(distinct):
+        fields = ['field_%d_%d' % (i, j) for j in range(width)]
+        fset = set(fields)
+        fsets = [set(fields[:j]) for j in range(width, -1, -1)]
+
+        pickled.append((cPickle.dumps(fset), cPickle.dumps(fsets)))
+        encoded.append((fs_type.process_bind_param(fset, None),
+                        fsl_type.process_bind_param(fsets, None)))
+
+    return ([pickled[i % distinct] for i in range(count)],
+            [encoded[i % distinct] for i in range(count)])
+
+
+def decode_pickled(rows):
+    """Decode rows using the old pickle encoding."""
+
+    for fset, fsets in rows:
+        cPickle.loads(str(fset))
+        cPickle.loads(str(fsets))
+
+
+def decode_json(rows):
+    """Decode rows using the FieldSet and FieldSetList types."""
+
+    # Start each run with empty decoding caches
+    fs_decode = sa_models.FieldSet().process_result_value
+    fsl_decode = sa_models.FieldSetList().process_result_value
+
+    for fset, fsets in rows:
+        fs_decode(fset, None)
+        fsl_decode(fsets, None)
+
+
+def bench(func, rows, repeat):
+    """
+    Return the best time per row, in microseconds, of ``repeat`` runs
+    of ``func`` over ``rows``.
+    """
+
+    best = None
+    for _i in range(repeat):
+        start = time.time()
+        func(rows)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best * 1e6 / len(rows)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--rows', type='int', default=100000,
+                      help='Number of registry rows to decode')
+    parser.add_option('-w', '--width', type='int', default=4,
+                      help='Number of field names in each field set')
+    parser.add_option('-d', '--distinct', type='int', default=100,
+                      help='Number of distinct field sets in the rows')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='Number of runs; the best run is reported')
+    opts, _args = parser.parse_args()
+
+    pickled, encoded = make_rows(opts.rows, opts.width, opts.distinct)
+
+    print 'Encoded size (bytes/row): pickle %d, json %d' % (
+        sum(len(v) for v in pickled[0]), sum(len(v) for v in encoded[0]))
+
+    pickle_us = bench(decode_pickled, pickled, opts.repeat)
+    json_us = bench(decode_json, encoded, opts.repeat)
+
+    print 'Decode cost (usec/row): pickle %.2f, json %.2f (%.1fx)' % (
+        pickle_us, json_us, pickle_us / json_us)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the reservation cycle through the ``boson.db.api.API``
+interface: reserving against the effective quotas, committing or
+rolling back the reservation, and expiring abandoned reservations.
+Any backend may be measured; the SQLAlchemy backend is connected to
+the database given by ``--connection``, which defaults to an
+in-memory SQLite database.
+
+For each phase of the cycle, the throughput, the 50th, 99th and
+99.9th percentile latencies, and, for the SQLAlchemy backend, the
+number of SQL statements issued per operation are reported.
+Operations are issued serially; ``--contention`` is the fraction of
+operations directed at a single hot tenant, which concentrates the
+work on a few usage records.  To measure lock contention, run several
+copies against the same server database; the registry, quotas and
+usages are shared between the copies.
+"""
+
+import datetime
+import math
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import sqlalchemy as sa
+
+from boson import context
+from boson.db.memory import api as memory_api
+from boson.db.sqlalchemy import api as sa_api
+from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import session
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common import timeutils
+
+
+PHASES = ('reserve', 'commit', 'rollback', 'expire')
+
+
+class StatementCounter(object):
+    """Count the SQL statements issued through an engine."""
+
+    def __init__(self, engine=None):
+        self.count = 0
+        if engine is not None:
+            sa.event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.count += 1
+
+
+def make_backend(opts):
+    """
+    Construct the database API object for the selected backend.
+    Returns a tuple of the API object and a ``StatementCounter``,
+    which counts nothing for backends not using SQL.
+    """
+
+    if opts.backend == 'memory':
+        return memory_api.API(), None
+
+    cfg.CONF.set_override('sql_connection', opts.connection)
+    session.cleanup()
+    engine = session.get_engine()
+    sa_models.BASE.metadata.create_all(engine)
+
+    return sa_api.API(), StatementCounter(engine)
+
+
+def get_or_create(getter, creator):
+    """
+    Look up an object, creating it if it does not exist.  Copies of
+    the benchmark sharing a database may race to create it.
+    """
+
+    try:
+        return getter()
+    except KeyError:
+        try:
+            return creator()
+        except exceptions.Duplicate:
+            return getter()
+
+
+def setup(dbapi, ctx, opts):
+    """
+    Create the registry, the quotas and the usages.  Returns a list
+    of tuples of each service and its resources, and a list of the
+    usage for each tenant and resource, keyed by resource ID.
+    """
+
+    services = []
+    for i in range(opts.services):
+        name = 'service-%d' % i
+        svc = get_or_create(
+            lambda: dbapi.get_service(ctx, name=name),
+            lambda: dbapi.create_service(ctx, name, ['tenant_id']))
+        cat = get_or_create(
+            lambda: dbapi.get_category(ctx, service=svc, name='tenant'),
+            lambda: dbapi.create_category(ctx, svc, 'tenant', ['tenant_id'],
+                                          [['tenant_id'], []]))
+
+        resources = []
+        for j in range(opts.resources):
+            res_name = 'resource-%d' % j
+            res = get_or_create(
+                lambda: dbapi.get_resource(ctx, service=svc, name=res_name),
+                lambda: dbapi.create_resource(ctx, svc, cat, res_name, []))
+            get_or_create(
+                lambda: dbapi.get_quota(ctx, resource=res, auth_data={}),
+                lambda: dbapi.create_quota(ctx, res, {}, opts.limit))
+            resources.append(res)
+
+        services.append((svc, resources))
+
+    usages = []
+    for i in range(opts.tenants):
+        auth_data = dict(tenant_id='tenant-%d' % i)
+        tenant_usages = {}
+        for _svc, resources in services:
+            for res in resources:
+                tenant_usages[res.id] = get_or_create(
+                    lambda: dbapi.get_usage(ctx, resource=res,
+                                            param_data={},
+                                            auth_data=auth_data),
+                    lambda: dbapi.create_usage(ctx, res, {}, auth_data))
+        usages.append((auth_data, tenant_usages))
+
+    return services, usages
+
+
+def reserve(dbapi, ctx, opts, services, usages, rand):
+    """
+    Reserve some resources of one service for one tenant, checking
+    the effective quotas.  Returns the ID of the reservation, or
+    ``None`` if a quota would be exceeded.
+    """
+
+    if rand.random() < opts.contention:
+        auth_data, tenant_usages = usages[0]
+    else:
+        auth_data, tenant_usages = rand.choice(usages)
+    _svc, resources = rand.choice(services)
+    resources = rand.sample(resources, min(opts.items, len(resources)))
+    expire = timeutils.utcnow() + datetime.timedelta(seconds=opts.expire)
+
+    with dbapi.transaction(ctx):
+        quotas = dbapi.get_effective_quotas(ctx, resources, auth_data)
+
+        items = []
+        for res in resources:
+            usage = dbapi.get_usage(ctx, id=tenant_usages[res.id].id)
+            delta = rand.randint(1, opts.delta)
+            quota = quotas[res.id]
+            if (quota is not None and quota.limit is not None and
+                    usage.used + usage.reserved + delta > quota.limit):
+                return None
+            items.append((res, usage, delta))
+
+        resv = dbapi.create_reservation(ctx, expire)
+        dbapi.reserve_many(ctx, resv, items)
+
+    return resv.id
+
+
+def finish(dbapi, ctx, resv_id, commit):
+    """
+    Commit or roll back a reservation.  When committing, the reserved
+    amounts are moved to the amounts in use.
+    """
+
+    with dbapi.transaction(ctx):
+        resv = dbapi.get_reservation(ctx, resv_id,
+                                     hints=['reserved_items.usage'])
+
+        deltas = {}
+        for item in resv.reserved_items:
+            deltas.setdefault(item.usage_id, [item.usage, 0])
+            deltas[item.usage_id][1] += item.delta
+            item.delete()
+
+        for usage, delta in deltas.values():
+            if commit:
+                usage.update(used=usage.used + delta,
+                             reserved=usage.reserved - max(delta, 0))
+            else:
+                usage.update(reserved=usage.reserved - max(delta, 0))
+
+        resv.delete()
+
+
+def percentile(timings, pct):
+    """Return a percentile of a sorted list of timings."""
+
+    index = int(math.ceil(pct / 100.0 * len(timings))) - 1
+    return timings[max(index, 0)]
+
+
+def run(dbapi, counter, ctx, opts, services, usages):
+    """
+    Run the reservation cycle.  Returns a dictionary mapping each
+    phase to a tuple of the list of latencies, in seconds, and the
+    number of statements issued.
+    """
+
+    rand = random.Random(opts.seed)
+    results = dict((phase, ([], 0)) for phase in PHASES)
+
+    def timed(phase, func, *args):
+        before = counter.count if counter else 0
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        timings, statements = results[phase]
+        timings.append(elapsed)
+        results[phase] = (timings,
+                          statements + (counter.count - before
+                                        if counter else 0))
+        return result
+
+    refused = 0
+    for i in range(opts.operations):
+        resv_id = timed('reserve', reserve, dbapi, ctx, opts, services,
+                        usages, rand)
+        if resv_id is None:
+            refused += 1
+        else:
+            outcome = rand.random()
+            if outcome < opts.commit:
+                timed('commit', finish, dbapi, ctx, resv_id, True)
+            elif outcome < opts.commit + opts.rollback:
+                timed('rollback', finish, dbapi, ctx, resv_id, False)
+
+        # Reservations neither committed nor rolled back are left to
+        # expire
+        if (i + 1) % opts.expire_every == 0:
+            timed('expire', dbapi.expire_reservations, ctx)
+
+    return results, refused
+
+
+def report(results, refused, counter):
+    """Print the measurements of each phase."""
+
+    print '%-10s %8s %10s %9s %9s %9s %8s' % (
+        'phase', 'ops', 'ops/sec', 'p50 ms', 'p99 ms', 'p999 ms', 'q/op')
+    for phase in PHASES:
+        timings, statements = results[phase]
+        if not timings:
+            continue
+
+        timings = sorted(timings)
+        queries = ('%8.1f' % (float(statements) / len(timings))
+                   if counter else '%8s' % '-')
+        print '%-10s %8d %10.1f %9.3f %9.3f %9.3f %s' % (
+            phase, len(timings), len(timings) / sum(timings),
+            percentile(timings, 50) * 1e3, percentile(timings, 99) * 1e3,
+            percentile(timings, 99.9) * 1e3, queries)
+
+    if refused:
+        print 'Reservations refused by quota: %d' % refused
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-b', '--backend', type='choice',
+                      choices=['sqlalchemy', 'memory'], default='sqlalchemy',
+                      help='Database backend to measure: sqlalchemy or '
+                           'memory')
+    parser.add_option('-c', '--connection', default='sqlite://',
+                      help='SQLAlchemy connection string for the '
+                           'sqlalchemy backend')
+    parser.add_option('-s', '--services', type='int', default=2,
+                      help='Number of services')
+    parser.add_option('-r', '--resources', type='int', default=5,
+                      help='Number of resources of each service')
+    parser.add_option('-t', '--tenants', type='int', default=100,
+                      help='Number of tenants')
+    parser.add_option('-x', '--contention', type='float', default=0.0,
+                      help='Fraction of operations directed at a single '
+                           'hot tenant')
+    parser.add_option('-n', '--operations', type='int', default=2000,
+                      help='Number of reservations to make')
+    parser.add_option('-i', '--items', type='int', default=2,
+                      help='Number of resources in each reservation')
+    parser.add_option('-d', '--delta', type='int', default=4,
+                      help='Largest amount of a resource reserved')
+    parser.add_option('-l', '--limit', type='int', default=1 << 30,
+                      help='Default quota limit of each resource')
+    parser.add_option('--commit', type='float', default=0.8,
+                      help='Fraction of reservations committed')
+    parser.add_option('--rollback', type='float', default=0.15,
+                      help='Fraction of reservations rolled back; the '
+                           'rest are left to expire')
+    parser.add_option('--expire', type='float', default=0.0,
+                      help='Seconds after which reservations expire')
+    parser.add_option('--expire-every', type='int', default=100,
+                      help='Number of reservations between runs of '
+                           'expire_reservations()')
+    parser.add_option('--seed', type='int', default=None,
+                      help='Seed for the random choices of operations')
+    opts, _args = parser.parse_args()
+
+    dbapi, counter = make_backend(opts)
+    ctx = context.Context('benchmark', None)
+
+    start = time.time()
+    services, usages = setup(dbapi, ctx, opts)
+    print 'Setup: %d services, %d resources, %d usages in %.2f s' % (
+        len(services), len(services) * opts.resources,
+        len(usages) * len(services) * opts.resources, time.time() - start)
+
+    results, refused = run(dbapi, counter, ctx, opts, services, usages)
+    report(results, refused, counter)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import weakref
+
 from boson.openstack.common.gettextutils import _
 
 
@@ -43,11 +45,22 @@ class Resource(object):
 class SpecificResource(object):
     """
     Represent a single resource.
+
+    Instances are interned: constructing a SpecificResource for the
+    same Resource object and parameter data as an existing one returns
+    the existing instance.  Comparing two instances is then usually an
+    identity check, and the hash is computed only once, which makes
+    them cheap to use as dictionary keys.  Instances, including their
+    param_data, must not be modified.
     """
 
-    def __init__(self, resource, param_data=None):
+    # The existing instances, by Resource object and sorted parameter
+    # data items
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, resource, param_data=None):
         """
-        Initialize a SpecificResource.
+        Look up or initialize a SpecificResource.
 
         :param resource: The Resource object.
         :param param_data: The parameter data relevant to this
@@ -56,39 +69,58 @@ class SpecificResource(object):
                            resource.
         """
 
-        self.resource = resource
-
         # Filter the parameter data
         if not param_data:
             param_data = {}
-        self.param_data = dict((k, v) for k, v in param_data.items()
-                               if k in resource.params)
+        param_data = dict((k, v) for k, v in param_data.items()
+                          if k in resource.params)
+        param_items = tuple(sorted(param_data.items()))
+
+        # Values which compare equal may still be named differently,
+        # such as 1 and True, or 'x' and u'x', so their types are
+        # part of the key
+        key = (resource, tuple((k, type(v), v) for k, v in param_items))
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable parameter values; don't intern the instance
+            key = None
 
         # Make sure we got everything
-        missing = resource.params - set(self.param_data.keys())
+        missing = resource.params - set(param_data.keys())
         if missing:
             raise ValueError(_("Missing parameter data fields: %s") %
                              ', '.join(repr(f) for f in sorted(missing)))
 
+        self = super(SpecificResource, cls).__new__(cls)
+        self.resource = resource
+        self.param_data = param_data
+
         # Build the canonical resource name
         self.name = '%s/%s' % (resource.service.name, resource.name)
-        if self.param_data:
-            param_items = ['%s=%r' % (k, v) for k, v in
-                           sorted(self.param_data.items(),
-                                  key=lambda x: x[0])]
-            self.name += '/%s' % '/'.join(param_items)
+        if param_items:
+            self.name += '/%s' % '/'.join('%s=%r' % (k, v)
+                                          for k, v in param_items)
+        self._hash = hash(self.name)
+
+        if key is not None:
+            cls._interned[key] = self
+
+        return self
 
     def __hash__(self):
         """Return a hash value of this resource."""
 
-        return hash(self.name)
+        return self._hash
 
     def __eq__(self, other):
         """Compare two resources and return equality."""
 
-        return self.name == other.name
+        return self is other or self.name == other.name
 
     def __ne__(self, other):
         """Compare two resources and return inequality."""
 
-        return self.name != other.name
+        return self is not other and self.name != other.name
@@ -16,13 +16,46 @@
 #    under the License.
 
 import abc
+import random
 
+from boson.db import models
+from boson import exceptions
+from boson.openstack.common import cfg
 from boson.openstack.common.gettextutils import _
 from boson.openstack.common import log as logging
+from boson import utils
 
 
 LOG = logging.getLogger(__name__)
 
+db_api_opts = [
+    cfg.IntOpt('usage_refresh_interval',
+               default=0,
+               help='Number of reservations against a usage after which '
+                    'fresh usage information is requested from the '
+                    'service; 0 disables usage refreshes'),
+    cfg.FloatOpt('usage_refresh_jitter',
+                 default=0.25,
+                 help='Fraction by which the number of reservations '
+                      'between usage refreshes is randomly varied, so '
+                      'that usages do not all become stale at once'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(db_api_opts)
+
+# The maximum number of entries in the hints caches; each cache is
+# cleared when it fills up
+HINTS_CACHE_SIZE = 1024
+
+# Parsed hints, keyed by model and the set of hints.  The models are
+# static, so a parsed hints tree never changes.
+_PARSED_HINTS = {}
+
+# Undefined or unnecessary hints, as (model, field) tuples, which have
+# already been logged
+_BAD_HINTS = set()
+
 
 class APITransaction(object):
     """
@@ -88,7 +121,11 @@ class APITransaction(object):
 
     def commit(self):
         """
-        Commit the transaction.
+        Commit the transaction.  Changes to model objects which have
+        not yet been written to the database are flushed first; if
+        that fails, and ``rollback=True`` was passed to the
+        constructor, the transaction is rolled back before the
+        exception is re-raised.
         """
 
         # If the transaction has already been closed, don't do
@@ -96,9 +133,22 @@ class APITransaction(object):
         if self._closed:
             return
 
-        self.dbapi.commit(self.context)
+        try:
+            self.dbapi.commit(self.context)
+        except Exception:
+            if self._rollback:
+                self.dbapi.rollback(self.context)
+            raise
+        finally:
+            self._closed = True
 
-        self._closed = True
+    def flush(self):
+        """
+        Write the changes made to model objects within the transaction
+        to the database, without ending the transaction.
+        """
+
+        self.dbapi.flush(self.context)
 
     def rollback(self):
         """
@@ -172,12 +222,23 @@ class API(object):
                       case of reference fields which are represented
                       as lists, there is no need to use square
                       brackets.)
+
+        :returns: A dictionary mapping the names of the reference
+                  fields to tuples of the referenced model and the
+                  parsed hints for that model.  The result is cached
+                  and shared between callers, and must not be
+                  modified.
         """
 
         # Were any hints even given?
         if not hints:
             return {}
 
+        # Have we parsed these hints before?
+        key = (model, frozenset(hints))
+        if key in _PARSED_HINTS:
+            return _PARSED_HINTS[key]
+
         # The fields dictionary maps the direct fields and the
         # corresponding models; the subhints dictionary will be used
         # to recurse later on
@@ -187,15 +248,22 @@ class API(object):
         for hint in hints:
             field, _sep, subfield = hint.partition('.')
 
-            # Look up the field in the model
+            # Look up the field in the model; bad hints are only
+            # reported the first time they are seen
             if field not in model._refs:
+                if (model, field) in _BAD_HINTS:
+                    continue
+                if len(_BAD_HINTS) >= HINTS_CACHE_SIZE:
+                    _BAD_HINTS.clear()
+                _BAD_HINTS.add((model, field))
+
                 model_name = model.__name__
                 if field not in model._fields:
                     LOG.warning(_("Hint for undefined field %(field)r "
                                   "of model %(model_name)s") % locals())
                 else:
-                    LOG.notice(_("Unnecessary hint %(field)r "
-                                 "for model %(model_name)s") % locals())
+                    LOG.info(_("Unnecessary hint %(field)r "
+                               "for model %(model_name)s") % locals())
                 continue
 
             # Have we handled this field before?
@@ -214,12 +282,160 @@ class API(object):
         # Now we can build and return the result dictionary tree
         results = {}
         for field, sub_model in fields.items():
-            sub_results = self.hint_parser(sub_model, subhints.get(field))
+            sub_results = self.hints_parser(sub_model, subhints.get(field))
 
             results[field] = (sub_model, sub_results)
 
+        if len(_PARSED_HINTS) >= HINTS_CACHE_SIZE:
+            _PARSED_HINTS.clear()
+        _PARSED_HINTS[key] = results
+
         return results
 
+    def _model(self, context, klass, base_obj, hints=None):
+        """
+        Retrieve the model object for an underlying database object.
+        If a model object for the same database object has already
+        been constructed in the session, it is brought up to date and
+        returned, so that repeated retrievals of an object yield the
+        same model object.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param base_obj: The underlying database object.
+        :param hints: An object expressing hints to the underlying
+                      database system, to be passed to the model
+                      class constructor.
+
+        :returns: An instance of ``klass``.
+        """
+
+        identity = self._identity_map(context)
+        key = (klass, base_obj.id)
+
+        model = identity.get(key)
+        if model is not None and model._base_obj is base_obj:
+            model._refresh(hints)
+            return model
+
+        model = klass(context, self, base_obj, hints)
+        identity[key] = model
+
+        return model
+
+    def _cached_model(self, context, klass, id, hints=None):
+        """
+        Retrieve the model object for a database object from the
+        identity map of the session, without accessing the database.
+        Returns ``None`` if no model object for the database object
+        has been constructed in the session.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param id: The ID of the database object.
+        :param hints: An object expressing hints to the underlying
+                      database system, to be installed in the model
+                      object.
+
+        :returns: An instance of ``klass``, or ``None``.
+        """
+
+        model = self._identity_map(context).get((klass, id))
+        if model is not None:
+            model._refresh(hints)
+
+        return model
+
+    def _iter_pages(self, get_list, context, chunk_size, **kwargs):
+        """
+        Retrieve the objects selected by a list method a page at a
+        time, yielding them one by one.  Only one page of objects is
+        held at a time.
+
+        :param get_list: The list method, which must accept the
+                         ``marker`` and ``limit`` keyword arguments,
+                         and return fewer than ``limit`` objects only
+                         for the last page.
+        :param context: The current context for accessing the
+                        database.
+        :param chunk_size: The number of objects in each page.
+
+        All other keyword arguments are passed to the list method.
+        """
+
+        marker = None
+        while True:
+            page = get_list(context, marker=marker, limit=chunk_size,
+                            **kwargs)
+            for model in page:
+                yield model
+
+            if len(page) < chunk_size:
+                break
+            marker = page[-1].id
+
+    def _refresh_countdown(self):
+        """
+        Select the number of reservations against a usage before it
+        next needs refreshing.  The configured interval is varied by
+        up to ``usage_refresh_jitter`` of itself either way.
+        """
+
+        interval = CONF.usage_refresh_interval
+        spread = int(interval * CONF.usage_refresh_jitter)
+
+        return random.randint(max(interval - spread, 1), interval + spread)
+
+    def _restart_countdown(self):
+        """
+        Select the ``until_refresh`` value of a freshly refreshed
+        usage: a new countdown, or 0 if usage refreshes are disabled.
+        """
+
+        if CONF.usage_refresh_interval <= 0:
+            return 0
+
+        return self._refresh_countdown()
+
+    def _count_down(self, until_refresh, refresh_id):
+        """
+        Advance the freshness countdown of a usage a reservation is
+        being made against.  A usage without a countdown starts one.
+        The reservation which exhausts the countdown is still made,
+        but a refresh ID is assigned to the usage, and further
+        reservations against it are refused until it is refreshed
+        with ``refresh_usage()``.  A stale usage is thus left
+        unchanged, and nothing need be saved when a reservation is
+        refused.
+
+        :param until_refresh: The current ``until_refresh`` value of
+                              the usage.
+        :param refresh_id: The current ``refresh_id`` value of the
+                           usage.
+
+        :returns: A tuple of the new ``until_refresh`` and
+                  ``refresh_id`` values, and a boolean which is
+                  ``True`` if the usage is stale.  If usage refreshes
+                  are disabled, the values are returned unchanged and
+                  the usage is never stale.
+        """
+
+        if CONF.usage_refresh_interval <= 0:
+            return until_refresh, refresh_id, False
+        elif refresh_id is not None:
+            # Already waiting for a refresh
+            return until_refresh, refresh_id, True
+
+        if not until_refresh:
+            until_refresh = self._refresh_countdown()
+        until_refresh -= 1
+        if until_refresh <= 0:
+            return 0, utils.generate_uuid(), False
+
+        return until_refresh, None, False
+
     @abc.abstractmethod
     def create_session(self, context):
         """
@@ -248,6 +464,8 @@ class API(object):
     def commit(self, context):
         """
         End a transaction, committing the changes to the database.
+        Changes to model objects which have not yet been written are
+        flushed first.
 
         :param context: The current context for accessing the
                         database.
@@ -259,6 +477,22 @@ class API(object):
     def rollback(self, context):
         """
         End a transaction, rolling back the changes to the database.
+        Changes to model objects which have not yet been written are
+        discarded.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def flush(self, context):
+        """
+        Write the changes made to model objects which have not yet
+        been written to the database.  Called by ``commit()``; may
+        also be called within a transaction, for instance before
+        querying for objects which have been changed.
 
         :param context: The current context for accessing the
                         database.
@@ -317,7 +551,8 @@ class API(object):
         pass  # Pragma: nocover
 
     @abc.abstractmethod
-    def get_services(self, context, hints=None):
+    def get_services(self, context, hints=None, marker=None,
+                     limit=None, fields=None):
         """
         Retrieve a list of all defined services.
 
@@ -333,12 +568,61 @@ class API(object):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Service`` object or ID.  If
+                       given, only services with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of services to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the services which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Service``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last service may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
         """
 
         pass  # Pragma: nocover
 
+    def iter_services(self, context, hints=None, fields=None,
+                      chunk_size=1000):
+        """
+        Iterate over all defined services, in order of ID.  The
+        services are retrieved from the database in pages, so that
+        only one page of services is held in memory at a time.
+
+        :param context: The current context for accessing the
+                        database.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param fields: An optional list of the names of the fields
+                       of the services which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+        :param chunk_size: The number of services to retrieve from
+                           the database at a time.
+
+        :returns: An iterator over instances of
+                  ``boson.db.models.Service``.
+        """
+
+        return self._iter_pages(self.get_services, context, chunk_size,
+                                hints=hints, fields=fields)
+
     @abc.abstractmethod
     def create_category(self, context, service, name, usage_fset, quota_fsets):
         """
@@ -536,7 +820,8 @@ class API(object):
 
     @abc.abstractmethod
     def create_usage(self, context, resource, param_data, auth_data, used=0,
-                     reserved=0, until_refresh=0, refresh_id=None):
+                     reserved=0, until_refresh=0, refresh_id=None,
+                     instance=''):
         """
         Create a new usage for a given resource and user.  Raises a
         Duplicate exception in the event that the new usage is a
@@ -574,6 +859,13 @@ class API(object):
                            information will only be accepted if the
                            refresh has the same ID as stored in this
                            field.  Defaults to None.
+        :param instance: The name of the service instance the usage is
+                         for.  Defaults to the empty string, which
+                         designates the aggregate usage.  When the
+                         usage of a service instance is created, the
+                         aggregate usage is created if necessary, and
+                         the amounts used and reserved are added to
+                         it.
 
         :returns: An instance of ``boson.db.models.Usage``.
         """
@@ -582,7 +874,7 @@ class API(object):
 
     @abc.abstractmethod
     def get_usage(self, context, id=None, resource=None, param_data=None,
-                  auth_data=None, hints=None):
+                  auth_data=None, instance='', hints=None):
         """
         Look up a specific usage by id or by resource, parameter data,
         and authentication and authorization data.
@@ -595,6 +887,10 @@ class API(object):
         :param param_data: Resource parameter data (a dictionary).
         :param auth_data: Authentication and authorization data (a
                           dictionary).
+        :param instance: The name of the service instance to look up
+                         the usage for.  Defaults to the empty string,
+                         which selects the aggregate usage.  Ignored
+                         when looking up a usage by ID.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -619,7 +915,8 @@ class API(object):
 
     @abc.abstractmethod
     def get_usages(self, context, resource=None, param_data=None,
-                   auth_data=None, hints=None):
+                   auth_data=None, instance=None, hints=None,
+                   marker=None, limit=None, fields=None):
         """
         Retrieve a list of all defined usages.
 
@@ -634,6 +931,9 @@ class API(object):
         :param auth_data: Authentication and authorization data (a
                           dictionary) to filter the list of returned
                           usages.
+        :param instance: The name of a service instance to filter the
+                         list of returned usages.  Use the empty
+                         string to select only aggregate usages.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -644,8 +944,95 @@ class API(object):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Usage`` object or ID.  If
+                       given, only usages with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of usages to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the usages which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Usage``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last usage may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        pass  # Pragma: nocover
+
+    def iter_usages(self, context, resource=None, param_data=None,
+                    auth_data=None, instance=None, hints=None,
+                    fields=None, chunk_size=1000):
+        """
+        Iterate over all defined usages, in order of ID.  The usages
+        are retrieved from the database in pages, so that only one
+        page of usages is held in memory at a time.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: A ``Service`` or service ID to filter the
+                         returned usages.
+        :param param_data: Resource parameter data (a dictionary) to
+                           filter the returned usages.  Should be used
+                           in conjunction with the ``resource``
+                           filter.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) to filter the returned usages.
+        :param instance: The name of a service instance to filter the
+                         returned usages.  Use the empty string to
+                         select only aggregate usages.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param fields: An optional list of the names of the fields
+                       of the usages which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+        :param chunk_size: The number of usages to retrieve from
+                           the database at a time.
+
+        :returns: An iterator over instances of
+                  ``boson.db.models.Usage``.
+        """
+
+        return self._iter_pages(self.get_usages, context, chunk_size,
+                                resource=resource, param_data=param_data,
+                                auth_data=auth_data, instance=instance,
+                                hints=hints, fields=fields)
+
+    @abc.abstractmethod
+    def refresh_usage(self, context, usage, refresh_id, used):
+        """
+        Record fresh usage information sent by a service in response
+        to a ``UsageRefreshNeeded`` exception.  The information is only
+        accepted if the refresh ID matches the pending refresh of the
+        usage; otherwise, a ``RefreshMismatch`` exception is raised.
+        The check and the update are atomic, so only the first
+        refresh with a given ID is accepted.  The freshness countdown
+        of the usage is restarted.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage: The usage being refreshed.  Can be either a
+                      ``Usage`` object or a UUID of an existing usage.
+        :param refresh_id: The refresh ID reported for the usage by
+                           the ``UsageRefreshNeeded`` exception.
+        :param used: The amount of the resource currently in use.
+
+        :returns: An instance of ``boson.db.models.Usage``.
         """
 
         pass  # Pragma: nocover
@@ -710,7 +1097,9 @@ class API(object):
         pass  # Pragma: nocover
 
     @abc.abstractmethod
-    def get_quotas(self, context, resource=None, auth_data=None, hints=None):
+    def get_quotas(self, context, resource=None, auth_data=None,
+                   hints=None, marker=None, limit=None,
+                   fields=None):
         """
         Retrieve a list of all defined quotas.
 
@@ -731,8 +1120,97 @@ class API(object):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Quota`` object or ID.  If
+                       given, only quotas with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of quotas to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the quotas which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Quota``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last quota may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        pass  # Pragma: nocover
+
+    def iter_quotas(self, context, resource=None, auth_data=None,
+                    hints=None, fields=None, chunk_size=1000):
+        """
+        Iterate over all defined quotas, in order of ID.  The quotas
+        are retrieved from the database in pages, so that only one
+        page of quotas is held in memory at a time.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: A ``Service`` or service ID to filter the
+                         returned quotas.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) to filter the returned quotas.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param fields: An optional list of the names of the fields
+                       of the quotas which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+        :param chunk_size: The number of quotas to retrieve from
+                           the database at a time.
+
+        :returns: An iterator over instances of
+                  ``boson.db.models.Quota``.
+        """
+
+        return self._iter_pages(self.get_quotas, context, chunk_size,
+                                resource=resource, auth_data=auth_data,
+                                hints=hints, fields=fields)
+
+    @abc.abstractmethod
+    def get_effective_quotas(self, context, resources, auth_data,
+                             hints=None):
+        """
+        Determine the quotas applicable to a user for a set of
+        resources.  For each resource, the quota records matching the
+        projections of the authentication and authorization data onto
+        the sets of fields listed in the ``quota_fsets`` of the
+        resource's category are considered, and the one for the most
+        specific set of fields is selected.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resources: A sequence of ``Resource`` objects or
+                          resource IDs.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        :returns: A dictionary mapping the ID of each resource to an
+                  instance of ``boson.db.models.Quota``, or to
+                  ``None`` if no quota applies to that resource.
         """
 
         pass  # Pragma: nocover
@@ -776,6 +1254,153 @@ class API(object):
 
         pass  # Pragma: nocover
 
+    @abc.abstractmethod
+    def reserve_many(self, context, reservation, items):
+        """
+        Reserve particular amounts of several resources at once.  This
+        is equivalent to calling ``reserve()`` for each item, but is
+        performed atomically, and the usage records are locked in a
+        consistent order to avoid deadlocks between concurrent
+        reservations.
+
+        If usage refreshes are enabled, each reservation counts down
+        to the next refresh of the usages reserved against.  If any
+        of the usages are stale, nothing is reserved or changed, and
+        a ``UsageRefreshNeeded`` exception listing all the stale
+        usages is raised.  A usage becomes stale once a reservation
+        exhausts its countdown, and its refresh ID is saved with that
+        reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation the items are reserved
+                            in.  Can be either a ``Reservation``
+                            object or a UUID of an existing
+                            reservation.
+        :param items: A sequence of (resource, usage, delta) tuples.
+                      The resource and usage may each be either a
+                      model object or a UUID, as for ``reserve()``.
+
+        :returns: A list of instances of
+                  ``boson.db.models.ReservedItem``, in the same order
+                  as ``items``.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def commit_deltas(self, context, items):
+        """
+        Commit amounts of several resources immediately, without
+        making a reservation.  This is intended for requests which
+        are committed as soon as they are approved, typically
+        decrements such as destroying an instance.  Each delta is
+        added directly to the amount used on its usage, and to the
+        aggregate usage for the usage of a service instance; no
+        reservation or reserved items are created.  Quota limits are
+        not checked.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of (usage, delta) tuples.  The usage
+                      may be either a ``Usage`` object or a UUID of
+                      an existing usage.  The delta may be positive or
+                      negative.
+        """
+
+        pass  # Pragma: nocover
+
+    def check_absolute(self, context, items, auth_data):
+        """
+        Check requested amounts of absolute resources against the
+        effective quotas.  Absolute resources have no usage, so each
+        delta need only not exceed the limit; no reservation is made
+        and nothing is locked.  The check does not open a
+        transaction, and is normally answered entirely from the
+        registry cache and the quota index.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of (resource, delta) tuples.  The
+                      resource may be either a ``Resource`` object or
+                      a UUID of an existing absolute resource.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+
+        Note: if any of the limits would be exceeded, a
+        ``QuotaExceeded`` exception listing all the offending
+        resources will be raised.  A ``ValueError`` is raised if any
+        of the resources is not absolute.
+        """
+
+        # Sum up the deltas requested for each resource
+        deltas = {}
+        for resource, delta in items:
+            if not isinstance(resource, models.Resource):
+                resource = self.get_resource(context, id=resource)
+            if not resource.absolute:
+                raise ValueError(_("Resource %s is not absolute") %
+                                 resource.id)
+
+            deltas[resource.id] = deltas.get(resource.id, 0) + delta
+        if not deltas:
+            return
+
+        quotas = self.get_effective_quotas(context, deltas.keys(),
+                                           auth_data)
+
+        over = sorted(res_id for res_id, delta in deltas.items()
+                      if quotas[res_id] is not None and
+                      quotas[res_id].limit is not None and
+                      delta > quotas[res_id].limit)
+        if over:
+            raise exceptions.QuotaExceeded(over)
+
+    def check_reserve(self, context, reservation, items, auth_data):
+        """
+        Handle a request which may mix absolute and reservable
+        resources.  The absolute items are checked in memory with
+        ``check_absolute()``; only if they are within their limits
+        are the remaining items passed to ``reserve_many()``.  A
+        request for absolute resources alone never touches the
+        reservation tables.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation the reservable items are
+                            reserved in.  Can be either a
+                            ``Reservation`` object or a UUID of an
+                            existing reservation.
+        :param items: A sequence of (resource, usage, delta) tuples.
+                      The resource and usage may each be either a
+                      model object or a UUID, as for ``reserve()``;
+                      the usage of an absolute resource is ignored,
+                      and may be ``None``.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+
+        :returns: A list of instances of
+                  ``boson.db.models.ReservedItem``, in the same order
+                  as the reservable items of ``items``.
+        """
+
+        absolute = []
+        reservable = []
+        for resource, usage, delta in items:
+            if not isinstance(resource, models.Resource):
+                resource = self.get_resource(context, id=resource)
+
+            if resource.absolute:
+                absolute.append((resource, delta))
+            else:
+                reservable.append((resource, usage, delta))
+
+        self.check_absolute(context, absolute, auth_data)
+
+        if not reservable:
+            return []
+        return self.reserve_many(context, reservation, reservable)
+
     @abc.abstractmethod
     def get_reservation(self, context, id, hints=None):
         """
@@ -808,6 +1433,24 @@ class API(object):
         """
         Rolls back all expired reservations.
 
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of reservations rolled back.
+        """
+
+        pass  # Pragma: nocover
+
+    @abc.abstractmethod
+    def _identity_map(self, context):
+        """
+        Called to obtain the identity map of the session: a
+        dictionary, which should hold its values weakly, mapping
+        tuples of a model class and an ID to the model objects
+        constructed in the session.  Entries must be discarded when
+        the database objects are deleted, or when the transaction
+        creating them is rolled back.
+
         :param context: The current context for accessing the
                         database.
         """
@@ -866,7 +1509,11 @@ class API(object):
     def _save(self, context, base_obj):
         """
         Called to update the underlying database with the changes made
-        to a base database object.
+        to a base database object.  Outside of a transaction, the
+        changes must be written immediately.  Within a transaction,
+        they may instead be written by the next ``flush()`` or
+        ``commit()``; all the changes made to one object before then
+        should be written together.
 
         :param context: The current context for accessing the
                         database.
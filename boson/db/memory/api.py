@@ -0,0 +1,1733 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import weakref
+
+from boson.db import api
+from boson.db import models
+from boson import exceptions
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import timeutils
+from boson import utils
+
+
+# The combinations of fields which must be unique for each model
+_UNIQUE = {
+    models.Service: [('name',)],
+    models.Category: [('service_id', 'name')],
+    models.Resource: [('service_id', 'name')],
+    models.Usage: [('resource_id', 'parameter_data', 'auth_data',
+                    'instance')],
+    models.Quota: [('resource_id', 'auth_data')],
+}
+
+# The field of the referenced objects pointing back at the referencing
+# object, for each list reference
+_BACKREFS = {
+    (models.Service, 'categories'): 'service_id',
+    (models.Service, 'resources'): 'service_id',
+    (models.Category, 'resources'): 'category_id',
+    (models.Resource, 'usages'): 'resource_id',
+    (models.Resource, 'quotas'): 'resource_id',
+    (models.Resource, 'reserved_items'): 'resource_id',
+    (models.Usage, 'instances'): 'aggregate_id',
+    (models.Usage, 'reserved_items'): 'usage_id',
+    (models.Reservation, 'reserved_items'): 'reservation_id',
+}
+
+# The referencing fields which may be cleared when the referenced
+# object is deleted
+_NULLABLE_REFS = set(['aggregate_id'])
+
+# The fields holding amounts, which other transactions may add to
+# concurrently; rolling back a transaction takes out only its own
+# changes to them
+_AMOUNTS = {
+    models.Usage: ('used', 'reserved'),
+}
+
+
+def _get_id(obj):
+    """
+    Helper function to convert an argument which may be either a
+    ``boson.db.models`` object or a UUID into the UUID.
+    """
+
+    if isinstance(obj, models.BaseModel):
+        return obj.id
+    return obj
+
+
+def _freeze(value):
+    """
+    Helper function to convert a field value for storage.  Sets are
+    stored as frozensets, so the stored record cannot be changed in
+    place by accident; dictionaries and lists are copied.
+    """
+
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    elif isinstance(value, dict):
+        return dict(value)
+    elif isinstance(value, list):
+        return [_freeze(v) for v in value]
+    return value
+
+
+def _index_key(record, fields):
+    """
+    Helper function to compute the key of a record in a unique index.
+    Dictionaries are represented by their canonical serialization.
+
+    :param record: The record, or a dictionary of the indexed fields.
+    :param fields: The names of the indexed fields.
+    """
+
+    return tuple(utils.dict_serialize(record[f])
+                 if isinstance(record[f], dict) else record[f]
+                 for f in fields)
+
+
+def _thaw(value):
+    """
+    Helper function to convert a stored field value for use by
+    callers.  Frozensets are converted back to sets; dictionaries and
+    lists are copied, so that changes made by callers do not affect
+    the stored record.
+    """
+
+    if isinstance(value, frozenset):
+        return set(value)
+    elif isinstance(value, dict):
+        return dict(value)
+    elif isinstance(value, list):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def _paginate(records, marker, limit):
+    """
+    Helper function to select a page of records.  If a marker or
+    limit is given, the records are ordered by ID, and only those with
+    IDs greater than that of the marker are selected.
+
+    :param records: A sequence of stored records.
+    :param marker: The object or ID of the object preceding the page,
+                   or ``None``.
+    :param limit: The maximum number of records in the page, or
+                  ``None``.
+    """
+
+    if marker is None and limit is None:
+        return records
+
+    records = sorted(records, key=lambda record: record['id'])
+    if marker is not None:
+        marker = _get_id(marker)
+        records = [record for record in records if record['id'] > marker]
+    if limit is not None:
+        records = records[:limit]
+
+    return records
+
+
+class _Row(object):
+    """
+    A copy of a stored record, used as the base object of the model
+    objects returned to callers.  Changes made to it only reach the
+    stored record when it is saved; the record it was copied from, or
+    last saved to, is kept to determine which fields were changed.
+    """
+
+    def __init__(self, klass, record):
+        """
+        Initialize a ``_Row``.
+
+        :param klass: The ``boson.db.models`` class of the record.
+        :param record: The stored record.
+        """
+
+        self._klass = klass
+        self._pending = False
+        self.load(record)
+
+    def load(self, record):
+        """
+        Copy the fields of a stored record.
+
+        :param record: The stored record.
+        """
+
+        self.__dict__.update((f, _thaw(v)) for f, v in record.items())
+        self._record = record
+
+
+class _Table(object):
+    """
+    Stores the records of one model class, as dictionaries keyed by
+    ID.  Records are never modified in place; changing a record
+    replaces it, which allows a transaction to be rolled back by
+    comparing the replaced and replacing records.  Hash indexes are
+    maintained for the unique combinations of fields and for the
+    fields referencing other records.
+    """
+
+    def __init__(self, klass):
+        """
+        Initialize a ``_Table``.
+
+        :param klass: The ``boson.db.models`` class of the records.
+        """
+
+        self.klass = klass
+        self.records = {}
+        self._unique = dict((fields, {}) for fields in
+                            _UNIQUE.get(klass, []))
+        self._refs = {}
+
+    def find(self, **values):
+        """
+        Look up a record by a unique combination of fields.  Returns
+        ``None`` if there is no such record.
+
+        All keyword arguments give the values of the fields.
+        """
+
+        fields = tuple(f for f in _UNIQUE[self.klass][0] if f in values)
+        index = self._unique[fields]
+
+        return self.records.get(index.get(_index_key(values, fields)))
+
+    def children(self, field, value):
+        """
+        Look up the records referencing another record.
+
+        :param field: The name of the referencing field.
+        :param value: The ID of the referenced record.
+        """
+
+        return [self.records[id]
+                for id in self._refs.get(field, {}).get(value, ())]
+
+    def insert(self, record):
+        """
+        Insert a record.  Raises a Duplicate exception if the record
+        duplicates an existing record.
+
+        :param record: The record to insert.
+        """
+
+        keys = [(index, _index_key(record, fields))
+                for fields, index in self._unique.items()]
+        if any(key in index for index, key in keys):
+            raise exceptions.Duplicate(klass=self.klass.__name__)
+
+        for index, key in keys:
+            index[key] = record['id']
+        for field, value in record.items():
+            if field.endswith('_id') and value is not None:
+                self._refs.setdefault(field, {}).\
+                    setdefault(value, set()).add(record['id'])
+
+        self.records[record['id']] = record
+
+    def remove(self, id):
+        """
+        Remove a record.  Returns the removed record.
+
+        :param id: The ID of the record to remove.
+        """
+
+        record = self.records.pop(id)
+
+        for fields, index in self._unique.items():
+            index.pop(_index_key(record, fields), None)
+        for field, value in record.items():
+            if field.endswith('_id') and value is not None:
+                self._refs[field][value].discard(id)
+
+        return record
+
+
+class _Session(object):
+    """
+    Tracks the transactions of a context.  While a transaction is
+    open, every record stored, replaced or removed is remembered in
+    an undo log, along with the record which replaced it, which is
+    replayed in reverse to roll the transaction back.
+    Nested transactions mark their starting point in the undo log, so
+    they may be rolled back independently.  Rows changed within a
+    transaction are kept pending until the session is flushed.  The
+    session also holds the identity map of the model objects
+    constructed in it.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``_Session``.
+        """
+
+        self.marks = []
+        self.undo = []
+        self.pending = []
+        self.models = weakref.WeakValueDictionary()
+
+
+class API(api.API):
+    """
+    In-memory implementation of the database API.  All objects are
+    kept in Python dictionaries, indexed by the same keys the
+    database backends index, so that each operation costs a few
+    dictionary lookups.  Nothing is persisted.
+
+    Transactions are honored through copy-on-write rollback, but are
+    not isolated from one another: changes are visible to other
+    contexts as soon as they are made.  Rolling back a transaction
+    undoes only its own changes, leaving those other contexts have
+    made to the same records in the meantime.  No operation yields to other
+    green threads, so each call is atomic under eventlet; the backend
+    is not safe for use from multiple OS threads.  Hints are accepted
+    and ignored, since references never cost a query.
+    """
+
+    def __init__(self):
+        """
+        Initialize the in-memory database.
+        """
+
+        self._tables = dict((klass, _Table(klass)) for klass in (
+            models.Service, models.Category, models.Resource, models.Usage,
+            models.Quota, models.Reservation, models.ReservedItem))
+
+    def _wrap(self, context, klass, record):
+        """
+        Construct a model object for a stored record.  Raises a
+        KeyError if the record is ``None``.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param record: The stored record.
+        """
+
+        if record is None:
+            raise KeyError(_("No matching %s") % klass.__name__)
+
+        # Reuse the model object already constructed in the session,
+        # bringing its row up to date unless it has pending changes
+        model = self._identity_map(context).get((klass, record['id']))
+        if model is None:
+            return self._model(context, klass, _Row(klass, record))
+
+        row = model._base_obj
+        if row._record is not record and not row._pending:
+            row.load(record)
+
+        return self._model(context, klass, row)
+
+    def _put(self, context, klass, record):
+        """
+        Store a new or replacement record.  Raises a Duplicate
+        exception if the record duplicates an existing record.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class of the record.
+        :param record: The record to store.
+        """
+
+        sess = self._get_session(context)
+        table = self._tables[klass]
+
+        old = table.records.get(record['id'])
+        if old is not None:
+            table.remove(old['id'])
+        try:
+            table.insert(record)
+        except exceptions.Duplicate:
+            if old is not None:
+                table.insert(old)
+            raise
+
+        if sess.marks:
+            sess.undo.append((klass, record['id'], old, record))
+
+    def _remove(self, context, klass, id):
+        """
+        Remove a stored record.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class of the record.
+        :param id: The ID of the record to remove.
+        """
+
+        sess = self._get_session(context)
+        old = self._tables[klass].remove(id)
+
+        if sess.marks:
+            sess.undo.append((klass, id, old, None))
+
+    def _undo(self, klass, id, old, new):
+        """
+        Undo a change made to a stored record by a transaction being
+        rolled back.  If the record has since been changed by another
+        context, only the fields the transaction changed are
+        restored: amounts have the transaction's change taken out of
+        them, and other fields are restored unless they have been
+        changed again.
+
+        :param klass: The ``boson.db.models`` class of the record.
+        :param id: The ID of the record.
+        :param old: The record replaced or removed by the
+                    transaction, or ``None`` if it created the
+                    record.
+        :param new: The record stored by the transaction, or ``None``
+                    if it removed the record.
+        """
+
+        table = self._tables[klass]
+        current = table.records.get(id)
+
+        # A record the transaction created is removed, and one which
+        # has not been changed since is restored as a whole; one which
+        # has since been removed stays removed
+        if old is None or current is new:
+            record = old
+        elif current is None:
+            return
+        else:
+            record = dict(current)
+            for field, value in old.items():
+                if value == new[field]:
+                    continue
+                elif field in _AMOUNTS.get(klass, ()):
+                    record[field] += value - new[field]
+                elif current[field] == new[field]:
+                    record[field] = value
+
+        if current is not None:
+            table.remove(id)
+        if record is not None:
+            try:
+                table.insert(record)
+            except exceptions.Duplicate:
+                # The restored fields now duplicate another record;
+                # leave the record as the other context left it
+                if current is not None:
+                    table.insert(current)
+
+    def _create(self, context, klass, **fields):
+        """
+        Create and store a new record.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+
+        All other keyword arguments give the values of the fields of
+        the new record.
+
+        :returns: An instance of ``klass``.
+        """
+
+        record = dict((f, _freeze(v)) for f, v in fields.items())
+        record.update(id=utils.generate_uuid(), created_at=timeutils.utcnow(),
+                      updated_at=None)
+        self._put(context, klass, record)
+
+        return self._wrap(context, klass, record)
+
+    def _update(self, context, klass, id, **fields):
+        """
+        Replace a stored record with a copy having some fields
+        changed.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class of the record.
+        :param id: The ID of the record to update.
+
+        All other keyword arguments give the new values of fields.
+        """
+
+        record = dict(self._tables[klass].records[id])
+        record.update(fields, updated_at=timeutils.utcnow())
+        self._put(context, klass, record)
+
+    def _write(self, context, row):
+        """
+        Write the fields of a row which have been changed to the
+        stored record.
+
+        :param context: The current context for accessing the
+                        database.
+        :param row: The changed ``_Row``.
+        """
+
+        loaded = row._record
+        fields = dict((f, _freeze(getattr(row, f))) for f in loaded
+                      if f not in ('id', 'created_at', 'updated_at') and
+                      getattr(row, f) != loaded[f])
+        if not fields:
+            return
+
+        # Changes to the usage of a service instance are also applied
+        # to the aggregate usage, relative to the stored amounts, which
+        # may have changed since the row was loaded
+        table = self._tables[row._klass]
+        if row._klass is models.Usage and loaded['aggregate_id']:
+            current = table.records[row.id]
+            self._adjust_usage(context,
+                               table.records[loaded['aggregate_id']],
+                               fields.get('used', current['used']) -
+                               current['used'],
+                               fields.get('reserved', current['reserved']) -
+                               current['reserved'])
+
+        self._update(context, row._klass, row.id, **fields)
+        row.load(table.records[row.id])
+
+    def _adjust_usage(self, context, usage, used, reserved):
+        """
+        Add amounts to the used and reserved fields of a usage.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage: The stored usage record.
+        :param used: The amount to add to the used field.
+        :param reserved: The amount to add to the reserved field.
+        """
+
+        if used or reserved:
+            self._update(context, models.Usage, usage['id'],
+                         used=usage['used'] + used,
+                         reserved=usage['reserved'] + reserved)
+
+    def create_session(self, context):
+        """
+        Create a new session.  This will be stored on the user
+        context, and can be used by the database to manage a single
+        database connection.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        return _Session()
+
+    def begin(self, context):
+        """
+        Begin a transaction.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        sess = self._get_session(context)
+
+        # Pending changes belong to the enclosing transaction
+        if sess.marks:
+            self.flush(context)
+
+        sess.marks.append(len(sess.undo))
+
+    def commit(self, context):
+        """
+        End a transaction, committing the changes to the database.
+        Changes to model objects which have not yet been written are
+        flushed first.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        sess = self._get_session(context)
+        self.flush(context)
+        if sess.marks:
+            sess.marks.pop()
+        if not sess.marks:
+            sess.undo = []
+
+    def rollback(self, context):
+        """
+        End a transaction, rolling back the changes to the database.
+        Changes to model objects which have not yet been written are
+        discarded.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        sess = self._get_session(context)
+        for row in sess.pending:
+            row._pending = False
+        sess.pending = []
+        sess.models.clear()
+        if not sess.marks:
+            return
+
+        # Undo the changes to the records, newest first
+        mark = sess.marks.pop()
+        while len(sess.undo) > mark:
+            self._undo(*sess.undo.pop())
+
+    def flush(self, context):
+        """
+        Write the changes made to model objects which have not yet
+        been written to the database.  Called by ``commit()``; may
+        also be called within a transaction, for instance before
+        querying for objects which have been changed.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        sess = self._get_session(context)
+        pending, sess.pending = sess.pending, []
+        for row in pending:
+            row._pending = False
+            self._write(context, row)
+
+    def create_service(self, context, name, auth_fields):
+        """
+        Create a new service.  Raises a Duplicate exception in the
+        event that the new service is a duplicate of an existing
+        service.
+
+        :param context: The current context for accessing the
+                        database.
+        :param name: The canonical name of the service, i.e., 'nova',
+                     'glance', etc.
+        :param auth_fields: A sequence listing the names of the fields
+                            of authentication and authorization data
+                            that the service passes to Boson to
+                            uniquely identify the user.
+
+        :returns: An instance of ``boson.db.models.Service``.
+        """
+
+        return self._create(context, models.Service, name=name,
+                            auth_fields=set(auth_fields))
+
+    def get_service(self, context, id=None, name=None, hints=None):
+        """
+        Look up a specific service by name or by ID.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the service to look up.
+        :param name: The name of the service to look up.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: exactly one of ``id`` and ``name`` must be provided; if
+        neither or both are provided, a TypeError will be raised.  If
+        no matching service can be found, a KeyError will be raised.
+
+        :returns: An instance of ``boson.db.models.Service``.
+        """
+
+        if (id is None) == (name is None):
+            raise TypeError(_("Exactly one of id and name must be given"))
+
+        table = self._tables[models.Service]
+        if id is not None:
+            record = table.records.get(id)
+        else:
+            record = table.find(name=name)
+
+        return self._wrap(context, models.Service, record)
+
+    def get_services(self, context, hints=None, marker=None,
+                     limit=None, fields=None):
+        """
+        Retrieve a list of all defined services.
+
+        :param context: The current context for accessing the
+                        database.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param marker: An optional ``Service`` object or ID.  If
+                       given, only services with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of services to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the services which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+
+        :returns: A list of instances of ``boson.db.models.Service``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last service may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        records = _paginate(self._tables[models.Service].records.values(),
+                            marker, limit)
+
+        return [self._wrap(context, models.Service, record)
+                for record in records]
+
+    def create_category(self, context, service, name, usage_fset, quota_fsets):
+        """
+        Create a new category on a service.  Raises a Duplicate
+        exception in the event that the new category is a duplicate of
+        an existing category for the service.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The service the category is for.  Can be
+                        either a ``Service`` object or a UUID of an
+                        existing service.
+        :param name: The canonical name of the category.
+        :param usage_fset: A sequence listing the names of the fields
+                           of authentication and authorization data,
+                           passed by the service to Boson, which are
+                           to be used when looking up a ``Usage``
+                           record.
+        :param quota_fsets: A list of sequences of the names of the
+                            fields of authentication and authorization
+                            data, which are to be used when looking up
+                            ``Quota`` records.  The list must be in
+                            order from the most specific to the least
+                            specific.  For instance, this list could
+                            contain a set referencing the
+                            ``tenant_id``, followed by a set
+                            referencing the ``quota_class``, followed
+                            by an empty set; in this example, a quota
+                            applicable to the tenant would be used in
+                            preference to one applicable to the quota
+                            class, which would be used in preference
+                            to the default quota.
+
+        :returns: An instance of ``boson.db.models.Category``.
+        """
+
+        return self._create(context, models.Category,
+                            service_id=_get_id(service), name=name,
+                            usage_fset=set(usage_fset),
+                            quota_fsets=[set(fset) for fset in quota_fsets])
+
+    def get_category(self, context, id=None, service=None, name=None,
+                     hints=None):
+        """
+        Look up a specific category by id or by service and name.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the category to look up.
+        :param service: The ``Service`` or service ID of the service
+                        to look up the category in.
+        :param name: The name of the category to look up.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: either provide ``id`` or provide both ``service`` and
+        ``name``.  If an invalid combination of arguments is provided,
+        a TypeError will be raised.  If no matching category can be
+        found, a KeyError will be raised.
+
+        :returns: An instance of ``boson.db.models.Category``.
+        """
+
+        table = self._tables[models.Category]
+        if id is not None and service is None and name is None:
+            record = table.records.get(id)
+        elif id is None and service is not None and name is not None:
+            record = table.find(service_id=_get_id(service), name=name)
+        else:
+            raise TypeError(_("Either id or both service and name must be "
+                              "given"))
+
+        return self._wrap(context, models.Category, record)
+
+    def get_categories(self, context, service, hints=None):
+        """
+        Retrieve a list of all defined categories for a given service.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID of the service
+                        to retrieve the categories for.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        :returns: A list of instances of ``boson.db.models.Category``.
+        """
+
+        return [self._wrap(context, models.Category, record)
+                for record in self._tables[models.Category].children(
+                    'service_id', _get_id(service))]
+
+    def create_resource(self, context, service, category, name, parameters,
+                        absolute=False):
+        """
+        Create a new resource on a service.  Raises a Duplicate
+        exception in the event that the new resource is a duplicate of
+        an existing resource for the service.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The service the resource is for.  Can be
+                        either a ``Service`` object or a UUID of an
+                        existing service.
+        :param category: The category the resource is in.  Can be
+                         either a ``Category`` object or a UUID of an
+                         existing category.
+        :param name: The canonical name of the resource.
+        :param parameters: A sequence listing the names of the fields
+                           of resource parameter data, passed by the
+                           service to Boson, which are to be used when
+                           looking up a ``Usage`` record.  Parameters
+                           allow application of limits to resources
+                           contained within other resources; that is,
+                           if a resource has a limit of 5, using
+                           parameter data would allow that limit to be
+                           interpreted as 5 per parent resource.
+        :param absolute: A boolean indicating whether the resource is
+                         "absolute."  An absolute resource does not
+                         maintain any usage records or allocate any
+                         reservations.  Quota enforcement consists of
+                         a simple numerical comparison of the
+                         requested delta against the quota limit.
+                         This is designed to accommodate ephemeral
+                         resources, such as the number of files to
+                         inject into a Nova instance on boot.
+
+        :returns: An instance of ``boson.db.models.Resource``.
+        """
+
+        return self._create(context, models.Resource,
+                            service_id=_get_id(service),
+                            category_id=_get_id(category), name=name,
+                            parameters=set(parameters), absolute=absolute)
+
+    def get_resource(self, context, id=None, service=None, name=None,
+                     hints=None):
+        """
+        Look up a specific resource by id or by service and name.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the resource to look up.
+        :param service: The ``Service`` or service ID of the service
+                        to look up the resource in.
+        :param name: The name of the resource to look up.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: either provide ``id`` or provide both ``service`` and
+        ``name``.  If an invalid combination of arguments is provided,
+        a TypeError will be raised.  If no matching resource can be
+        found, a KeyError will be raised.
+
+        :returns: An instance of ``boson.db.models.Resource``.
+        """
+
+        table = self._tables[models.Resource]
+        if id is not None and service is None and name is None:
+            record = table.records.get(id)
+        elif id is None and service is not None and name is not None:
+            record = table.find(service_id=_get_id(service), name=name)
+        else:
+            raise TypeError(_("Either id or both service and name must be "
+                              "given"))
+
+        return self._wrap(context, models.Resource, record)
+
+    def get_resources(self, context, service, hints=None):
+        """
+        Retrieve a list of all defined resources for a given service.
+
+        :param context: The current context for accessing the
+                        database.
+        :param service: The ``Service`` or service ID of the service
+                        to retrieve the resources for.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        :returns: A list of instances of ``boson.db.models.Resource``.
+        """
+
+        return [self._wrap(context, models.Resource, record)
+                for record in self._tables[models.Resource].children(
+                    'service_id', _get_id(service))]
+
+    def create_usage(self, context, resource, param_data, auth_data, used=0,
+                     reserved=0, until_refresh=0, refresh_id=None,
+                     instance=''):
+        """
+        Create a new usage for a given resource and user.  Raises a
+        Duplicate exception in the event that the new usage is a
+        duplicate of an existing usage.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The resource the usage is for.  Can be either
+                         a ``Resource`` object or a UUID of an
+                         existing resource.
+        :param param_data: Resource parameter data (a dictionary).
+                           This is used to allow for usages of
+                           resources which are children of another
+                           resource, where the limit should apply only
+                           within that parent resource.  This allows,
+                           for example, a restriction on the number of
+                           IP addresses for a given Nova instance,
+                           without limiting the total number of IP
+                           addresses that can be allocated.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).  This is used to match up a
+                          usage with a particular user of the system.
+        :param used: The amount of the resource currently in use.
+                     Defaults to 0.
+        :param reserved: The amount of the resource currently
+                         reserved.  Note that negative reservations
+                         are not counted here.  Defaults to 0.
+        :param until_refresh: A counter which decrements each time the
+                              usage record is used in a quota
+                              computation.  When it reaches 0, the
+                              usage record will be refreshed.
+                              Defaults to 0.
+        :param refresh_id: A UUID generated when the usage record
+                           needs refreshing.  Refreshed usage
+                           information will only be accepted if the
+                           refresh has the same ID as stored in this
+                           field.  Defaults to None.
+        :param instance: The name of the service instance the usage is
+                         for.  Defaults to the empty string, which
+                         designates the aggregate usage.  When the
+                         usage of a service instance is created, the
+                         aggregate usage is created if necessary, and
+                         the amounts used and reserved are added to
+                         it.
+
+        :returns: An instance of ``boson.db.models.Usage``.
+        """
+
+        fields = dict(resource_id=_get_id(resource),
+                      parameter_data=param_data, auth_data=auth_data,
+                      used=used, reserved=reserved,
+                      until_refresh=until_refresh, refresh_id=None,
+                      instance='', aggregate_id=None)
+        if not instance:
+            fields['refresh_id'] = refresh_id
+            return self._create(context, models.Usage, **fields)
+
+        # The usage of a service instance is added to the aggregate
+        # usage
+        table = self._tables[models.Usage]
+        aggregate = table.find(resource_id=fields['resource_id'],
+                               parameter_data=param_data,
+                               auth_data=auth_data, instance='')
+        if table.find(resource_id=fields['resource_id'],
+                      parameter_data=param_data, auth_data=auth_data,
+                      instance=instance):
+            raise exceptions.Duplicate(klass=models.Usage.__name__)
+
+        if aggregate is None:
+            aggregate_id = self._create(context, models.Usage, **fields).id
+        else:
+            aggregate_id = aggregate['id']
+            self._adjust_usage(context, aggregate, used, reserved)
+
+        fields.update(refresh_id=refresh_id, instance=instance,
+                      aggregate_id=aggregate_id)
+        return self._create(context, models.Usage, **fields)
+
+    def get_usage(self, context, id=None, resource=None, param_data=None,
+                  auth_data=None, instance='', hints=None):
+        """
+        Look up a specific usage by id or by resource, parameter data,
+        and authentication and authorization data.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the usage to look up.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource to look up the usage for.
+        :param param_data: Resource parameter data (a dictionary).
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param instance: The name of the service instance to look up
+                         the usage for.  Defaults to the empty string,
+                         which selects the aggregate usage.  Ignored
+                         when looking up a usage by ID.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: either provide ``id`` or provide all three of
+        ``resource``, ``param_data``, and ``auth_data``.  If an
+        invalid combination of arguments is provided, a TypeError will
+        be raised.  If no matching resource can be found, a KeyError
+        will be raised.
+
+        :returns: An instance of ``boson.db.models.Usage``.
+        """
+
+        table = self._tables[models.Usage]
+        if (id is not None and resource is None and param_data is None and
+                auth_data is None):
+            record = table.records.get(id)
+        elif (id is None and resource is not None and
+              param_data is not None and auth_data is not None):
+            record = table.find(resource_id=_get_id(resource),
+                                parameter_data=param_data,
+                                auth_data=auth_data, instance=instance)
+        else:
+            raise TypeError(_("Either id or all of resource, param_data, "
+                              "and auth_data must be given"))
+
+        return self._wrap(context, models.Usage, record)
+
+    def get_usages(self, context, resource=None, param_data=None,
+                   auth_data=None, instance=None, hints=None,
+                   marker=None, limit=None, fields=None):
+        """
+        Retrieve a list of all defined usages.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: A ``Service`` or service ID to filter the
+                         list of returned usages.
+        :param param_data: Resource parameter data (a dictionary) to
+                           filter the list of returned usages.  Should
+                           be used in conjunction with the
+                           ``resource`` filter.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) to filter the list of returned
+                          usages.
+        :param instance: The name of a service instance to filter the
+                         list of returned usages.  Use the empty
+                         string to select only aggregate usages.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param marker: An optional ``Usage`` object or ID.  If
+                       given, only usages with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of usages to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the usages which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+
+        :returns: A list of instances of ``boson.db.models.Usage``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last usage may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        table = self._tables[models.Usage]
+        if resource is not None:
+            records = table.children('resource_id', _get_id(resource))
+        else:
+            records = table.records.values()
+
+        records = [record for record in records
+                   if ((param_data is None or
+                        record['parameter_data'] == param_data) and
+                       (auth_data is None or
+                        record['auth_data'] == auth_data) and
+                       (instance is None or record['instance'] == instance))]
+
+        return [self._wrap(context, models.Usage, record)
+                for record in _paginate(records, marker, limit)]
+
+    def refresh_usage(self, context, usage, refresh_id, used):
+        """
+        Record fresh usage information sent by a service in response
+        to a ``UsageRefreshNeeded`` exception.  The information is only
+        accepted if the refresh ID matches the pending refresh of the
+        usage; otherwise, a ``RefreshMismatch`` exception is raised.
+        The check and the update are atomic, so only the first
+        refresh with a given ID is accepted.  The freshness countdown
+        of the usage is restarted.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage: The usage being refreshed.  Can be either a
+                      ``Usage`` object or a UUID of an existing usage.
+        :param refresh_id: The refresh ID reported for the usage by
+                           the ``UsageRefreshNeeded`` exception.
+        :param used: The amount of the resource currently in use.
+
+        :returns: An instance of ``boson.db.models.Usage``.
+        """
+
+        # Write out pending changes first, so they do not overwrite
+        # the amounts changed here when they are flushed
+        self.flush(context)
+
+        usage_tab = self._tables[models.Usage]
+        usage_id = _get_id(usage)
+        if usage_id not in usage_tab.records:
+            raise KeyError(_("No matching Usage: %s") % usage_id)
+
+        record = usage_tab.records[usage_id]
+        if refresh_id is None or record['refresh_id'] != refresh_id:
+            raise exceptions.RefreshMismatch(refresh_id=refresh_id,
+                                             usage_id=usage_id)
+
+        # Changes to the usage of a service instance are also applied
+        # to the aggregate usage
+        if record['aggregate_id']:
+            self._adjust_usage(context,
+                               usage_tab.records[record['aggregate_id']],
+                               used - record['used'], 0)
+        self._update(context, models.Usage, usage_id, used=used,
+                     until_refresh=self._restart_countdown(),
+                     refresh_id=None)
+
+        return self.get_usage(context, id=usage_id)
+
+    def create_quota(self, context, resource, auth_data, limit=None):
+        """
+        Create a new quota for a given resource and user.  Raises a
+        Duplicate exception in the event that the new usage is a
+        duplicate of an existing quota.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: The resource the quota is for.  Can be either
+                         a ``Resource`` object or a UUID of an
+                         existing resource.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).  This is used to match up a
+                          quota with a particular user of the system.
+        :param limit: The limit on the number of the resource that the
+                      user is permitted to allocate.  Defaults to
+                      ``None`` (unlimited).
+
+        :returns: An instance of ``boson.db.models.Quota``.
+        """
+
+        return self._create(context, models.Quota,
+                            resource_id=_get_id(resource),
+                            auth_data=auth_data, limit=limit)
+
+    def get_quota(self, context, id=None, resource=None, auth_data=None,
+                  hints=None):
+        """
+        Look up a specific quota by id or by resource and
+        authentication and authorization data.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the quota to look up.
+        :param resource: The ``Resource`` or resource ID of the
+                         resource to look up the quota for.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: either provide ``id`` or both ``resource`` and
+        ``auth_data``.  If an invalid combination of arguments is
+        provided, a TypeError will be raised.  If no matching resource
+        can be found, a KeyError will be raised.
+
+        :returns: An instance of ``boson.db.models.Quota``.
+        """
+
+        table = self._tables[models.Quota]
+        if id is not None and resource is None and auth_data is None:
+            record = table.records.get(id)
+        elif id is None and resource is not None and auth_data is not None:
+            record = table.find(resource_id=_get_id(resource),
+                                auth_data=auth_data)
+        else:
+            raise TypeError(_("Either id or both resource and auth_data "
+                              "must be given"))
+
+        return self._wrap(context, models.Quota, record)
+
+    def get_quotas(self, context, resource=None, auth_data=None,
+                   hints=None, marker=None, limit=None,
+                   fields=None):
+        """
+        Retrieve a list of all defined quotas.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resource: A ``Service`` or service ID to filter the
+                         list of returned quotas.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary) to filter the list of returned
+                          quotas.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+        :param marker: An optional ``Quota`` object or ID.  If
+                       given, only quotas with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of quotas to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the quotas which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
+
+        :returns: A list of instances of ``boson.db.models.Quota``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last quota may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        table = self._tables[models.Quota]
+        if resource is not None:
+            records = table.children('resource_id', _get_id(resource))
+        else:
+            records = table.records.values()
+
+        records = [record for record in records
+                   if auth_data is None or record['auth_data'] == auth_data]
+
+        return [self._wrap(context, models.Quota, record)
+                for record in _paginate(records, marker, limit)]
+
+    def get_effective_quotas(self, context, resources, auth_data,
+                             hints=None):
+        """
+        Determine the quotas applicable to a user for a set of
+        resources.  For each resource, the quota records matching the
+        projections of the authentication and authorization data onto
+        the sets of fields listed in the ``quota_fsets`` of the
+        resource's category are considered, and the one for the most
+        specific set of fields is selected.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resources: A sequence of ``Resource`` objects or
+                          resource IDs.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        :returns: A dictionary mapping the ID of each resource to an
+                  instance of ``boson.db.models.Quota``, or to
+                  ``None`` if no quota applies to that resource.
+        """
+
+        resource_tab = self._tables[models.Resource]
+        category_tab = self._tables[models.Category]
+        quota_tab = self._tables[models.Quota]
+
+        fields = set(auth_data)
+        result = {}
+        for resource in resources:
+            resource_id = _get_id(resource)
+            if resource_id not in resource_tab.records:
+                raise KeyError(_("No matching %s") %
+                               models.Resource.__name__)
+            category = category_tab.records[
+                resource_tab.records[resource_id]['category_id']]
+
+            # The first quota found, from most to least specific, wins
+            result[resource_id] = None
+            for fset in category['quota_fsets']:
+                if not fset <= fields:
+                    continue
+
+                record = quota_tab.find(
+                    resource_id=resource_id,
+                    auth_data=dict((f, auth_data[f]) for f in fset))
+                if record is not None:
+                    result[resource_id] = self._wrap(context, models.Quota,
+                                                     record)
+                    break
+
+        return result
+
+    def create_reservation(self, context, expire):
+        """
+        Create a new reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param expire: A date and time at which the reservation will
+                       expire.
+
+        :returns: An instance of ``boson.db.models.Reservation``.
+        """
+
+        return self._create(context, models.Reservation, expire=expire)
+
+    def reserve(self, context, reservation, resource, usage, delta):
+        """
+        Reserve a particular amount of a specific resource.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation the item is reserved in.
+                            Can be either a ``Reservation`` object or
+                            a UUID of an existing reservation.
+        :param resource: The resource the reserved item is for.  Can
+                         be either a ``Resource`` object or a UUID of
+                         an existing resource.
+        :param usage: The usage record for the resource reservation.
+                      Can be either a ``Usage`` object or a UUID of an
+                      existing usage.
+        :param delta: The amount of the resource to reserve.  May be
+                      negative for deallocation.
+
+        :returns: An instance of ``boson.db.models.ReservedItem``.
+        """
+
+        return self.reserve_many(context, reservation,
+                                 [(resource, usage, delta)])[0]
+
+    def reserve_many(self, context, reservation, items):
+        """
+        Reserve particular amounts of several resources at once.  This
+        is equivalent to calling ``reserve()`` for each item, but is
+        performed atomically, and the usage records are locked in a
+        consistent order to avoid deadlocks between concurrent
+        reservations.
+
+        If usage refreshes are enabled, each reservation counts down
+        to the next refresh of the usages reserved against.  If any
+        of the usages are stale, nothing is reserved or changed, and
+        a ``UsageRefreshNeeded`` exception listing all the stale
+        usages is raised.  A usage becomes stale once a reservation
+        exhausts its countdown, and its refresh ID is saved with that
+        reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation the items are reserved
+                            in.  Can be either a ``Reservation``
+                            object or a UUID of an existing
+                            reservation.
+        :param items: A sequence of (resource, usage, delta) tuples.
+                      The resource and usage may each be either a
+                      model object or a UUID, as for ``reserve()``.
+
+        :returns: A list of instances of
+                  ``boson.db.models.ReservedItem``, in the same order
+                  as ``items``.
+        """
+
+        # Write out pending changes first, so they do not overwrite
+        # the amounts changed here when they are flushed
+        self.flush(context)
+
+        usage_tab = self._tables[models.Usage]
+        resv_id = _get_id(reservation)
+        items = [(_get_id(resource), _get_id(usage), delta)
+                 for resource, usage, delta in items]
+
+        # Sum up the positive deltas for each usage and its aggregate;
+        # negative reservations are not counted in the usage
+        increments = {}
+        for _res_id, usage_id, delta in items:
+            if usage_id not in usage_tab.records:
+                raise KeyError(_("No matching Usage: %s") % usage_id)
+
+            aggregate_id = usage_tab.records[usage_id]['aggregate_id']
+            for target in (usage_id, aggregate_id):
+                if target and delta > 0:
+                    increments[target] = increments.get(target, 0) + delta
+
+        # Count down to the next refresh of each usage reserved
+        # against, collecting all the stale usages
+        countdowns = {}
+        stale = []
+        for usage_id in sorted(set(item[1] for item in items)):
+            record = usage_tab.records[usage_id]
+            until_refresh, refresh_id, is_stale = self._count_down(
+                record['until_refresh'], record['refresh_id'])
+            countdowns[usage_id] = (until_refresh, refresh_id)
+            if is_stale:
+                stale.append(usage_id)
+
+        # Stale usages are left unchanged, so nothing is written when
+        # the reservation is refused
+        if stale:
+            raise exceptions.UsageRefreshNeeded(
+                [self._wrap(context, models.Usage, usage_tab.records[id])
+                 for id in stale])
+
+        # The reserved items must reference an existing reservation
+        # and resources, as the database's foreign keys require
+        reservations = self._tables[models.Reservation].records
+        resources = self._tables[models.Resource].records
+        if items and (resv_id not in reservations or
+                      any(item[0] not in resources for item in items)):
+            raise KeyError(_("No matching Reservation or Resource for "
+                             "reservation %s") % resv_id)
+
+        for usage_id, (until_refresh, refresh_id) in countdowns.items():
+            record = usage_tab.records[usage_id]
+            if (until_refresh != record['until_refresh'] or
+                    refresh_id != record['refresh_id']):
+                self._update(context, models.Usage, usage_id,
+                             until_refresh=until_refresh,
+                             refresh_id=refresh_id)
+
+        reserved_items = [self._create(context, models.ReservedItem,
+                                       reservation_id=resv_id,
+                                       resource_id=res_id,
+                                       usage_id=usage_id, delta=delta)
+                          for res_id, usage_id, delta in items]
+        for usage_id, incr in increments.items():
+            self._adjust_usage(context, usage_tab.records[usage_id], 0, incr)
+
+        return reserved_items
+
+    def commit_deltas(self, context, items):
+        """
+        Commit amounts of several resources immediately, without
+        making a reservation.  This is intended for requests which
+        are committed as soon as they are approved, typically
+        decrements such as destroying an instance.  Each delta is
+        added directly to the amount used on its usage, and to the
+        aggregate usage for the usage of a service instance; no
+        reservation or reserved items are created.  Quota limits are
+        not checked.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of (usage, delta) tuples.  The usage
+                      may be either a ``Usage`` object or a UUID of
+                      an existing usage.  The delta may be positive or
+                      negative.
+        """
+
+        # Write out pending changes first, so they do not overwrite
+        # the amounts changed here when they are flushed
+        self.flush(context)
+
+        usage_tab = self._tables[models.Usage]
+
+        # Sum up the deltas for each usage and its aggregate
+        deltas = {}
+        for usage, delta in items:
+            usage_id = _get_id(usage)
+            if usage_id not in usage_tab.records:
+                raise KeyError(_("No matching Usage: %s") % usage_id)
+
+            aggregate_id = usage_tab.records[usage_id]['aggregate_id']
+            for target in (usage_id, aggregate_id):
+                if target and delta:
+                    deltas[target] = deltas.get(target, 0) + delta
+
+        for usage_id, delta in deltas.items():
+            self._adjust_usage(context, usage_tab.records[usage_id], delta,
+                               0)
+
+    def get_reservation(self, context, id, hints=None):
+        """
+        Look up a specific reservation by id.
+
+        :param context: The current context for accessing the
+                        database.
+        :param id: The ID of the reservation to look up.
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        Note: if no matching reservation can be found, a KeyError will
+        be raised.
+
+        :returns: An instance of ``boson.db.models.Reservation``.
+        """
+
+        return self._wrap(context, models.Reservation,
+                          self._tables[models.Reservation].records.get(id))
+
+    def expire_reservations(self, context):
+        """
+        Rolls back all expired reservations.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of reservations rolled back.
+        """
+
+        # Write out pending changes first, so they do not overwrite
+        # the amounts changed here when they are flushed
+        self.flush(context)
+
+        resv_tab = self._tables[models.Reservation]
+        item_tab = self._tables[models.ReservedItem]
+        usage_tab = self._tables[models.Usage]
+
+        now = timeutils.utcnow()
+        expired = [record['id'] for record in resv_tab.records.values()
+                   if record['expire'] < now]
+
+        for resv_id in expired:
+            for item in item_tab.children('reservation_id', resv_id):
+                # Only positive reservations are counted in the usage
+                if item['delta'] > 0:
+                    usage = usage_tab.records[item['usage_id']]
+                    for target in (usage['id'], usage['aggregate_id']):
+                        if target:
+                            self._adjust_usage(context,
+                                               usage_tab.records[target],
+                                               0, -item['delta'])
+
+                self._remove(context, models.ReservedItem, item['id'])
+            self._remove(context, models.Reservation, resv_id)
+            self._identity_map(context).pop((models.Reservation, resv_id),
+                                            None)
+
+        return len(expired)
+
+    def _identity_map(self, context):
+        """
+        Called to obtain the identity map of the session: a
+        dictionary, which should hold its values weakly, mapping
+        tuples of a model class and an ID to the model objects
+        constructed in the session.  Entries must be discarded when
+        the database objects are deleted, or when the transaction
+        creating them is rolled back.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        return self._get_session(context).models
+
+    def _lazy_get(self, context, base_obj, field, hints, klass):
+        """
+        Called to obtain the given field from the base database
+        object.  Used to resolve cross-references to other database
+        objects.
+
+        :param context: The current context for accessing the
+                        database.
+        :param base_obj: The underlying database object to retrieve
+                         the field from.
+        :param field: The name of the field to retrieve.
+        :param hints: An object expressing hints to the underlying
+                      database system.  This object will have been
+                      passed to the model class constructor by the
+                      underlying database system.
+        :param klass: The model class that is expected to be returned
+                      from ``lazy_get()``.
+
+        :returns: An instance of ``klass``.
+        """
+
+        id = getattr(base_obj, field)
+        if id is None:
+            return None
+
+        return self._wrap(context, klass, self._tables[klass].records.get(id))
+
+    def _lazy_get_list(self, context, base_obj, field, hints, klass):
+        """
+        Called to obtain the given field from the base database
+        object.  Used to resolve cross-references to lists of other
+        database objects.
+
+        :param context: The current context for accessing the
+                        database.
+        :param base_obj: The underlying database object to retrieve
+                         the field from.
+        :param field: The name of the field to retrieve.
+        :param hints: An object expressing hints to the underlying
+                      database system.  This object will have been
+                      passed to the model class constructor by the
+                      underlying database system.
+        :param klass: The model class that is expected to be returned
+                      from ``lazy_get_list()``.
+
+        :returns: A list of instances of ``klass``.
+        """
+
+        backref = _BACKREFS[(base_obj._klass, field)]
+
+        return [self._wrap(context, klass, record)
+                for record in self._tables[klass].children(backref,
+                                                           base_obj.id)]
+
+    def _save(self, context, base_obj):
+        """
+        Called to update the underlying database with the changes made
+        to a base database object.
+
+        :param context: The current context for accessing the
+                        database.
+        :param base_obj: The underlying database object to save to the
+                         database.
+        """
+
+        # Within a transaction, the changes are written when the
+        # session is flushed, so that all the changes made to a row
+        # are written together
+        sess = self._get_session(context)
+        if not sess.marks:
+            self._write(context, base_obj)
+        elif not base_obj._pending:
+            base_obj._pending = True
+            sess.pending.append(base_obj)
+
+    def _delete(self, context, base_obj):
+        """
+        Called to delete the underlying base database object from the
+        database.
+
+        :param context: The current context for accessing the
+                        database.
+        :param base_obj: The underlying database object to delete from
+                         the database.
+        """
+
+        klass = base_obj._klass
+
+        # As in the database, an object cannot be deleted while other
+        # objects must reference it; the usages of service instances
+        # are merely detached from a deleted aggregate usage
+        fields = set(field for (parent, _ref), field in _BACKREFS.items()
+                     if parent is klass)
+        children = [(table.klass, field, child)
+                    for table in self._tables.values()
+                    for field in fields
+                    for child in table.children(field, base_obj.id)]
+        if any(field not in _NULLABLE_REFS
+               for _child_klass, field, _child in children):
+            raise exceptions.InUse(klass=klass.__name__)
+
+        sess = self._get_session(context)
+        if base_obj._pending:
+            base_obj._pending = False
+            sess.pending.remove(base_obj)
+
+        for child_klass, field, child in children:
+            self._update(context, child_klass, child['id'], **{field: None})
+
+        old = self._tables[klass].records[base_obj.id]
+        sess.models.pop((klass, base_obj.id), None)
+
+        # Take the usage of a service instance out of the aggregate
+        # usage
+        if klass is models.Usage and old['aggregate_id']:
+            self._adjust_usage(context,
+                               self._tables[klass].records[
+                                   old['aggregate_id']],
+                               -old['used'], -old['reserved'])
+
+        self._remove(context, klass, base_obj.id)
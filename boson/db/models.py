@@ -19,6 +19,7 @@ import sys
 
 import metatools
 
+from boson import exceptions
 from boson.openstack.common.gettextutils import _
 
 
@@ -37,6 +38,10 @@ class BaseRef(object):
     classes that correspond to instances of other model classes.  The
     BaseRef subclasses control how to obtain those instances from the
     database API.
+
+    References are installed in the model class as descriptors; the
+    referenced object is retrieved on first access and cached in a
+    slot of the model object.
     """
 
     def __init__(self, field, klass):
@@ -51,9 +56,30 @@ class BaseRef(object):
         """
 
         self.field = field
+        self.cache_slot = '_ref_%s' % field
         self._klass_name = klass
         self._klass = None
 
+    def __get__(self, model, owner):
+        """
+        Retrieve the referenced object, from the cache if possible.
+
+        :param model: The instance of the model class, or ``None`` if
+                      the reference is being retrieved from the model
+                      class itself.
+        :param owner: The model class.
+        """
+
+        if model is None:
+            return self
+
+        try:
+            return getattr(model, self.cache_slot)
+        except AttributeError:
+            value = self(model)
+            object.__setattr__(model, self.cache_slot, value)
+            return value
+
     @property
     def klass(self):
         """
@@ -97,6 +123,10 @@ class Ref(BaseRef):
         :param model: The instance of the model class.
         """
 
+        # Read the ID through the model object, so that it knows which
+        # ID the cached object was retrieved for
+        getattr(model, self.base_field)
+
         return model._dbapi._lazy_get(model._context, model._base_obj,
                                       self.base_field, model._hints,
                                       self.klass)
@@ -124,7 +154,12 @@ class BaseModelMeta(metatools.MetaClass):
     """
     Metaclass for class BaseModel.  Uses the metatools package to
     allow for inheritance of field names, and translates lists of
-    references into the dictionary needed by BaseModel.__getattr__().
+    references into the dictionary needed by BaseModel.__getitem__().
+
+    Model objects have no instance dictionary.  The value of each
+    simple field is kept in a slot named for the field, so reading a
+    field is a plain attribute lookup; each reference is installed as
+    a descriptor, with a slot for caching the referenced object.
     """
 
     def __new__(mcs, name, bases, namespace):
@@ -132,21 +167,32 @@ class BaseModelMeta(metatools.MetaClass):
         Create a new BaseModel subclass.
         """
 
-        # Set up _refs as a dictionary
+        # Set up _refs as a dictionary, installing the references as
+        # descriptors
         decl_refs = namespace.get('_refs', [])
         refs = {}
         for ref in decl_refs:
             refs[ref.field] = ref
+            namespace[ref.field] = ref
 
         # Update the namespace appropriately
         namespace['_refs'] = refs
         namespace.setdefault('_fields', set())
+        decl_fields = set(namespace['_fields'])
 
         # Inherit _fields and _refs
         for base in mcs.iter_bases(bases):
             mcs.inherit_set(base, namespace, '_fields')
+            decl_fields -= set(getattr(base, '_fields', ()))
             mcs.inherit_dict(base, namespace, '_refs')
 
+        # Allocate slots for the fields and reference caches declared
+        # by this class; inherited ones already have slots
+        slots = list(namespace.get('__slots__', ()))
+        slots.extend(sorted(decl_fields))
+        slots.extend(sorted(ref.cache_slot for ref in decl_refs))
+        namespace['__slots__'] = tuple(slots)
+
         return super(BaseModelMeta, mcs).__new__(mcs, name, bases, namespace)
 
 
@@ -164,9 +210,18 @@ class BaseModel(object):
     both _fields and _refs are subject to inheritance behavior; that
     is, BaseModel declares the 'created_at' and 'updated_at' fields,
     which will automatically be declared for all subclasses.
+
+    Field values are read from the underlying database object when
+    they are first accessed, so fields which are never used cost
+    nothing to construct.  Setting a field saves the change through
+    the database API.
+    Within a transaction, the database API may defer writing changes
+    until the transaction is committed or explicitly flushed, writing
+    all the changes made to an object together.
     """
 
     __metaclass__ = BaseModelMeta
+    __slots__ = ('_context', '_dbapi', '_base_obj', '_hints', '__weakref__')
 
     _fields = set(['created_at', 'updated_at', 'id'])
     _refs = []
@@ -182,7 +237,8 @@ class BaseModel(object):
                          database API.  It is assumed that all
                          declared fields (listed in the _fields class
                          attribute) will be accessible as attributes
-                         of this object.
+                         of this object.  The ID is read immediately;
+                         other fields are read when first accessed.
         :param hints: An object constructed by the underlying database
                       API that can be used by that API to remember
                       information about what database objects have
@@ -190,42 +246,85 @@ class BaseModel(object):
                       references.
         """
 
-        self._context = context
-        self._dbapi = dbapi
-        self._base_obj = base_obj
-        self._values = dict((fld, getattr(base_obj, fld))
-                            for fld in self._fields)
-        self._cache = {}
-        self._hints = hints
+        setter = object.__setattr__
+        setter(self, '_context', context)
+        setter(self, '_dbapi', dbapi)
+        setter(self, '_base_obj', base_obj)
+        setter(self, '_hints', hints)
+        setter(self, 'id', base_obj.id)
+
+    def _refresh(self, hints=None):
+        """
+        Bring the field values up to date with the base object, when
+        the model object is retrieved again.  Field values already
+        read are discarded, to be read again when next accessed.
+        Cached lists of referenced objects are discarded, as are
+        cached referenced objects whose IDs may have changed.
+
+        :param hints: If not ``None``, replaces the hints object.
+        """
+
+        base_obj = self._base_obj
+        unchanged = set()
+        for fld in self._fields:
+            # The ID never changes
+            if fld == 'id':
+                continue
+
+            # Only look at the slot; don't read the field
+            try:
+                value = object.__getattribute__(self, fld)
+            except AttributeError:
+                continue
+
+            object.__delattr__(self, fld)
+            if fld[-3:] == '_id' and value == getattr(base_obj, fld):
+                unchanged.add(fld[:-3])
+
+        for name in self._refs:
+            if name not in unchanged:
+                self._uncache(name)
+
+        if hints is not None:
+            object.__setattr__(self, '_hints', hints)
+
+    def _uncache(self, name):
+        """
+        Discard the cached object for a reference.
+
+        :param name: The name of the reference.
+        """
+
+        try:
+            object.__delattr__(self, self._refs[name].cache_slot)
+        except (KeyError, AttributeError):
+            pass
 
     def __getitem__(self, name):
         """
         Retrieve the value of a given field (item syntax).
         """
 
-        # For simple values, return the value
-        if name in self._fields:
-            return self._values[name]
-
-        # For reference values, return the referenced object
-        elif name in self._refs:
-            if name not in self._cache:
-                self._cache[name] = self._refs[name](self)
-            return self._cache[name]
+        # Simple values and references are both attributes
+        if name in self._fields or name in self._refs:
+            return getattr(self, name)
 
         # OK, don't know that name
         raise KeyError(name)
 
     def __getattr__(self, name):
         """
-        Retrieve the value of a given field (attribute syntax).
+        Called for fields which have not yet been read from the base
+        object, and for attributes which are not fields or
+        references.
         """
 
-        try:
-            return self.__getitem__(name)
-        except KeyError:
-            # OK, don't know that attribute
-            raise AttributeError(_('cannot get %r attribute') % name)
+        if name in self._fields:
+            value = getattr(self._base_obj, name)
+            object.__setattr__(self, name, value)
+            return value
+
+        raise AttributeError(_('cannot get %r attribute') % name)
 
     def __setitem__(self, name, value):
         """
@@ -237,12 +336,12 @@ class BaseModel(object):
         if name in self._fields:
             setattr(self._base_obj, name, value)
             self._dbapi._save(self._context, self._base_obj)
-            self._values[name] = value
+            object.__setattr__(self, name, value)
 
             # If there's a corresponding reference, invalidate the
             # corresponding cache entry
             if name[-3:] == '_id':
-                self._cache.pop(name[:-3], None)
+                self._uncache(name[:-3])
 
             return
 
@@ -255,8 +354,8 @@ class BaseModel(object):
             if isinstance(ref, Ref):
                 setattr(self._base_obj, ref.base_field, value.id)
                 self._dbapi._save(self._context, self._base_obj)
-                self._values[ref.base_field] = value.id
-                self._cache[name] = value
+                object.__setattr__(self, ref.base_field, value.id)
+                object.__setattr__(self, ref.cache_slot, value)
                 return
 
         # Can't set that field
@@ -308,7 +407,7 @@ class BaseModel(object):
             if name in self._fields:
                 # Make sure we didn't have a duplicate
                 if name in values:
-                    raise AmbiguousFieldUpdate(field=name)
+                    raise exceptions.AmbiguousFieldUpdate(field=name)
 
                 # Save the value we're going to set
                 values[name] = value
@@ -328,13 +427,14 @@ class BaseModel(object):
                 if isinstance(ref, Ref):
                     # Make sure we didn't have a duplicate
                     if ref.base_field in values:
-                        raise AmbiguousFieldUpdate(field=ref.base_field)
+                        raise exceptions.AmbiguousFieldUpdate(
+                            field=ref.base_field)
 
                     # Save the value we're going to set
-                    values[name] = value.id  # sanity-checks the value, too
+                    values[ref.base_field] = value.id  # sanity-checks
 
                     # Mark the cache for update
-                    cache[name] = value
+                    cache[ref.cache_slot] = value
 
                     continue
 
@@ -349,13 +449,13 @@ class BaseModel(object):
         # Save it...
         self._dbapi._save(self._context, self._base_obj)
 
-        # Install the changes to the values and the cache
-        self._values.update(values)
-        self._cache.update(cache)
-
         # Handle cache invalidations
         for name in invalidate:
-            self._cache.pop(name, None)
+            self._uncache(name)
+
+        # Install the changes to the values and the cache
+        for key, value in values.items() + cache.items():
+            object.__setattr__(self, key, value)
 
     def delete(self):
         """
@@ -556,6 +656,28 @@ class Usage(BaseModel):
         only refreshed once, and also to mark a usage record as
         currently being refreshed.
 
+    *instance*
+        The name of the service instance the usage is tracked for,
+        e.g., "chicago" or "london" for a nova service deployed in two
+        regions.  An empty string designates the aggregate usage, which
+        tracks the total usage across all service instances.
+
+    *aggregate_id*
+        For the usage of a service instance, the ID of the aggregate
+        usage.  The *used* and *reserved* fields of the aggregate
+        usage are kept equal to the sums of those of the instance
+        usages (plus any amounts recorded directly on the aggregate
+        usage), so quota enforcement only needs to consult one usage
+        record.
+
+    *aggregate*
+        The Usage object corresponding to *aggregate_id*, or ``None``
+        for an aggregate usage.
+
+    *instances*
+        For an aggregate usage, a list of the Usage objects of the
+        service instances.
+
     *reserved_items*
         A list of ReservedItem objects representing the currently
         reserved items counted by this usage.  (Note that reserved
@@ -565,9 +687,12 @@ class Usage(BaseModel):
     """
 
     _fields = set(['resource_id', 'parameter_data', 'auth_data', 'used',
-                   'reserved', 'until_refresh', 'refresh_id'])
+                   'reserved', 'until_refresh', 'refresh_id', 'instance',
+                   'aggregate_id'])
     _refs = [
         Ref('resource', 'Resource'),
+        Ref('aggregate', 'Usage'),
+        ListRef('instances', 'Usage'),
         ListRef('reserved_items', 'ReservedItem'),
     ]
 
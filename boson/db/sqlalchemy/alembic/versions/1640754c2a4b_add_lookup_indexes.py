@@ -0,0 +1,65 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add lookup indexes and uniqueness constraints
+
+Revision ID: 1640754c2a4b
+Revises: 1f22e3c5ff66
+Create Date: 2012-11-05 14:12:09.441327
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1640754c2a4b'
+down_revision = '1f22e3c5ff66'
+
+from alembic import op
+
+
+def upgrade():
+    """
+    Create the indexes.  The uniqueness constraints are created as
+    unique indexes, which all supported databases can add to an
+    existing table.  Usages and quotas are made unique by a later
+    revision, which indexes digests of their serialized data columns;
+    those columns are too long to index directly.
+    """
+
+    op.create_index('uniq_services_name', 'services', ['name'],
+                    unique=True)
+    op.create_index('uniq_categories_service_id_name', 'categories',
+                    ['service_id', 'name'], unique=True)
+    op.create_index('uniq_resources_service_id_name', 'resources',
+                    ['service_id', 'name'], unique=True)
+    op.create_index('ix_reservations_expire', 'reservations', ['expire'])
+    op.create_index('ix_reserved_items_reservation_id', 'reserved_items',
+                    ['reservation_id'])
+    op.create_index('ix_reserved_items_usage_id', 'reserved_items',
+                    ['usage_id'])
+
+
+def downgrade():
+    """
+    Drop the indexes.
+    """
+
+    op.drop_index('ix_reserved_items_usage_id', 'reserved_items')
+    op.drop_index('ix_reserved_items_reservation_id', 'reserved_items')
+    op.drop_index('ix_reservations_expire', 'reservations')
+    op.drop_index('uniq_resources_service_id_name', 'resources')
+    op.drop_index('uniq_categories_service_id_name', 'categories')
+    op.drop_index('uniq_services_name', 'services')
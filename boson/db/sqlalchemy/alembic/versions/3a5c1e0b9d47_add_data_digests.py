@@ -0,0 +1,106 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Add digest columns for serialized data
+
+Revision ID: 3a5c1e0b9d47
+Revises: 1640754c2a4b
+Create Date: 2012-11-07 10:48:31.207714
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a5c1e0b9d47'
+down_revision = '1640754c2a4b'
+
+from alembic import op
+import sqlalchemy as sa
+
+from boson import utils
+
+
+def _digest(value):
+    """
+    Compute the digest of a serialized data column value.
+    """
+
+    if value is None:
+        return None
+
+    return utils.dict_digest(utils.dict_deserialize(value))
+
+
+def _fill_digests(table_name, columns):
+    """
+    Compute the digest columns for the existing rows of a table.
+
+    :param table_name: The name of the table.
+    :param columns: A dictionary mapping the serialized data columns
+                    to the corresponding digest columns.
+    """
+
+    table = sa.sql.table(table_name, sa.sql.column('id'),
+                         *[sa.sql.column(c) for c in
+                           columns.keys() + columns.values()])
+    bind = op.get_bind()
+
+    for row in bind.execute(sa.select([table.c.id] +
+                                      [table.c[c] for c in columns])):
+        values = dict((digest_col, _digest(row[data_col]))
+                      for data_col, digest_col in columns.items())
+        bind.execute(table.update().
+                     where(table.c.id == row['id']).
+                     values(**values))
+
+
+def upgrade():
+    """
+    Add the digest columns, and make usages and quotas unique by
+    indexing them.
+    """
+
+    op.add_column('usages', sa.Column('parameter_digest', sa.String(40)))
+    op.add_column('usages', sa.Column('auth_digest', sa.String(40)))
+    op.add_column('quotas', sa.Column('auth_digest', sa.String(40)))
+
+    _fill_digests('usages', {
+        'parameter_data': 'parameter_digest',
+        'auth_data': 'auth_digest',
+    })
+    _fill_digests('quotas', {
+        'auth_data': 'auth_digest',
+    })
+
+    op.create_index('uniq_usages_resource_id_parameter_digest_auth_digest',
+                    'usages', ['resource_id', 'parameter_digest',
+                               'auth_digest'], unique=True)
+    op.create_index('uniq_quotas_resource_id_auth_digest', 'quotas',
+                    ['resource_id', 'auth_digest'], unique=True)
+
+
+def downgrade():
+    """
+    Drop the digest columns and their indexes.
+    """
+
+    op.drop_index('uniq_quotas_resource_id_auth_digest', 'quotas')
+    op.drop_index('uniq_usages_resource_id_parameter_digest_auth_digest',
+                  'usages')
+
+    op.drop_column('quotas', 'auth_digest')
+    op.drop_column('usages', 'auth_digest')
+    op.drop_column('usages', 'parameter_digest')
@@ -0,0 +1,111 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Store field sets as JSON instead of pickles
+
+Revision ID: 4b0e7d2f6c18
+Revises: 3a5c1e0b9d47
+Create Date: 2012-11-09 16:05:52.873140
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b0e7d2f6c18'
+down_revision = '3a5c1e0b9d47'
+
+import cPickle
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Maps each table to its field set columns; the value is True for
+# columns containing a list of field sets
+FIELD_SET_COLUMNS = {
+    'services': {'auth_fields': False},
+    'categories': {'usage_fset': False, 'quota_fsets': True},
+    'resources': {'parameters': False},
+}
+
+
+def _pickle_to_json(value, nested):
+    """
+    Convert a pickled field set, or list of field sets, to JSON.
+    """
+
+    value = cPickle.loads(str(value))
+    if nested:
+        value = [sorted(fset) for fset in value]
+    else:
+        value = sorted(value)
+
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _json_to_pickle(value, nested):
+    """
+    Convert a JSON field set, or list of field sets, to a pickle.
+    """
+
+    value = json.loads(value)
+    if nested:
+        value = [set(fset) for fset in value]
+    else:
+        value = set(value)
+
+    return cPickle.dumps(value)
+
+
+def _convert(convert):
+    """
+    Convert all the field set columns of all the existing rows.
+
+    :param convert: The function to convert a single column value.
+    """
+
+    bind = op.get_bind()
+
+    for table_name, columns in FIELD_SET_COLUMNS.items():
+        table = sa.sql.table(table_name, sa.sql.column('id'),
+                             *[sa.sql.column(c) for c in columns])
+
+        for row in bind.execute(sa.select([table.c.id] +
+                                          [table.c[c] for c in columns])):
+            values = dict((col, convert(row[col], nested))
+                          for col, nested in columns.items()
+                          if row[col] is not None)
+            if values:
+                bind.execute(table.update().
+                             where(table.c.id == row['id']).
+                             values(**values))
+
+
+def upgrade():
+    """
+    Convert the field sets from pickles to JSON.
+    """
+
+    _convert(_pickle_to_json)
+
+
+def downgrade():
+    """
+    Convert the field sets from JSON back to pickles.
+    """
+
+    _convert(_json_to_pickle)
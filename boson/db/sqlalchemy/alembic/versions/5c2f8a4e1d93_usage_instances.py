@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Track usages per service instance
+
+Revision ID: 5c2f8a4e1d93
+Revises: 4b0e7d2f6c18
+Create Date: 2012-11-14 15:02:47.384120
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2f8a4e1d93'
+down_revision = '4b0e7d2f6c18'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Add the service instance and aggregate usage columns.  Existing
+    usages become aggregate usages.  MySQL indexes the aggregate usage
+    column itself when creating its foreign key, so it is only
+    indexed explicitly on other databases.
+    """
+
+    with op.batch_alter_table('usages') as batch_op:
+        batch_op.add_column(sa.Column('instance', sa.String(255),
+                                      nullable=False, server_default=''))
+        batch_op.add_column(sa.Column('aggregate_id', sa.String(36)))
+        batch_op.create_foreign_key('fk_usages_aggregate_id', 'usages',
+                                    ['aggregate_id'], ['id'])
+    if op.get_bind().dialect.name != 'mysql':
+        op.create_index('ix_usages_aggregate_id', 'usages', ['aggregate_id'])
+
+    op.drop_index('uniq_usages_resource_id_parameter_digest_auth_digest',
+                  'usages')
+    op.create_index('uniq_usages_resource_id_parameter_digest_auth_digest_'
+                    'instance', 'usages',
+                    ['resource_id', 'parameter_digest', 'auth_digest',
+                     'instance'], unique=True)
+
+
+def downgrade():
+    """
+    Drop the usages of service instances, leaving the aggregate
+    usages, and drop the service instance and aggregate usage
+    columns.  Items reserved against the usages of service instances
+    are moved to the aggregate usages, which already count them.
+    """
+
+    usages = sa.sql.table('usages', sa.sql.column('id'),
+                          sa.sql.column('instance'),
+                          sa.sql.column('aggregate_id'))
+    items = sa.sql.table('reserved_items', sa.sql.column('usage_id'))
+    instance_ids = sa.select([usages.c.id]).where(usages.c.instance != '')
+    aggregate_id = sa.select([usages.c.aggregate_id]).\
+        where(usages.c.id == items.c.usage_id).\
+        as_scalar()
+    op.execute(items.update().
+               where(items.c.usage_id.in_(instance_ids)).
+               values(usage_id=aggregate_id))
+    op.execute(usages.delete().where(usages.c.instance != ''))
+
+    op.drop_index('uniq_usages_resource_id_parameter_digest_auth_digest_'
+                  'instance', 'usages')
+    op.create_index('uniq_usages_resource_id_parameter_digest_auth_digest',
+                    'usages', ['resource_id', 'parameter_digest',
+                               'auth_digest'], unique=True)
+
+    if op.get_bind().dialect.name != 'mysql':
+        op.drop_index('ix_usages_aggregate_id', 'usages')
+    with op.batch_alter_table('usages') as batch_op:
+        batch_op.drop_constraint('fk_usages_aggregate_id',
+                                 type_='foreignkey')
+        batch_op.drop_column('aggregate_id')
+        batch_op.drop_column('instance')
@@ -15,12 +15,619 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import weakref
+
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import orm
+
 from boson.db import api
 from boson.db import models
+from boson.db.sqlalchemy import cache
 from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import session
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import timeutils
+from boson import utils
+
+
+sql_api_opts = [
+    cfg.IntOpt('reservation_expire_batch_size',
+               default=1000,
+               help='Maximum number of expired reservations to roll back '
+                    'in a single transaction'),
+    cfg.IntOpt('lazy_load_batch_size',
+               default=500,
+               help='Maximum number of referenced objects to load in a '
+                    'single query when a reference is first accessed on '
+                    'one of a list of objects'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(sql_api_opts)
+
+# Services, categories and resources are shared by all sessions in the
+# process through the registry cache, and quotas through the quota index
+_REGISTRY = cache.RegistryCache()
+_QUOTAS = cache.QuotaIndex()
+
+
+def _get_id(obj):
+    """
+    Helper function to convert an argument which may be either a
+    ``boson.db.models`` object or a UUID into the UUID.
+    """
+
+    if isinstance(obj, models.BaseModel):
+        return obj.id
+    return obj
+
+
+def _history_delta(obj, attr):
+    """
+    Helper function to compute the change made to a numeric attribute
+    of a SQLAlchemy model object since it was loaded.
+
+    :param obj: The SQLAlchemy model object.
+    :param attr: The name of the attribute.
+    """
+
+    hist = sa.inspect(obj).attrs[attr].history
+    if not hist.added or not hist.deleted:
+        return 0
+
+    return (hist.added[0] or 0) - (hist.deleted[0] or 0)
+
+
+def _paginate(query, sa_model, marker, limit):
+    """
+    Restrict a query to a page of objects.  If a marker or limit is
+    given, the objects are ordered by ID, and only those with IDs
+    greater than that of the marker are selected.
+
+    :param query: The query to restrict.
+    :param sa_model: The SQLAlchemy model class being queried.
+    :param marker: The object or ID of the object preceding the page,
+                   or ``None``.
+    :param limit: The maximum number of objects in the page, or
+                  ``None``.
+    """
+
+    if marker is None and limit is None:
+        return query
+
+    query = query.order_by(sa_model.id)
+    if marker is not None:
+        query = query.filter(sa_model.id > _get_id(marker))
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+
+def _sub_hints(hints, field):
+    """
+    Helper function to select the parsed hints tree applicable to the
+    objects referenced by a given field.
+
+    :param hints: The parsed hints tree, or ``None``.
+    :param field: The name of the reference field.
+    """
+
+    if not hints or field not in hints:
+        return {}
+
+    return hints[field][1]
+
+
+def _load_only(sa_model, fields):
+    """
+    Construct a query option which loads only the columns for the
+    given fields of a SQLAlchemy model class, along with the ID and
+    the IDs of referenced objects.  The other columns are loaded when
+    first accessed.  Names which are not column fields are ignored.
+
+    :param sa_model: The SQLAlchemy model class being queried.
+    :param fields: A list of the names of the fields to load.
+    """
+
+    # Map the field names to the column attributes, including those
+    # of the serialized dictionaries
+    columns = dict((prop.key, prop.key)
+                   for prop in sa.inspect(sa_model).column_attrs)
+    for name, attr in vars(sa_model).items():
+        if isinstance(attr, sa_models.DictSerialized):
+            columns[name] = attr.column_attr
+
+    attrs = set(key for key in columns if key == 'id' or key[-3:] == '_id')
+    attrs.update(columns[field] for field in fields if field in columns)
+
+    return orm.load_only(*sorted(attrs))
+
+
+def _eager_options(klass, hints, prefix=''):
+    """
+    Helper function to translate a tree of parsed hints, as returned
+    by ``hints_parser()``, into a list of SQLAlchemy loader options.
+    Single references are loaded with a join; list references are
+    loaded with a single additional query per level, which avoids
+    multiplying the rows of the parent query.
+
+    :param klass: The ``boson.db.models`` class the hints apply to.
+    :param hints: The parsed hints tree.
+    :param prefix: The relationship path leading to ``klass``.
+    """
+
+    options = []
+    for field, (sub_klass, sub_hints) in hints.items():
+        path = prefix + field
+        if isinstance(klass._refs[field], models.ListRef):
+            options.append(orm.subqueryload(path))
+        else:
+            options.append(orm.joinedload(path))
+
+        options.extend(_eager_options(sub_klass, sub_hints, path + '.'))
+
+    return options
+
+
+class _DataMatcher(object):
+    """
+    Filters a query on data dictionaries stored in ``DictSerialized``
+    columns.  The query is restricted using the indexed digest
+    columns, and the full values of the selected objects are then
+    compared, which guards against digest collisions.
+    """
+
+    def __init__(self, sa_model, **fields):
+        """
+        Initialize a ``_DataMatcher``.
+
+        :param sa_model: The SQLAlchemy model class being queried.
+
+        All other keyword arguments map the names of
+        ``DictSerialized`` columns to the desired dictionaries; those
+        with a value of ``None`` are ignored.
+        """
+
+        self.sa_model = sa_model
+        self.fields = dict((k, v) for k, v in fields.items()
+                           if v is not None)
+
+    def __call__(self, obj):
+        """
+        Confirm that an object matches the desired dictionaries.
+        """
+
+        for field, value in self.fields.items():
+            if getattr(obj, field) != value:
+                return False
+
+        return True
+
+    def __nonzero__(self):
+        """
+        Returns ``True`` if there are any dictionaries to match.
+        """
+
+        return bool(self.fields)
+
+    def filter(self, query):
+        """
+        Restrict a query to rows with the digests of the desired
+        dictionaries.
+
+        :param query: The query to restrict.
+        """
+
+        for field, value in self.fields.items():
+            digest_col = getattr(self.sa_model,
+                                 sa_models.DIGEST_COLUMNS[field])
+            query = query.filter(digest_col == utils.dict_digest(value))
+
+        return query
 
 
 class API(api.API):
+    """
+    SQLAlchemy implementation of the database API.  A single session
+    is allocated for each context and reused for all database
+    operations performed on behalf of that context.
+    """
+
+    def _query(self, context, sa_model):
+        """
+        Construct a query for the given SQLAlchemy model class, using
+        the session associated with the context.
+
+        :param context: The current context for accessing the
+                        database.
+        :param sa_model: The SQLAlchemy model class to query.
+        """
+
+        return self._get_session(context).query(sa_model)
+
+    def _get(self, context, klass, query, hints, match=None, id=None):
+        """
+        Retrieve a single object from the database.  Raises a
+        KeyError if no matching object is found.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param query: The query selecting the object.
+        :param hints: The hints passed by the caller.
+        :param match: An optional ``_DataMatcher`` which objects
+                      selected by the query must also satisfy.
+        :param id: The ID of the object, if the query selects it by
+                   ID.  If no hints are given, the object is then
+                   taken from the identity map of the session when
+                   possible, without issuing the query.
+        """
+
+        if id is not None and not hints:
+            model = self._cached_model(context, klass, id)
+            if model is not None:
+                return model
+
+        hints = self.hints_parser(klass, hints)
+
+        query = query.options(*_eager_options(klass, hints))
+        if not match:
+            obj = query.first()
+        else:
+            obj = next((obj for obj in query if match(obj)), None)
+        if obj is None:
+            raise KeyError(_("No matching %s") % klass.__name__)
+
+        return self._model(context, klass, obj, hints)
+
+    def _get_registry(self, context, klass, sa_model, query, hints, **key):
+        """
+        Retrieve a single registry object--a service, category or
+        resource--from the registry cache, falling back to the
+        database.  Raises a KeyError if no matching object is found.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param sa_model: The SQLAlchemy model class to look up.
+        :param query: The query selecting the object.
+        :param hints: The hints passed by the caller.  Objects are
+                      only taken from the cache if no hints are
+                      given, since the cache does not contain the
+                      referenced objects.
+
+        All other keyword arguments identify the object within the
+        cache, and must be equivalent to the query.
+        """
+
+        sess = self._get_session(context)
+        dirty = sess.info.get('registry_dirty')
+
+        if not hints:
+            if key.keys() == ['id']:
+                model = self._cached_model(context, klass, key['id'])
+                if model is not None:
+                    return model
+
+            snap = None if dirty else _REGISTRY.get(sa_model, **key)
+            if snap is not None:
+                return self._model(context, klass,
+                                   self._attach(sess, snap))
+
+        generation = _REGISTRY.generation
+        result = self._get(context, klass, query, hints)
+
+        # Don't publish objects this session may have changed before
+        # they are committed
+        if not dirty:
+            _REGISTRY.put(result._base_obj, generation)
+
+        return result
+
+    def _attach(self, sess, snap):
+        """
+        Obtain the instance of a cached registry object belonging to a
+        session, without querying the database.
+
+        :param sess: The session.
+        :param snap: The cached snapshot of the object.
+        """
+
+        # An instance already in the session takes precedence, since
+        # it may have been changed
+        obj = sess.identity_map.get(sa.inspect(snap).key)
+        if obj is None:
+            obj = sess.merge(snap, load=False)
+
+        return obj
+
+    def _changed(self, sess, obj, deleted=False):
+        """
+        Update the registry cache and the quota index for an object
+        which is being changed.  The registry cache is invalidated if
+        a service, category or resource is changed; it is invalidated
+        again once the session's transaction ends, since other
+        sessions may have cached the old object in the meantime.
+        Changed quotas are dropped from the quota index, and written
+        to it once the session's transaction is committed.
+
+        :param sess: The session making the change.
+        :param obj: The SQLAlchemy model object being changed.
+        :param deleted: If ``True``, the object is being deleted.
+        """
+
+        if type(obj) in _REGISTRY:
+            _REGISTRY.invalidate()
+            sess.info['registry_dirty'] = True
+        elif isinstance(obj, sa_models.Quota):
+            _QUOTAS.discard(cache.quota_keys(obj))
+            sess.info.setdefault('quota_dirty', []).append((obj, deleted))
+
+    def _settle(self, sess, committed):
+        """
+        Update the registry cache and the quota index after the end of
+        a transaction which changed registry objects or quotas.
+
+        :param sess: The session.
+        :param committed: ``True`` if the transaction was committed,
+                          ``False`` if it was rolled back.
+        """
+
+        if sess.is_active:
+            return
+
+        if sess.info.pop('registry_dirty', False):
+            _REGISTRY.invalidate()
+
+        for obj, deleted in sess.info.pop('quota_dirty', []):
+            if committed:
+                _QUOTAS.write(obj, deleted)
+            else:
+                _QUOTAS.discard(cache.quota_keys(obj))
+
+    def _adjust_aggregate(self, sess, aggregate_id, used, reserved):
+        """
+        Add amounts to the used and reserved fields of an aggregate
+        usage, in a single statement.  The caller should hold the lock
+        on the aggregate usage.
+
+        :param sess: The session.
+        :param aggregate_id: The ID of the aggregate usage.
+        :param used: The amount to add to the used field.
+        :param reserved: The amount to add to the reserved field.
+        """
+
+        if not used and not reserved:
+            return
+
+        usage_tab = sa_models.Usage.__table__
+        sess.execute(usage_tab.update().
+                     where(usage_tab.c.id == aggregate_id).
+                     values(used=usage_tab.c.used + used,
+                            reserved=usage_tab.c.reserved + reserved))
+
+        # Bring a loaded aggregate up to date without marking it as
+        # modified
+        key = sa.inspect(sa_models.Usage).\
+            identity_key_from_primary_key([aggregate_id])
+        aggregate = sess.identity_map.get(key)
+        if aggregate is not None:
+            orm.attributes.set_committed_value(aggregate, 'used',
+                                               aggregate.used + used)
+            orm.attributes.set_committed_value(aggregate, 'reserved',
+                                               aggregate.reserved + reserved)
+
+    def _lock_usages(self, sess, usage_ids, refresh=False):
+        """
+        Lock usage records, along with their aggregate usages, always
+        in ID order, so concurrent transactions cannot deadlock.
+
+        :param sess: The session.
+        :param usage_ids: The IDs of the usages, or a query selecting
+                          them.
+        :param refresh: If ``True``, usages already loaded in the
+                        session are refreshed from the locked rows.
+                        Any unflushed changes to them are lost, so
+                        the caller should flush the session first.
+
+        :returns: A list of the locked usages.
+        """
+
+        usage_tab = sa_models.Usage.__table__
+        if isinstance(usage_ids, sa.sql.ClauseElement):
+            usage_ids = [row[0] for row in sess.execute(usage_ids)]
+        usage_ids = set(usage_ids)
+        if not usage_ids:
+            return []
+
+        # The aggregate of a usage never changes, so the aggregates
+        # can be taken from the loaded usages, or looked up without a
+        # lock; the locking statement then selects its rows by
+        # primary key alone, and locks no others
+        mapper = sa.inspect(sa_models.Usage)
+        aggregate_ids = set()
+        unknown = []
+        for usage_id in usage_ids:
+            obj = sess.identity_map.get(
+                mapper.identity_key_from_primary_key([usage_id]))
+            if obj is None or 'aggregate_id' in sa.inspect(obj).unloaded:
+                unknown.append(usage_id)
+            elif obj.aggregate_id:
+                aggregate_ids.add(obj.aggregate_id)
+        if unknown:
+            aggregate_ids.update(row[0] for row in sess.execute(
+                sa.select([usage_tab.c.aggregate_id]).
+                where(sa.and_(usage_tab.c.id.in_(unknown),
+                              usage_tab.c.aggregate_id.isnot(None)))))
+
+        query = sess.query(sa_models.Usage).\
+            filter(sa_models.Usage.id.in_(sorted(usage_ids |
+                                                 aggregate_ids))).\
+            order_by(sa_models.Usage.id).\
+            with_lockmode('update')
+        if refresh:
+            query = query.populate_existing()
+
+        return query.all()
+
+    def _get_list(self, context, klass, query, hints, match=None,
+                  fields=None, marker=None, limit=None):
+        """
+        Retrieve a list of objects from the database, optionally a
+        page at a time.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param query: The query selecting the objects.
+        :param hints: The hints passed by the caller.
+        :param match: An optional ``_DataMatcher`` which objects
+                      selected by the query must also satisfy.
+        :param fields: The fields passed by the caller.  If given,
+                       only those fields, and those needed to match
+                       the objects, are loaded by the query.
+        :param marker: The marker passed by the caller.
+        :param limit: The limit passed by the caller.
+        """
+
+        hints = self.hints_parser(klass, hints)
+        sa_model = getattr(sa_models, klass.__name__)
+
+        query = query.options(*_eager_options(klass, hints))
+        if fields:
+            if match:
+                fields = list(fields) + match.fields.keys()
+            query = query.options(_load_only(sa_model, fields))
+
+        if not match or limit is None:
+            objs = [obj for obj in _paginate(query, sa_model, marker, limit)
+                    if not match or match(obj)]
+        else:
+            # The page is limited in the query, but objects failing to
+            # match are only dropped afterwards; keep reading until
+            # the page is full or the query runs out, so that only the
+            # last page comes back short
+            objs = []
+            while len(objs) < limit:
+                rows = _paginate(query, sa_model, marker, limit).all()
+                objs.extend(obj for obj in rows if match(obj))
+                if len(rows) < limit:
+                    break
+                marker = rows[-1].id
+            del objs[limit:]
+
+        self._batch(self._get_session(context), objs)
+
+        return [self._model(context, klass, obj, hints) for obj in objs]
+
+    def _batch(self, sess, objs):
+        """
+        Remember that a list of objects was retrieved together, so
+        that when a reference is first accessed on one of them, the
+        referenced objects may be loaded for all of them at once.
+
+        :param sess: The database session.
+        :param objs: The list of SQLAlchemy model objects.
+        """
+
+        if len(objs) < 2:
+            return
+
+        if 'batches' not in sess.info:
+            sess.info['batches'] = weakref.WeakKeyDictionary()
+
+        # The batch refers to the objects weakly, so that it does not
+        # keep them alive
+        batch = [weakref.ref(obj) for obj in objs]
+        for obj in objs:
+            sess.info['batches'][obj] = batch
+
+    def _load_batch(self, sess, base_obj, field, rel, sa_model):
+        """
+        Load a relationship for all the objects retrieved together
+        with a given object which have not yet loaded it, using a
+        single query for each ``lazy_load_batch_size`` referenced
+        objects.
+
+        :param sess: The database session.
+        :param base_obj: The SQLAlchemy model object the relationship
+                         is being accessed on.
+        :param field: The name of the ID field of the relationship.
+        :param rel: The name of the relationship.
+        :param sa_model: The SQLAlchemy model class referenced by the
+                         relationship.
+
+        :returns: A list of the objects loaded.
+        """
+
+        batch = sess.info.get('batches', {}).get(base_obj)
+        if not batch:
+            return []
+
+        # Collect the objects still waiting for the relationship by
+        # the ID they reference; objects which have been expired are
+        # left to load normally
+        pending = {}
+        for ref in batch:
+            obj = ref()
+            if obj is None:
+                continue
+            state = sa.inspect(obj)
+            id = state.dict.get(field)
+            if (id is not None and rel in state.unloaded and
+                    state.session is sess):
+                pending.setdefault(id, []).append(obj)
+
+        # Nothing to gain over loading the relationship normally
+        if len(pending) < 2:
+            return []
+
+        ids = sorted(pending)
+        batch_size = CONF.lazy_load_batch_size
+        loaded = []
+        for i in range(0, len(ids), batch_size):
+            for obj in sess.query(sa_model).\
+                    filter(sa_model.id.in_(ids[i:i + batch_size])):
+                for referrer in pending[obj.id]:
+                    orm.attributes.set_committed_value(referrer, rel, obj)
+                loaded.append(obj)
+
+        # The objects loaded together form a batch in turn
+        self._batch(sess, loaded)
+
+        return loaded
+
+    def _create(self, context, klass, obj):
+        """
+        Add a new object to the database.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class to return.
+        :param obj: The new SQLAlchemy model object.
+        """
+
+        sess = self._get_session(context)
+        self._changed(sess, obj)
+        committed = False
+        try:
+            with sess.begin(subtransactions=True):
+                sess.add(obj)
+                sess.flush()
+            committed = True
+        except sa_exc.IntegrityError:
+            # Let the unique indexes catch duplicates, rather than
+            # looking for an existing object first
+            raise exceptions.Duplicate(klass=klass.__name__)
+        finally:
+            self._settle(sess, committed)
+
+        return self._model(context, klass, obj)
+
     def create_session(self, context):
         """
         Create a new session.  This will be stored on the user
@@ -31,7 +638,7 @@ class API(api.API):
                         database.
         """
 
-        pass
+        return session.get_session()
 
     def begin(self, context):
         """
@@ -41,27 +648,78 @@ class API(api.API):
                         database.
         """
 
-        pass
+        self._get_session(context).begin(subtransactions=True)
 
     def commit(self, context):
         """
         End a transaction, committing the changes to the database.
+        Changes to model objects which have not yet been written are
+        flushed first.
 
         :param context: The current context for accessing the
                         database.
         """
 
-        pass
+        sess = self._get_session(context)
+        self.flush(context)
+        sess.commit()
+        self._settle(sess, True)
 
     def rollback(self, context):
         """
         End a transaction, rolling back the changes to the database.
+        Changes to model objects which have not yet been written are
+        discarded.
 
         :param context: The current context for accessing the
                         database.
         """
 
-        pass
+        sess = self._get_session(context)
+        sess.info.pop('unflushed', None)
+        sess.info.pop('saved', None)
+        sess.info.pop('models', None)
+        sess.info.pop('batches', None)
+        sess.rollback()
+        self._settle(sess, False)
+
+    def flush(self, context):
+        """
+        Write the changes made to model objects which have not yet
+        been written to the database.  Called by ``commit()``; may
+        also be called within a transaction, for instance before
+        querying for objects which have been changed.
+
+        :param context: The current context for accessing the
+                        database.
+        """
+
+        sess = self._get_session(context)
+        unflushed = sess.info.pop('unflushed', {})
+        saved = sess.info.pop('saved', set())
+
+        committed = False
+        try:
+            # Committing the subtransaction flushes the session
+            with sess.begin(subtransactions=True):
+                if unflushed:
+                    with sess.no_autoflush:
+                        self._lock_usages(sess, sorted(unflushed))
+
+                # Apply the changes to the usages of service instances
+                # to their aggregate usages
+                for obj, used, reserved in unflushed.values():
+                    used = obj.used - used
+                    reserved = obj.reserved - reserved
+                    if used or reserved:
+                        self._adjust_aggregate(sess, obj.aggregate_id, used,
+                                               reserved)
+            committed = True
+        except sa_exc.IntegrityError:
+            # A changed object duplicates another one
+            raise exceptions.Duplicate(klass=', '.join(sorted(saved)))
+        finally:
+            self._settle(sess, committed)
 
     def create_service(self, context, name, auth_fields):
         """
@@ -81,7 +739,9 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Service``.
         """
 
-        pass
+        service = sa_models.Service(name=name, auth_fields=set(auth_fields))
+
+        return self._create(context, models.Service, service)
 
     def get_service(self, context, id=None, name=None, hints=None):
         """
@@ -109,9 +769,20 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Service``.
         """
 
-        pass
+        if (id is None) == (name is None):
+            raise TypeError(_("Exactly one of id and name must be given"))
 
-    def get_services(self, context, hints=None):
+        if id is not None:
+            key = dict(id=id)
+        else:
+            key = dict(name=name)
+        query = self._query(context, sa_models.Service).filter_by(**key)
+
+        return self._get_registry(context, models.Service, sa_models.Service,
+                                  query, hints, **key)
+
+    def get_services(self, context, hints=None, marker=None,
+                     limit=None, fields=None):
         """
         Retrieve a list of all defined services.
 
@@ -127,11 +798,29 @@ class API(api.API):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Service`` object or ID.  If
+                       given, only services with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of services to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the services which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Service``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last service may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
         """
 
-        pass
+        query = self._query(context, sa_models.Service)
+
+        return self._get_list(context, models.Service, query, hints,
+                              fields=fields, marker=marker, limit=limit)
 
     def create_category(self, context, service, name, usage_fset, quota_fsets):
         """
@@ -168,7 +857,12 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Category``.
         """
 
-        pass
+        category = sa_models.Category(service_id=_get_id(service), name=name,
+                                      usage_fset=set(usage_fset),
+                                      quota_fsets=[set(fset) for fset in
+                                                   quota_fsets])
+
+        return self._create(context, models.Category, category)
 
     def get_category(self, context, id=None, service=None, name=None,
                      hints=None):
@@ -200,7 +894,17 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Category``.
         """
 
-        pass
+        if id is not None and service is None and name is None:
+            key = dict(id=id)
+        elif id is None and service is not None and name is not None:
+            key = dict(service_id=_get_id(service), name=name)
+        else:
+            raise TypeError(_("Either id or both service and name must be "
+                              "given"))
+        query = self._query(context, sa_models.Category).filter_by(**key)
+
+        return self._get_registry(context, models.Category,
+                                  sa_models.Category, query, hints, **key)
 
     def get_categories(self, context, service, hints=None):
         """
@@ -224,7 +928,10 @@ class API(api.API):
         :returns: A list of instances of ``boson.db.models.Category``.
         """
 
-        pass
+        query = self._query(context, sa_models.Category).\
+            filter_by(service_id=_get_id(service))
+
+        return self._get_list(context, models.Category, query, hints)
 
     def create_resource(self, context, service, category, name, parameters,
                         absolute=False):
@@ -264,7 +971,12 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Resource``.
         """
 
-        pass
+        resource = sa_models.Resource(service_id=_get_id(service),
+                                      category_id=_get_id(category),
+                                      name=name, parameters=set(parameters),
+                                      absolute=absolute)
+
+        return self._create(context, models.Resource, resource)
 
     def get_resource(self, context, id=None, service=None, name=None,
                      hints=None):
@@ -296,7 +1008,17 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Resource``.
         """
 
-        pass
+        if id is not None and service is None and name is None:
+            key = dict(id=id)
+        elif id is None and service is not None and name is not None:
+            key = dict(service_id=_get_id(service), name=name)
+        else:
+            raise TypeError(_("Either id or both service and name must be "
+                              "given"))
+        query = self._query(context, sa_models.Resource).filter_by(**key)
+
+        return self._get_registry(context, models.Resource,
+                                  sa_models.Resource, query, hints, **key)
 
     def get_resources(self, context, service, hints=None):
         """
@@ -320,10 +1042,14 @@ class API(api.API):
         :returns: A list of instances of ``boson.db.models.Resource``.
         """
 
-        pass
+        query = self._query(context, sa_models.Resource).\
+            filter_by(service_id=_get_id(service))
+
+        return self._get_list(context, models.Resource, query, hints)
 
     def create_usage(self, context, resource, param_data, auth_data, used=0,
-                     reserved=0, until_refresh=0, refresh_id=None):
+                     reserved=0, until_refresh=0, refresh_id=None,
+                     instance=''):
         """
         Create a new usage for a given resource and user.  Raises a
         Duplicate exception in the event that the new usage is a
@@ -361,14 +1087,69 @@ class API(api.API):
                            information will only be accepted if the
                            refresh has the same ID as stored in this
                            field.  Defaults to None.
+        :param instance: The name of the service instance the usage is
+                         for.  Defaults to the empty string, which
+                         designates the aggregate usage.  When the
+                         usage of a service instance is created, the
+                         aggregate usage is created if necessary, and
+                         the amounts used and reserved are added to
+                         it.
 
         :returns: An instance of ``boson.db.models.Usage``.
         """
 
-        pass
+        usage = sa_models.Usage(resource_id=_get_id(resource),
+                                parameter_data=param_data,
+                                auth_data=auth_data, used=used,
+                                reserved=reserved,
+                                until_refresh=until_refresh,
+                                refresh_id=refresh_id,
+                                instance=instance, aggregate_id=None)
+        if not instance:
+            return self._create(context, models.Usage, usage)
+
+        # The usage of a service instance is added to the aggregate
+        # usage in the same transaction
+        sess = self._get_session(context)
+        with sess.begin(subtransactions=True):
+            match = _DataMatcher(sa_models.Usage, parameter_data=param_data,
+                                 auth_data=auth_data)
+            query = match.filter(sess.query(sa_models.Usage).filter_by(
+                resource_id=usage.resource_id, instance='')).\
+                with_lockmode('update')
+            aggregate = next((obj for obj in query if match(obj)), None)
+
+            created = False
+            if aggregate is None:
+                aggregate = sa_models.Usage(resource_id=usage.resource_id,
+                                            parameter_data=param_data,
+                                            auth_data=auth_data, used=used,
+                                            reserved=reserved,
+                                            until_refresh=until_refresh,
+                                            instance='', aggregate_id=None)
+
+                # A concurrent transaction may create the aggregate
+                # usage first; the insert is then undone back to a
+                # savepoint, and the other aggregate usage is used
+                try:
+                    with sess.begin_nested():
+                        sess.add(aggregate)
+                    created = True
+                except sa_exc.IntegrityError:
+                    aggregate = next((obj for obj in query if match(obj)),
+                                     None)
+                    if aggregate is None:
+                        raise exceptions.Duplicate(
+                            klass=models.Usage.__name__)
+
+            if not created:
+                self._adjust_aggregate(sess, aggregate.id, used, reserved)
+
+            usage.aggregate_id = aggregate.id
+            return self._create(context, models.Usage, usage)
 
     def get_usage(self, context, id=None, resource=None, param_data=None,
-                  auth_data=None, hints=None):
+                  auth_data=None, instance='', hints=None):
         """
         Look up a specific usage by id or by resource, parameter data,
         and authentication and authorization data.
@@ -381,6 +1162,10 @@ class API(api.API):
         :param param_data: Resource parameter data (a dictionary).
         :param auth_data: Authentication and authorization data (a
                           dictionary).
+        :param instance: The name of the service instance to look up
+                         the usage for.  Defaults to the empty string,
+                         which selects the aggregate usage.  Ignored
+                         when looking up a usage by ID.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -401,10 +1186,25 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Usage``.
         """
 
-        pass
+        query = self._query(context, sa_models.Usage)
+        match = _DataMatcher(sa_models.Usage, parameter_data=param_data,
+                             auth_data=auth_data)
+        if (id is not None and resource is None and param_data is None and
+                auth_data is None):
+            query = query.filter_by(id=id)
+        elif (id is None and resource is not None and
+              param_data is not None and auth_data is not None):
+            query = match.filter(query.filter_by(
+                resource_id=_get_id(resource), instance=instance))
+        else:
+            raise TypeError(_("Either id or all of resource, param_data, "
+                              "and auth_data must be given"))
+
+        return self._get(context, models.Usage, query, hints, match, id=id)
 
     def get_usages(self, context, resource=None, param_data=None,
-                   auth_data=None, hints=None):
+                   auth_data=None, instance=None, hints=None,
+                   marker=None, limit=None, fields=None):
         """
         Retrieve a list of all defined usages.
 
@@ -419,6 +1219,9 @@ class API(api.API):
         :param auth_data: Authentication and authorization data (a
                           dictionary) to filter the list of returned
                           usages.
+        :param instance: The name of a service instance to filter the
+                         list of returned usages.  Use the empty
+                         string to select only aggregate usages.
         :param hints: An optional list of hints indicating which
                       attributes of the model will be required by the
                       calling code.  Only those attributes which
@@ -429,11 +1232,102 @@ class API(api.API):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Usage`` object or ID.  If
+                       given, only usages with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of usages to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the usages which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Usage``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last usage may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
+        """
+
+        query = self._query(context, sa_models.Usage)
+        match = _DataMatcher(sa_models.Usage, parameter_data=param_data,
+                             auth_data=auth_data)
+        if resource is not None:
+            query = query.filter_by(resource_id=_get_id(resource))
+        if instance is not None:
+            query = query.filter_by(instance=instance)
+        query = match.filter(query)
+
+        return self._get_list(context, models.Usage, query, hints, match,
+                              fields, marker, limit)
+
+    def refresh_usage(self, context, usage, refresh_id, used):
+        """
+        Record fresh usage information sent by a service in response
+        to a ``UsageRefreshNeeded`` exception.  The information is only
+        accepted if the refresh ID matches the pending refresh of the
+        usage; otherwise, a ``RefreshMismatch`` exception is raised.
+        The check and the update are atomic, so only the first
+        refresh with a given ID is accepted.  The freshness countdown
+        of the usage is restarted.
+
+        :param context: The current context for accessing the
+                        database.
+        :param usage: The usage being refreshed.  Can be either a
+                      ``Usage`` object or a UUID of an existing usage.
+        :param refresh_id: The refresh ID reported for the usage by
+                           the ``UsageRefreshNeeded`` exception.
+        :param used: The amount of the resource currently in use.
+
+        :returns: An instance of ``boson.db.models.Usage``.
         """
 
-        pass
+        usage_id = _get_id(usage)
+        usage_tab = sa_models.Usage.__table__
+
+        # Write out pending changes first, so they cannot be lost
+        # when the loaded usage is expired
+        sess = self._get_session(context)
+        if sess.dirty or sess.info.get('unflushed'):
+            self.flush(context)
+
+        with sess.begin(subtransactions=True):
+            # Lock the usage and its aggregate, then check the refresh
+            # ID against the locked row
+            self._lock_usages(sess, [usage_id])
+            row = sess.execute(
+                sa.select([usage_tab.c.used, usage_tab.c.aggregate_id,
+                           usage_tab.c.refresh_id]).
+                where(usage_tab.c.id == usage_id)).first()
+            accepted = (row is not None and refresh_id is not None and
+                        row['refresh_id'] == refresh_id)
+
+            if accepted:
+                sess.execute(usage_tab.update().
+                             where(usage_tab.c.id == usage_id).
+                             values(used=used,
+                                    until_refresh=self._restart_countdown(),
+                                    refresh_id=None))
+                if row['aggregate_id']:
+                    self._adjust_aggregate(sess, row['aggregate_id'],
+                                           used - row['used'], 0)
+
+        if row is None:
+            raise KeyError(_("No matching Usage: %s") % usage_id)
+        elif not accepted:
+            raise exceptions.RefreshMismatch(refresh_id=refresh_id,
+                                             usage_id=usage_id)
+
+        # The update bypasses the session, so make a loaded usage
+        # reload the refreshed fields
+        obj = sess.identity_map.get(sa.inspect(sa_models.Usage).
+                                    identity_key_from_primary_key([usage_id]))
+        if obj is not None:
+            sess.expire(obj, ['used', 'until_refresh', 'refresh_id'])
+
+        return self.get_usage(context, id=usage_id)
 
     def create_quota(self, context, resource, auth_data, limit=None):
         """
@@ -456,7 +1350,10 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Quota``.
         """
 
-        pass
+        quota = sa_models.Quota(resource_id=_get_id(resource),
+                                auth_data=auth_data, limit=limit)
+
+        return self._create(context, models.Quota, quota)
 
     def get_quota(self, context, id=None, resource=None, auth_data=None,
                   hints=None):
@@ -490,9 +1387,22 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Quota``.
         """
 
-        pass
-
-    def get_quotas(self, context, resource=None, auth_data=None, hints=None):
+        query = self._query(context, sa_models.Quota)
+        match = _DataMatcher(sa_models.Quota, auth_data=auth_data)
+        if id is not None and resource is None and auth_data is None:
+            query = query.filter_by(id=id)
+        elif id is None and resource is not None and auth_data is not None:
+            query = match.filter(query.filter_by(
+                resource_id=_get_id(resource)))
+        else:
+            raise TypeError(_("Either id or both resource and auth_data "
+                              "must be given"))
+
+        return self._get(context, models.Quota, query, hints, match, id=id)
+
+    def get_quotas(self, context, resource=None, auth_data=None,
+                   hints=None, marker=None, limit=None,
+                   fields=None):
         """
         Retrieve a list of all defined quotas.
 
@@ -513,11 +1423,164 @@ class API(api.API):
                       (In the case of reference fields which are
                       represented as lists, there is no need to use
                       square brackets.)
+        :param marker: An optional ``Quota`` object or ID.  If
+                       given, only quotas with IDs greater than
+                       that of the marker are returned.
+        :param limit: An optional maximum number of quotas to
+                      return.
+        :param fields: An optional list of the names of the fields
+                       of the quotas which will be required by
+                       the calling code.  The database may then defer
+                       retrieving the other fields until they are
+                       first accessed.
 
         :returns: A list of instances of ``boson.db.models.Quota``.
+                  If ``marker`` or ``limit`` is given, the list is
+                  ordered by ID, and the ID of the last quota may
+                  be passed as the marker to retrieve the next page.
+                  Only the last page has fewer than ``limit``
+                  objects.
         """
 
-        pass
+        query = self._query(context, sa_models.Quota)
+        match = _DataMatcher(sa_models.Quota, auth_data=auth_data)
+        if resource is not None:
+            query = query.filter_by(resource_id=_get_id(resource))
+        query = match.filter(query)
+
+        return self._get_list(context, models.Quota, query, hints, match,
+                              fields, marker, limit)
+
+    def get_effective_quotas(self, context, resources, auth_data,
+                             hints=None):
+        """
+        Determine the quotas applicable to a user for a set of
+        resources.  For each resource, the quota records matching the
+        projections of the authentication and authorization data onto
+        the sets of fields listed in the ``quota_fsets`` of the
+        resource's category are considered, and the one for the most
+        specific set of fields is selected.
+
+        :param context: The current context for accessing the
+                        database.
+        :param resources: A sequence of ``Resource`` objects or
+                          resource IDs.
+        :param auth_data: Authentication and authorization data (a
+                          dictionary).
+        :param hints: An optional list of hints indicating which
+                      attributes of the model will be required by the
+                      calling code.  Only those attributes which
+                      reference other fields need be listed, although
+                      it is not an error to list other fields.  It is
+                      also permissible to indicate deeper levels of
+                      access by separating attributes with periods.
+                      (In the case of reference fields which are
+                      represented as lists, there is no need to use
+                      square brackets.)
+
+        :returns: A dictionary mapping the ID of each resource to an
+                  instance of ``boson.db.models.Quota``, or to
+                  ``None`` if no quota applies to that resource.
+        """
+
+        # Compute the candidate projections of the auth data for each
+        # resource, ranked from most to least specific.  Resolving
+        # the categories is normally served by the registry cache.
+        fields = set(auth_data)
+        candidates = {}
+        for resource in resources:
+            if not isinstance(resource, models.Resource):
+                resource = self.get_resource(context, id=resource)
+
+            ranks = candidates.setdefault(resource.id, {})
+            for rank, fset in enumerate(resource.category.quota_fsets):
+                # Skip field sets the auth data cannot be projected on
+                if not fset <= fields:
+                    continue
+
+                proj = dict((f, auth_data[f]) for f in fset)
+                ranks.setdefault(utils.dict_digest(proj), (rank, proj))
+
+        sess = self._get_session(context)
+        publish = not sess.info.get('quota_dirty')
+        hints = self.hints_parser(models.Quota, hints)
+
+        # Consult the quota index first.  Candidates it knows about
+        # need not be looked up, and neither need candidates less
+        # specific than a known quota.
+        best = {}
+        wanted = {}
+        for resource_id, ranks in candidates.items():
+            unknown = {}
+            for digest, (rank, proj) in ranks.items():
+                found, snap = (False, None)
+                if publish and not hints:
+                    found, snap = _QUOTAS.get(resource_id, digest)
+
+                # Guard against digest collisions
+                if snap is not None and snap.auth_data != proj:
+                    found, snap = (False, None)
+
+                if not found:
+                    unknown[digest] = rank
+                elif snap is not None and (resource_id not in best or
+                                           rank < best[resource_id][0]):
+                    best[resource_id] = (rank, snap)
+
+            if resource_id in best:
+                bound = best[resource_id][0]
+                unknown = dict((d, r) for d, r in unknown.items()
+                               if r < bound)
+            if unknown:
+                wanted[resource_id] = unknown
+
+        for resource_id, (rank, snap) in best.items():
+            best[resource_id] = (rank, self._attach(sess, snap))
+
+        # Select all remaining candidates in one query, then keep the
+        # most specific quota for each resource
+        if wanted:
+            generation = _QUOTAS.generation
+            digests = set(digest for unknown in wanted.values()
+                          for digest in unknown)
+            query = self._query(context, sa_models.Quota).\
+                filter(sa_models.Quota.resource_id.in_(wanted)).\
+                filter(sa_models.Quota.auth_digest.in_(digests)).\
+                options(*_eager_options(models.Quota, hints))
+
+            found = set()
+            for obj in query:
+                if obj.auth_digest not in wanted.get(obj.resource_id, {}):
+                    continue
+
+                found.add((obj.resource_id, obj.auth_digest))
+                if publish:
+                    _QUOTAS.put(obj.resource_id, obj.auth_digest, obj,
+                                generation)
+
+                # Guard against digest collisions
+                rank, proj = candidates[obj.resource_id][obj.auth_digest]
+                if obj.auth_data != proj:
+                    continue
+
+                if (obj.resource_id not in best or
+                        rank < best[obj.resource_id][0]):
+                    best[obj.resource_id] = (rank, obj)
+
+            # Remember the quotas which do not exist
+            if publish:
+                for resource_id, unknown in wanted.items():
+                    for digest in unknown:
+                        if (resource_id, digest) not in found:
+                            _QUOTAS.put(resource_id, digest, None,
+                                        generation)
+
+        result = dict.fromkeys(candidates)
+        for resource_id, (rank, obj) in best.items():
+            result[resource_id] = self._model(context, models.Quota, obj,
+                                              hints)
+
+        return result
 
     def create_reservation(self, context, expire):
         """
@@ -531,7 +1594,9 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Reservation``.
         """
 
-        pass
+        reservation = sa_models.Reservation(expire=expire)
+
+        return self._create(context, models.Reservation, reservation)
 
     def reserve(self, context, reservation, resource, usage, delta):
         """
@@ -554,7 +1619,278 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.ReservedItem``.
         """
 
-        pass
+        return self.reserve_many(context, reservation,
+                                 [(resource, usage, delta)])[0]
+
+    def reserve_many(self, context, reservation, items):
+        """
+        Reserve particular amounts of several resources at once.  The
+        affected usage records are locked in a stable order, so
+        concurrent multi-resource reservations cannot deadlock.
+        Amounts reserved on the usage of a service instance are also
+        added to the aggregate usage.
+
+        If usage refreshes are enabled, each reservation counts down
+        to the next refresh of the usages reserved against.  If any
+        of the usages are stale, nothing is reserved or changed, and
+        a ``UsageRefreshNeeded`` exception listing all the stale
+        usages is raised.  A usage becomes stale once a reservation
+        exhausts its countdown, and its refresh ID is saved with that
+        reservation.
+
+        :param context: The current context for accessing the
+                        database.
+        :param reservation: The reservation the items are reserved
+                            in.  Can be either a ``Reservation``
+                            object or a UUID of an existing
+                            reservation.
+        :param items: A sequence of (resource, usage, delta) tuples.
+                      The resource and usage may each be either a
+                      model object or a UUID, as for ``reserve()``.
+
+        :returns: A list of instances of
+                  ``boson.db.models.ReservedItem``, in the same order
+                  as ``items``.
+        """
+
+        resv_id = _get_id(reservation)
+        items = [(_get_id(resource), _get_id(usage), delta)
+                 for resource, usage, delta in items]
+        if not items:
+            return []
+
+        # Sum up the positive deltas for each usage; negative
+        # reservations are not counted in the usage
+        increments = {}
+        for _res_id, usage_id, delta in items:
+            increments.setdefault(usage_id, 0)
+            if delta > 0:
+                increments[usage_id] += delta
+
+        # Write out pending changes first, so they cannot be lost, or
+        # rolled up into the aggregates twice, when the reserved
+        # amounts are updated
+        sess = self._get_session(context)
+        if sess.dirty or sess.info.get('unflushed'):
+            self.flush(context)
+
+        with sess.begin(subtransactions=True):
+            # Lock the usage records and their aggregates; the
+            # countdowns must be read from the locked rows
+            usages = self._lock_usages(sess, increments.keys(),
+                                       refresh=True)
+            missing = set(increments) - set(u.id for u in usages)
+            if missing:
+                raise KeyError(_("No matching Usage: %s") %
+                               ', '.join(sorted(missing)))
+
+            # Count down to the next refresh of each usage reserved
+            # against, collecting all the stale usages
+            countdowns = {}
+            stale = []
+            for usage in usages:
+                if usage.id not in increments:
+                    continue
+                until_refresh, refresh_id, is_stale = self._count_down(
+                    usage.until_refresh, usage.refresh_id)
+                countdowns[usage] = (until_refresh, refresh_id)
+                if is_stale:
+                    stale.append(usage)
+
+            # Stale usages are left unchanged, so nothing is written
+            # when the reservation is refused
+            if not stale:
+                for usage, (until_refresh, refresh_id) in countdowns.items():
+                    if until_refresh != usage.until_refresh:
+                        usage.until_refresh = until_refresh
+                    if refresh_id != usage.refresh_id:
+                        usage.refresh_id = refresh_id
+
+                reserved_items = self._reserve_items(sess, resv_id, items,
+                                                     usages, increments)
+
+        if stale:
+            raise exceptions.UsageRefreshNeeded(
+                [self._model(context, models.Usage, usage)
+                 for usage in stale])
+
+        return [self._model(context, models.ReservedItem, item)
+                for item in reserved_items]
+
+    def _reserve_items(self, sess, resv_id, items, usages, increments):
+        """
+        Add the reserved items of a reservation, and add their
+        positive deltas to the reserved amounts of the usages.  Called
+        by ``reserve_many()`` with the usages locked.
+
+        :param sess: The database session.
+        :param resv_id: The ID of the reservation.
+        :param items: A list of (resource ID, usage ID, delta) tuples.
+        :param usages: The locked SQLAlchemy ``Usage`` objects,
+                       including the aggregate usages.
+        :param increments: A dictionary mapping the IDs of the usages
+                           reserved against to the sums of their
+                           positive deltas.
+
+        :returns: A list of the SQLAlchemy ``ReservedItem`` objects.
+        """
+
+        # Roll the increments up into the aggregate usages
+        for usage in usages:
+            if usage.aggregate_id and increments.get(usage.id):
+                increments.setdefault(usage.aggregate_id, 0)
+                increments[usage.aggregate_id] += increments[usage.id]
+
+        # Add the reserved items; with the IDs assigned up front,
+        # they are inserted with a single executemany()
+        reserved_items = [sa_models.ReservedItem(
+            id=utils.generate_uuid(),
+            reservation_id=resv_id,
+            resource_id=res_id,
+            usage_id=usage_id,
+            delta=delta) for res_id, usage_id, delta in items]
+        sess.add_all(reserved_items)
+        try:
+            sess.flush(reserved_items)
+        except sa_exc.IntegrityError:
+            # The usages are locked, so the reservation or one of the
+            # resources must be missing
+            raise KeyError(_("No matching Reservation or Resource for "
+                             "reservation %s") % resv_id)
+
+        # Apply all the reserved increments in one statement
+        increments = dict((usage_id, incr)
+                          for usage_id, incr in increments.items()
+                          if incr)
+        if increments:
+            usage_tab = sa_models.Usage.__table__
+            sess.execute(usage_tab.update().
+                         where(usage_tab.c.id.in_(increments.keys())).
+                         values(reserved=usage_tab.c.reserved +
+                                sa.case(increments,
+                                        value=usage_tab.c.id)))
+
+            # Bring the loaded usages up to date without marking
+            # them as modified
+            for usage in usages:
+                if usage.id in increments:
+                    orm.attributes.set_committed_value(
+                        usage, 'reserved',
+                        usage.reserved + increments[usage.id])
+
+        return reserved_items
+
+    def commit_deltas(self, context, items):
+        """
+        Commit amounts of several resources immediately, without
+        making a reservation.  This is intended for requests which
+        are committed as soon as they are approved, typically
+        decrements such as destroying an instance.  Each delta is
+        added directly to the amount used on its usage, and to the
+        aggregate usage for the usage of a service instance; no
+        reservation or reserved items are created.  Quota limits are
+        not checked.
+
+        :param context: The current context for accessing the
+                        database.
+        :param items: A sequence of (usage, delta) tuples.  The usage
+                      may be either a ``Usage`` object or a UUID of
+                      an existing usage.  The delta may be positive or
+                      negative.
+        """
+
+        # Sum up the deltas for each usage, noting the aggregates of
+        # the usages passed as objects
+        deltas = {}
+        aggregates = {}
+        for usage, delta in items:
+            usage_id = _get_id(usage)
+            deltas[usage_id] = deltas.get(usage_id, 0) + delta
+            if isinstance(usage, models.Usage):
+                aggregates[usage_id] = usage.aggregate_id
+
+        # Write out pending changes first, so they cannot be lost
+        # when the loaded usages are brought up to date
+        sess = self._get_session(context)
+        if sess.new or sess.dirty or sess.info.get('unflushed'):
+            self.flush(context)
+
+        # The aggregate of a usage never changes, so the aggregates
+        # not known from loaded usages can be looked up without a
+        # lock
+        usage_tab = sa_models.Usage.__table__
+        mapper = sa.inspect(sa_models.Usage)
+        for usage_id in deltas:
+            obj = sess.identity_map.get(
+                mapper.identity_key_from_primary_key([usage_id]))
+            if usage_id not in aggregates and obj is not None:
+                aggregates[usage_id] = obj.aggregate_id
+        unknown = [usage_id for usage_id in deltas
+                   if usage_id not in aggregates]
+        if unknown:
+            aggregates.update(sess.execute(
+                sa.select([usage_tab.c.id, usage_tab.c.aggregate_id]).
+                where(usage_tab.c.id.in_(unknown))).fetchall())
+            missing = set(unknown) - set(aggregates)
+            if missing:
+                raise KeyError(_("No matching Usage: %s") %
+                               ', '.join(sorted(missing)))
+
+        # Roll the deltas up into the aggregate usages
+        usage_ids = list(deltas)
+        for usage_id in usage_ids:
+            if aggregates[usage_id]:
+                deltas.setdefault(aggregates[usage_id], 0)
+                deltas[aggregates[usage_id]] += deltas[usage_id]
+
+        # The update only finds out about missing usages it changes,
+        # so check that the others, not already looked up, exist
+        unchecked = [usage_id for usage_id in usage_ids
+                     if not deltas[usage_id] and usage_id not in unknown]
+        if unchecked:
+            found = set(row[0] for row in sess.execute(
+                sa.select([usage_tab.c.id]).
+                where(usage_tab.c.id.in_(unchecked))))
+            missing = set(unchecked) - found
+            if missing:
+                raise KeyError(_("No matching Usage: %s") %
+                               ', '.join(sorted(missing)))
+
+        deltas = dict((usage_id, delta) for usage_id, delta in deltas.items()
+                      if delta)
+        if not deltas:
+            return
+
+        # Apply all the deltas in one statement, which takes the row
+        # locks itself; usages passed as objects may no longer exist,
+        # in which case the update is undone
+        with sess.begin(subtransactions=True):
+            result = sess.execute(usage_tab.update().
+                                  where(usage_tab.c.id.in_(deltas.keys())).
+                                  values(used=usage_tab.c.used +
+                                         sa.case(deltas,
+                                                 value=usage_tab.c.id)))
+            if result.rowcount != len(deltas):
+                found = set(row[0] for row in sess.execute(
+                    sa.select([usage_tab.c.id]).
+                    where(usage_tab.c.id.in_(deltas.keys()))))
+                raise KeyError(_("No matching Usage: %s") %
+                               ', '.join(sorted(set(deltas) - found)))
+
+        # Bring the loaded usages, and their models, up to date
+        # without marking them as modified
+        identity = self._identity_map(context)
+        for usage_id, delta in deltas.items():
+            obj = sess.identity_map.get(
+                mapper.identity_key_from_primary_key([usage_id]))
+            if obj is None:
+                continue
+
+            orm.attributes.set_committed_value(obj, 'used',
+                                               obj.used + delta)
+            model = identity.get((models.Usage, usage_id))
+            if model is not None and model._base_obj is obj:
+                model._refresh()
 
     def get_reservation(self, context, id, hints=None):
         """
@@ -580,17 +1916,168 @@ class API(api.API):
         :returns: An instance of ``boson.db.models.Reservation``.
         """
 
-        pass
+        query = self._query(context, sa_models.Reservation).filter_by(id=id)
+
+        return self._get(context, models.Reservation, query, hints, id=id)
 
     def expire_reservations(self, context):
         """
-        Rolls back all expired reservations.
+        Rolls back all expired reservations.  Expired reservations are
+        processed in batches of at most
+        ``reservation_expire_batch_size`` reservations, each in its
+        own transaction, so that a large backlog does not hold the
+        usage locks for long.
+
+        :param context: The current context for accessing the
+                        database.
+
+        :returns: The number of reservations rolled back.
+        """
+
+        resv_tab = sa_models.Reservation.__table__
+        item_tab = sa_models.ReservedItem.__table__
+        usage_tab = sa_models.Usage.__table__
+
+        batch_size = CONF.reservation_expire_batch_size
+        now = timeutils.utcnow()
+        total = 0
+
+        # Write out pending changes first, so they cannot be lost, or
+        # rolled up into the aggregates twice, when the released
+        # amounts are expired
+        sess = self._get_session(context)
+        if sess.dirty or sess.info.get('unflushed'):
+            self.flush(context)
+
+        while True:
+            with sess.begin(subtransactions=True):
+                resv_ids = [row[0] for row in sess.execute(
+                    sa.select([resv_tab.c.id]).
+                    where(resv_tab.c.expire < now).
+                    order_by(resv_tab.c.expire).
+                    limit(batch_size))]
+                if not resv_ids:
+                    break
+
+                # Only positive reservations are counted in the usage
+                positive = sa.and_(item_tab.c.reservation_id.in_(resv_ids),
+                                   item_tab.c.delta > 0)
+                usage_ids = sa.select([item_tab.c.usage_id]).where(positive)
+
+                # Lock the usage records and their aggregates, as
+                # reserve_many() does, then release the reserved
+                # amounts, rolled up into the aggregates
+                usages = self._lock_usages(sess, usage_ids)
+                aggregates = dict((usage.id, usage.aggregate_id)
+                                  for usage in usages)
+                released = {}
+                for usage_id, amount in sess.execute(
+                        sa.select([item_tab.c.usage_id,
+                                   sa.func.sum(item_tab.c.delta)]).
+                        where(positive).
+                        group_by(item_tab.c.usage_id)):
+                    for target in (usage_id, aggregates.get(usage_id)):
+                        if target:
+                            released.setdefault(target, 0)
+                            released[target] += amount
+
+                if released:
+                    sess.execute(usage_tab.update().
+                                 where(usage_tab.c.id.in_(released.keys())).
+                                 values(reserved=usage_tab.c.reserved -
+                                        sa.case(released,
+                                                value=usage_tab.c.id)))
+
+                    # The update bypasses the session, so make usages
+                    # loaded in it reload the released amounts
+                    for usage in usages:
+                        if usage.id in released:
+                            sess.expire(usage, ['reserved'])
+
+                # Now drop the reservations, noting the reserved items
+                # going with them
+                item_ids = [row[0] for row in sess.execute(
+                    sa.select([item_tab.c.id]).
+                    where(item_tab.c.reservation_id.in_(resv_ids)))]
+                sess.execute(item_tab.delete().
+                             where(item_tab.c.reservation_id.in_(resv_ids)))
+                sess.execute(resv_tab.delete().
+                             where(resv_tab.c.id.in_(resv_ids)))
+
+            # The rows were deleted without the session, so forget
+            # them, and the reserved items of the usages loaded in it
+            identity = self._identity_map(context)
+            usage_mapper = sa.inspect(sa_models.Usage)
+            for item in self._evict(context, models.ReservedItem,
+                                    item_ids):
+                usage = sess.identity_map.get(
+                    usage_mapper.identity_key_from_primary_key(
+                        [item.usage_id]))
+                if usage is None:
+                    continue
+
+                sess.expire(usage, ['reserved_items'])
+                model = identity.get((models.Usage, usage.id))
+                if model is not None and model._base_obj is usage:
+                    model._refresh()
+            self._evict(context, models.Reservation, resv_ids)
+
+            total += len(resv_ids)
+            if len(resv_ids) < batch_size:
+                break
+
+        return total
+
+    def _identity_map(self, context):
+        """
+        Called to obtain the identity map of the session: a
+        dictionary, which should hold its values weakly, mapping
+        tuples of a model class and an ID to the model objects
+        constructed in the session.  Entries must be discarded when
+        the database objects are deleted, or when the transaction
+        creating them is rolled back.
 
         :param context: The current context for accessing the
                         database.
         """
 
-        pass
+        info = self._get_session(context).info
+        if 'models' not in info:
+            info['models'] = weakref.WeakValueDictionary()
+
+        return info['models']
+
+    def _evict(self, context, klass, ids):
+        """
+        Called to discard database objects deleted without going
+        through the session.  Their model objects are dropped from the
+        identity map, and the database objects loaded in the session
+        are expunged from it.
+
+        :param context: The current context for accessing the
+                        database.
+        :param klass: The ``boson.db.models`` class of the deleted
+                      objects.
+        :param ids: The IDs of the deleted objects.
+
+        :returns: A list of the database objects expunged from the
+                  session.
+        """
+
+        sess = self._get_session(context)
+        identity = self._identity_map(context)
+        mapper = sa.inspect(getattr(sa_models, klass.__name__))
+
+        evicted = []
+        for id in ids:
+            identity.pop((klass, id), None)
+            obj = sess.identity_map.get(
+                mapper.identity_key_from_primary_key([id]))
+            if obj is not None:
+                sess.expunge(obj)
+                evicted.append(obj)
+
+        return evicted
 
     def _lazy_get(self, context, base_obj, field, hints, klass):
         """
@@ -613,7 +2100,52 @@ class API(api.API):
         :returns: An instance of ``klass``.
         """
 
-        pass
+        # Objects already retrieved in the session are taken from the
+        # identity map
+        id = getattr(base_obj, field)
+        if id is None:
+            return None
+        model = self._cached_model(context, klass, id)
+        if model is not None:
+            return model
+
+        # The field is the ID field; the relationship drops the '_id'.
+        # If the relationship was named in the hints, it has already
+        # been loaded, and no query is issued here.
+        rel = field[:-3]
+        state = sa.inspect(base_obj)
+        sa_model = state.mapper.relationships[rel].mapper.class_
+        cacheable = (rel in state.unloaded and sa_model in _REGISTRY and
+                     state.session is not None and
+                     not state.session.info.get('registry_dirty'))
+
+        # Registry objects are taken from the cache, and installed as
+        # the loaded value of the relationship
+        snap = None
+        if cacheable:
+            snap = _REGISTRY.get(sa_model, id=id)
+
+        if snap is not None:
+            obj = self._attach(state.session, snap)
+            orm.attributes.set_committed_value(base_obj, rel, obj)
+        else:
+            # The first access to the relationship on one of a list of
+            # objects loads it for the rest of the list as well
+            generation = _REGISTRY.generation
+            loaded = []
+            if rel in state.unloaded and state.session is not None:
+                loaded = self._load_batch(state.session, base_obj, field,
+                                          rel, sa_model)
+
+            obj = getattr(base_obj, rel)
+            if obj is None:
+                return None
+            elif cacheable:
+                for other in loaded:
+                    _REGISTRY.put(other, generation)
+                _REGISTRY.put(obj, generation)
+
+        return self._model(context, klass, obj, _sub_hints(hints, rel))
 
     def _lazy_get_list(self, context, base_obj, field, hints, klass):
         """
@@ -636,7 +2168,11 @@ class API(api.API):
         :returns: A list of instances of ``klass``.
         """
 
-        pass
+        sub_hints = _sub_hints(hints, field)
+        objs = getattr(base_obj, field)
+        self._batch(self._get_session(context), objs)
+
+        return [self._model(context, klass, obj, sub_hints) for obj in objs]
 
     def _save(self, context, base_obj):
         """
@@ -649,7 +2185,27 @@ class API(api.API):
                          database.
         """
 
-        pass
+        sess = self._get_session(context)
+        self._changed(sess, base_obj)
+        sess.add(base_obj)
+        sess.info.setdefault('saved', set()).add(type(base_obj).__name__)
+
+        # Changes to the usage of a service instance are also applied
+        # to the aggregate usage when flushed; remember the amounts
+        # already counted in the aggregate before anything is flushed
+        if getattr(base_obj, 'aggregate_id', None):
+            unflushed = sess.info.setdefault('unflushed', {})
+            if base_obj.id not in unflushed:
+                unflushed[base_obj.id] = (
+                    base_obj,
+                    base_obj.used - _history_delta(base_obj, 'used'),
+                    base_obj.reserved - _history_delta(base_obj,
+                                                       'reserved'))
+
+        # Within a transaction, the session writes all the changes to
+        # an object in a single statement when it is flushed
+        if not sess.is_active:
+            self.flush(context)
 
     def _delete(self, context, base_obj):
         """
@@ -662,4 +2218,34 @@ class API(api.API):
                          the database.
         """
 
-        pass
+        sess = self._get_session(context)
+        self._changed(sess, base_obj, deleted=True)
+        aggregate_id = getattr(base_obj, 'aggregate_id', None)
+
+        klass = getattr(models, type(base_obj).__name__)
+        self._identity_map(context).pop((klass, base_obj.id), None)
+
+        # Only the amounts already counted in the aggregate usage are
+        # taken out of it
+        if aggregate_id:
+            unflushed = sess.info.get('unflushed', {})
+            _obj, used, reserved = unflushed.pop(
+                base_obj.id, (base_obj, base_obj.used, base_obj.reserved))
+
+        committed = False
+        try:
+            with sess.begin(subtransactions=True):
+                # Take the usage of a service instance out of the
+                # aggregate usage
+                if aggregate_id:
+                    with sess.no_autoflush:
+                        self._lock_usages(sess, [base_obj.id])
+                    self._adjust_aggregate(sess, aggregate_id, -used,
+                                           -reserved)
+                sess.delete(base_obj)
+            committed = True
+        except sa_exc.IntegrityError:
+            # Objects which must reference the object still do
+            raise exceptions.InUse(klass=klass.__name__)
+        finally:
+            self._settle(sess, committed)
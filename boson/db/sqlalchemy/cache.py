@@ -0,0 +1,293 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from boson.db.sqlalchemy import models as sa_models
+from boson.openstack.common import cfg
+
+
+cache_opts = [
+    cfg.IntOpt('registry_cache_ttl',
+               default=60,
+               help='Seconds for which cached services, categories and '
+                    'resources may be used; changes made by other Boson '
+                    'processes become visible after this delay.  Set to '
+                    '0 to disable the registry cache'),
+    cfg.IntOpt('quota_cache_ttl',
+               default=60,
+               help='Seconds for which cached quotas, and the absence of '
+                    'quotas, may be used; quotas created or changed by '
+                    'other Boson processes become visible after this '
+                    'delay.  Set to 0 to disable the quota index'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(cache_opts)
+
+# The maximum number of entries in the quota index; the index is
+# cleared when it fills up
+QUOTA_INDEX_SIZE = 10000
+
+
+def snapshot(obj):
+    """
+    Make a detached copy of the column values of a SQLAlchemy model
+    object.  The copy is not attached to any session, and can be
+    shared between sessions; use ``Session.merge(copy, load=False)``
+    to obtain an instance of it in a given session without querying
+    the database.
+
+    :param obj: The SQLAlchemy model object to copy.
+    """
+
+    mapper = orm.object_mapper(obj)
+    copy = mapper.class_()
+    for prop in mapper.column_attrs:
+        setattr(copy, prop.key, getattr(obj, prop.key))
+    orm.make_transient_to_detached(copy)
+
+    return copy
+
+
+class RegistryCache(object):
+    """
+    A read-through cache of the registry: services, categories and
+    resources.  Entries are snapshots of the database rows, indexed by
+    ID and by name.  The whole cache is invalidated by bumping a
+    generation counter whenever a registry object is created, saved or
+    deleted through this process.
+    """
+
+    # The attributes indexing each registry model, in addition to
+    # the ID
+    KEYS = {
+        sa_models.Service: [('name',)],
+        sa_models.Category: [('service_id', 'name')],
+        sa_models.Resource: [('service_id', 'name')],
+    }
+
+    def __init__(self):
+        """
+        Initialize the ``RegistryCache``.
+        """
+
+        self.generation = 0
+        self._entries = {}
+
+    def __contains__(self, sa_model):
+        """
+        Determine whether a SQLAlchemy model class is part of the
+        registry.
+        """
+
+        return sa_model in self.KEYS
+
+    def invalidate(self):
+        """
+        Invalidate all cache entries.
+        """
+
+        self.generation += 1
+
+    def clear(self):
+        """
+        Invalidate and discard all cache entries.
+        """
+
+        self.invalidate()
+        self._entries = {}
+
+    def get(self, sa_model, **kwargs):
+        """
+        Look up a registry object.  Returns a detached snapshot of the
+        object, or ``None`` if it is not cached.
+
+        :param sa_model: The SQLAlchemy model class.
+
+        The object is identified by keyword arguments, either ``id``
+        or the attributes listed in ``KEYS``.
+        """
+
+        key = (sa_model,) + tuple(sorted(kwargs.items()))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        generation, expires, snap = entry
+        if generation != self.generation or expires < time.time():
+            return None
+
+        return snap
+
+    def put(self, obj, generation):
+        """
+        Add a registry object to the cache.
+
+        :param obj: The SQLAlchemy model object.
+        :param generation: The value of ``generation`` before the
+                           object was loaded.  If the cache has been
+                           invalidated since, the object may be stale
+                           and is not added.
+        """
+
+        ttl = CONF.registry_cache_ttl
+        if generation != self.generation or ttl <= 0:
+            return
+
+        sa_model = type(obj)
+        snap = snapshot(obj)
+        entry = (generation, time.time() + ttl, snap)
+
+        self._entries[(sa_model, ('id', obj.id))] = entry
+        for attrs in self.KEYS[sa_model]:
+            key = (sa_model,) + tuple((attr, getattr(obj, attr))
+                                      for attr in sorted(attrs))
+            self._entries[key] = entry
+
+
+def quota_keys(obj):
+    """
+    Compute the quota index keys affected by a change to a quota.
+    This includes the key for the current values of the quota, and
+    the key for its values as last loaded from the database, which
+    differ if the resource or the authentication data of the quota
+    have been changed.
+
+    :param obj: The SQLAlchemy ``Quota`` object.
+    """
+
+    state = sa.inspect(obj)
+    keys = set([(obj.resource_id, obj.auth_digest)])
+
+    old = []
+    for attr in ('resource_id', 'auth_digest'):
+        hist = state.attrs[attr].history
+        old.append((hist.deleted or hist.unchanged or [None])[0])
+    if None not in old:
+        keys.add(tuple(old))
+
+    return keys
+
+
+class QuotaIndex(object):
+    """
+    An index of quotas, keyed by resource ID and the digest of the
+    projection of the authentication data the quota applies to.  The
+    index records both quotas that exist, as snapshots of the
+    database rows, and quotas confirmed not to exist, which is the
+    common case for the more specific field sets of a category.
+    """
+
+    def __init__(self):
+        """
+        Initialize the ``QuotaIndex``.
+        """
+
+        self.generation = 0
+        self._entries = {}
+
+    def get(self, resource_id, digest):
+        """
+        Look up a quota.  Returns a tuple of a boolean indicating
+        whether the index knows about the quota and the detached
+        snapshot of the quota, which will be ``None`` if the quota is
+        known not to exist.
+
+        :param resource_id: The ID of the resource.
+        :param digest: The digest of the authentication data.
+        """
+
+        entry = self._entries.get((resource_id, digest))
+        if entry is None:
+            return False, None
+        elif entry[0] < time.time():
+            del self._entries[(resource_id, digest)]
+            return False, None
+
+        return True, entry[1]
+
+    def put(self, resource_id, digest, obj, generation):
+        """
+        Record the result of looking up a quota in the database.
+
+        :param resource_id: The ID of the resource.
+        :param digest: The digest of the authentication data.
+        :param obj: The SQLAlchemy ``Quota`` object, or ``None`` if
+                    the quota does not exist.
+        :param generation: The value of ``generation`` before the
+                           quota was looked up.  If any quota has been
+                           changed since, the result may be stale and
+                           is not recorded.
+        """
+
+        if generation == self.generation:
+            self._set((resource_id, digest), obj)
+
+    def write(self, obj, deleted=False):
+        """
+        Record a committed change to a quota.
+
+        :param obj: The SQLAlchemy ``Quota`` object.
+        :param deleted: If ``True``, the quota has been deleted.
+        """
+
+        self._set((obj.resource_id, obj.auth_digest),
+                  None if deleted else obj)
+
+    def discard(self, keys):
+        """
+        Forget about quotas which are being changed.  Lookups of those
+        quotas which are in progress will not be recorded.
+
+        :param keys: A sequence of index keys, as returned by
+                     ``quota_keys()``.
+        """
+
+        self.generation += 1
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Discard all index entries.
+        """
+
+        self.generation += 1
+        self._entries = {}
+
+    def _set(self, key, obj):
+        """
+        Set an index entry.
+
+        :param key: The index key.
+        :param obj: The SQLAlchemy ``Quota`` object, or ``None``.
+        """
+
+        ttl = CONF.quota_cache_ttl
+        if ttl <= 0:
+            return
+
+        if (key not in self._entries and
+                len(self._entries) >= QUOTA_INDEX_SIZE):
+            self._entries.clear()
+
+        snap = None if obj is None else snapshot(obj)
+        self._entries[key] = (time.time() + ttl, snap)
@@ -15,10 +15,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import cPickle
+import json
 
 import sqlalchemy as sa
-from sqlalchemy.exc import declarative as sa_dec
+from sqlalchemy.ext import declarative as sa_dec
 from sqlalchemy import orm
 from sqlalchemy import types as sa_types
 
@@ -28,57 +28,175 @@ from boson import utils
 
 BASE = sa_dec.declarative_base()
 
+# Maximum number of decoded values memoized by each FieldSet column
+DECODE_CACHE_SIZE = 1024
 
-class DictSerialized(sa_types.TypeDecorator):
+_JSON_DECODER = json.JSONDecoder()
+
+# Maps the DictSerialized columns to their digest columns
+DIGEST_COLUMNS = {
+    'parameter_data': 'parameter_digest',
+    'auth_data': 'auth_digest',
+}
+
+
+class DictSerialized(object):
     """
-    Special SQLAlchemy type to support serializing dictionaries into
-    and out of the special serialization format implemented by
+    Descriptor to support serializing dictionaries into and out of the
+    special serialization format implemented by
     boson.utils.dict_{,de}serialize().  This serialization format is a
     repeatable format (dictionary keys are ordered), which makes it
     possible to search for table rows matching a desired dictionary.
+
+    The serialized text is mapped to a separate column attribute and
+    loaded as is.  It is only deserialized when the descriptor is
+    first read, and the result is kept on the object until the text
+    changes, so rows whose dictionaries are never examined cost
+    nothing to decode.  Setting the descriptor also updates the
+    corresponding digest column.
     """
 
-    impl = sa.Text
+    def __init__(self, column_attr, digest_attr):
+        """
+        Initialize a ``DictSerialized`` descriptor.
 
-    def process_bind_param(self, value, dialect):
-        """Marshal the value into its serialized format."""
+        :param column_attr: The name of the model attribute mapping
+                            the column containing the serialized
+                            text.
+        :param digest_attr: The name of the digest attribute.
+        """
 
-        if value is not None:
-            value = utils.dict_serialize(value)
+        self.column_attr = column_attr
+        self.digest_attr = digest_attr
+        self.cache_key = '%s_decoded' % column_attr
 
-        return value
+    @staticmethod
+    def digest(value):
+        """
+        Compute the digest of a value.  Long serialized values cannot
+        be indexed efficiently; instead, each ``DictSerialized``
+        column is paired with a fixed-width digest column, which is
+        updated whenever the dictionary is set.
+        """
 
-    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+
+        return utils.dict_digest(value)
+
+    def __get__(self, obj, owner):
         """Marshal the value out of its serialized format."""
 
-        if value is not None:
-            value = utils.dict_deserializer(value)
+        if obj is None:
+            return self
+
+        text = getattr(obj, self.column_attr)
+        if text is None:
+            return None
+
+        # The decoded value is only valid for the text it was decoded
+        # from; the text is replaced if the object is refreshed
+        cached = obj.__dict__.get(self.cache_key)
+        if cached is not None and cached[0] is text:
+            return cached[1]
+
+        value = utils.dict_deserialize(text)
+        obj.__dict__[self.cache_key] = (text, value)
 
         return value
 
+    def __set__(self, obj, value):
+        """Marshal the value into its serialized format."""
 
-class PickledString(sa_types.TypeDecorator):
+        text = None
+        if value is not None:
+            text = utils.dict_serialize(value)
+
+        setattr(obj, self.column_attr, text)
+        setattr(obj, self.digest_attr, self.digest(value))
+        obj.__dict__[self.cache_key] = (text, value)
+
+
+class FieldSet(sa_types.TypeDecorator):
     """
-    Special SQLAlchemy type to support serializing Python objects into
-    and out of the database, using the cPickle module.  This enables
-    field sets to be stored in the database as sets, etc.
+    Special SQLAlchemy type to support storing sets of field names.
+    Sets are stored as JSON lists in sorted order, which is compact,
+    canonical, and cheaper to decode than a pickle.  Since the same
+    field sets recur across many rows, decoded values are memoized;
+    they are returned as frozensets so they may be safely shared.
     """
 
     impl = sa.Text
 
+    def __init__(self, *args, **kwargs):
+        """Initialize the type and its decoding cache."""
+
+        super(FieldSet, self).__init__(*args, **kwargs)
+        self._cache = {}
+
+    def _encode(self, value):
+        """Convert a value into its JSON-compatible form."""
+
+        return sorted(value)
+
+    def _decode(self, value):
+        """Convert a decoded JSON value into a cacheable value."""
+
+        return frozenset(value)
+
     def process_bind_param(self, value, dialect):
         """Marshal the value into its serialized format."""
 
         if value is not None:
-            value = cPickle.dumps(value)
+            value = json.dumps(self._encode(value), separators=(',', ':'))
 
         return value
 
     def process_result_value(self, value, dialect):
         """Marshal the value out of its serialized format."""
 
+        if value is None:
+            return None
+
+        result = self._cache.get(value)
+        if result is not None:
+            return result
+
+        result = self._decode(_JSON_DECODER.raw_decode(value)[0])
+
+        # Keep the cache bounded
+        if len(self._cache) >= DECODE_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[value] = result
+
+        return result
+
+
+class FieldSetList(FieldSet):
+    """
+    Special SQLAlchemy type to support storing lists of sets of field
+    names.  The list is stored as a JSON list of sorted lists; the
+    order of the outer list is preserved.
+    """
+
+    def _encode(self, value):
+        """Convert a value into its JSON-compatible form."""
+
+        return [sorted(fset) for fset in value]
+
+    def _decode(self, value):
+        """Convert a decoded JSON value into a cacheable value."""
+
+        return tuple(map(frozenset, value))
+
+    def process_result_value(self, value, dialect):
+        """Marshal the value out of its serialized format."""
+
+        value = super(FieldSetList, self).process_result_value(value,
+                                                               dialect)
         if value is not None:
-            value = cPickle.loads(value)
+            # Callers get their own list of the shared field sets
+            value = list(value)
 
         return value
 
@@ -97,21 +215,28 @@ class Service(BASE, ModelBase):
     """Represents a declared service."""
 
     __tablename__ = 'services'
+    __table_args__ = (
+        sa.Index('uniq_services_name', 'name', unique=True),
+    )
 
     name = sa.Column(sa.String(64), nullable=False)
-    auth_fields = sa.Column(PickledString)
+    auth_fields = sa.Column(FieldSet)
 
 
 class Category(BASE, ModelBase):
     """Represents a category of quotas for a given service."""
 
     __tablename__ = 'categories'
+    __table_args__ = (
+        sa.Index('uniq_categories_service_id_name', 'service_id', 'name',
+                 unique=True),
+    )
 
     service_id = sa.Column(sa.String(36), sa.ForeignKey('services.id'),
                            nullable=False)
     name = sa.Column(sa.String(64), nullable=False)
-    usage_fset = sa.Column(PickledString)
-    quota_fsets = sa.Column(PickledString)
+    usage_fset = sa.Column(FieldSet)
+    quota_fsets = sa.Column(FieldSetList)
 
     service = orm.relationship(Service, backref=orm.backref('categories'))
 
@@ -120,13 +245,17 @@ class Resource(BASE, ModelBase):
     """Represents an abstract resource for a given service."""
 
     __tablename__ = 'resources'
+    __table_args__ = (
+        sa.Index('uniq_resources_service_id_name', 'service_id', 'name',
+                 unique=True),
+    )
 
     service_id = sa.Column(sa.String(36), sa.ForeignKey('services.id'),
                            nullable=False)
     category_id = sa.Column(sa.String(36), sa.ForeignKey('categories.id'),
                             nullable=False)
     name = sa.Column(sa.String(64), nullable=False)
-    parameters = sa.Column(PickledString)
+    parameters = sa.Column(FieldSet)
     absolute = sa.Column(sa.Boolean, nullable=False)
 
     service = orm.relationship(Service, backref=orm.backref('resources'))
@@ -137,27 +266,56 @@ class Usage(BASE, ModelBase):
     """Represents a resource usage."""
 
     __tablename__ = 'usages'
+    __table_args__ = (
+        sa.Index('uniq_usages_resource_id_parameter_digest_auth_digest_'
+                 'instance', 'resource_id', 'parameter_digest',
+                 'auth_digest', 'instance', unique=True),
+    )
 
     resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
                          nullable=False)
-    parameter_data = sa.Column(DictSerialized)
-    auth_data = sa.Column(DictSerialized)
-    used = sa.Column(sa.BigInteger, nullable=False)
-    reserved = sa.Column(sa.BigInteger, nullable=False)
+    _parameter_data = sa.Column('parameter_data', sa.Text)
+    parameter_data = DictSerialized('_parameter_data', 'parameter_digest')
+    parameter_digest = sa.Column(sa.String(40))
+    _auth_data = sa.Column('auth_data', sa.Text)
+    auth_data = DictSerialized('_auth_data', 'auth_digest')
+    auth_digest = sa.Column(sa.String(40))
+    # Changes to the usage of a service instance are rolled up into
+    # the aggregate usage from the attribute history, so the old
+    # value must be loaded before an expired or deferred value is
+    # replaced
+    used = orm.column_property(sa.Column(sa.BigInteger, nullable=False),
+                               active_history=True)
+    reserved = orm.column_property(sa.Column(sa.BigInteger,
+                                             nullable=False),
+                                   active_history=True)
     until_refresh = sa.Column(sa.Integer)
     refresh_id = sa.Column(sa.String(36))
+    instance = sa.Column(sa.String(255), nullable=False, default='')
+    aggregate_id = sa.Column(sa.String(36),
+                             sa.ForeignKey('usages.id',
+                                           name='fk_usages_aggregate_id'),
+                             index=True)
 
     resource = orm.relationship(Resource, backref=orm.backref('usages'))
+    aggregate = orm.relationship('Usage', remote_side='Usage.id',
+                                 backref=orm.backref('instances'))
 
 
 class Quota(BASE, ModelBase):
     """Represents a quota."""
 
     __tablename__ = 'quotas'
+    __table_args__ = (
+        sa.Index('uniq_quotas_resource_id_auth_digest', 'resource_id',
+                 'auth_digest', unique=True),
+    )
 
     resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
                             nullable=False)
-    auth_data = sa.Column(DictSerialized)
+    _auth_data = sa.Column('auth_data', sa.Text)
+    auth_data = DictSerialized('_auth_data', 'auth_digest')
+    auth_digest = sa.Column(sa.String(40))
     limit = sa.Column(sa.BigInteger)
 
     resource = orm.relationship(Resource, backref=orm.backref('quotas'))
@@ -168,7 +326,7 @@ class Reservation(BASE, ModelBase):
 
     __tablename__ = 'reservations'
 
-    expire = sa.Column(sa.DateTime, nullable=False)
+    expire = sa.Column(sa.DateTime, nullable=False, index=True)
 
 
 class ReservedItem(BASE, ModelBase):
@@ -177,11 +335,11 @@ class ReservedItem(BASE, ModelBase):
     __tablename__ = 'reserved_items'
 
     reservation_id = sa.Column(sa.String(36), sa.ForeignKey('reservations.id'),
-                               nullable=False)
+                               nullable=False, index=True)
     resource_id = sa.Column(sa.String(36), sa.ForeignKey('resources.id'),
                             nullable=False)
     usage_id = sa.Column(sa.String(36), sa.ForeignKey('usages.id'),
-                         nullable=False)
+                         nullable=False, index=True)
     delta = sa.Column(sa.BigInteger, nullable=False)
 
     reservation = orm.relationship(Reservation,
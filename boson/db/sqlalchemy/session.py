@@ -0,0 +1,212 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import orm
+from sqlalchemy import pool as sa_pool
+
+from boson.openstack.common import cfg
+from boson.openstack.common.gettextutils import _
+from boson.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+sql_opts = [
+    cfg.StrOpt('sql_connection',
+               default='sqlite:///boson.sqlite',
+               help='The SQLAlchemy connection string used to connect to '
+                    'the database'),
+    cfg.IntOpt('sql_max_pool_size',
+               default=5,
+               help='Maximum number of SQL connections to keep open in '
+                    'the connection pool'),
+    cfg.IntOpt('sql_max_overflow',
+               default=10,
+               help='Number of SQL connections which may be opened beyond '
+                    'sql_max_pool_size under load'),
+    cfg.IntOpt('sql_pool_timeout',
+               default=30,
+               help='Seconds to wait for a connection to become available '
+                    'in the connection pool'),
+    cfg.IntOpt('sql_idle_timeout',
+               default=3600,
+               help='Seconds after which a pooled SQL connection is '
+                    'recycled'),
+    cfg.BoolOpt('sql_pool_pre_ping',
+                default=True,
+                help='Test pooled SQL connections for liveness when they '
+                     'are checked out of the pool after sitting idle for '
+                     'sql_pool_ping_idle seconds'),
+    cfg.IntOpt('sql_pool_ping_idle',
+               default=30,
+               help='Seconds a pooled SQL connection may sit idle before '
+                    'it is tested for liveness on checkout.  Each test '
+                    'costs a round trip; since a connection is checked '
+                    'out for each statement executed outside a '
+                    'transaction, setting this to 0 to test every '
+                    'checkout doubles the round trips of most reads'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(sql_opts)
+
+_ENGINE = None
+_MAKER = None
+
+
+def _checkin_listener(dbapi_conn, connection_rec):
+    """
+    Records the time a connection was returned to the pool, so its
+    idle time can be determined when it is next checked out.
+    """
+
+    connection_rec.info['checkin'] = time.time()
+
+
+def _ping_listener(dbapi_conn, connection_rec, connection_proxy):
+    """
+    Ensures that connections checked out of the pool are still alive.
+    If the database went away while the connection was idle in the
+    pool, a ``DisconnectionError`` is raised, which causes the pool to
+    discard the connection and retry with a fresh one.  Connections
+    which have not been idle for ``sql_pool_ping_idle`` seconds, and
+    fresh connections, are not tested.
+    """
+
+    checkin = connection_rec.info.get('checkin')
+    if checkin is None or time.time() - checkin < CONF.sql_pool_ping_idle:
+        return
+
+    try:
+        cursor = dbapi_conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception as exc:
+        LOG.warning(_("Discarding dead SQL connection: %s") % exc)
+        raise sa_exc.DisconnectionError(str(exc))
+
+
+def _sqlite_connect_listener(dbapi_conn, connection_rec):
+    """
+    Stops the ``sqlite3`` module from beginning and committing
+    transactions on its own, which breaks savepoints; transactions
+    are begun by ``_sqlite_begin_listener()`` instead.  Foreign keys
+    are also enforced, as on other databases.
+    """
+
+    dbapi_conn.isolation_level = None
+    dbapi_conn.execute('PRAGMA foreign_keys = ON')
+
+
+def _sqlite_begin_listener(conn):
+    """
+    Begins a transaction on a SQLite connection.  The statement is
+    issued on the DBAPI connection, as other databases begin
+    transactions implicitly.
+    """
+
+    conn.connection.execute('BEGIN')
+
+
+def get_engine():
+    """
+    Retrieve the engine.  The engine, and its connection pool, is
+    created on first use from the ``sql_*`` configuration options,
+    and is shared by all sessions in the process.
+    """
+
+    global _ENGINE
+
+    if _ENGINE is None:
+        url = sa.engine.url.make_url(CONF.sql_connection)
+        engine_args = {
+            'pool_recycle': CONF.sql_idle_timeout,
+        }
+
+        if url.drivername.startswith('sqlite'):
+            # SQLite cannot use a sized connection pool; an in-memory
+            # database must additionally be shared by all threads, or
+            # each connection would see its own empty database
+            if url.database in (None, '', ':memory:'):
+                engine_args['poolclass'] = sa_pool.StaticPool
+                engine_args['connect_args'] = {'check_same_thread': False}
+        else:
+            engine_args.update(
+                pool_size=CONF.sql_max_pool_size,
+                max_overflow=CONF.sql_max_overflow,
+                pool_timeout=CONF.sql_pool_timeout,
+            )
+
+        engine = sa.create_engine(url, **engine_args)
+
+        if url.drivername.startswith('sqlite'):
+            sa.event.listen(engine, 'connect', _sqlite_connect_listener)
+            sa.event.listen(engine, 'begin', _sqlite_begin_listener)
+
+        if CONF.sql_pool_pre_ping:
+            sa.event.listen(engine, 'checkin', _checkin_listener)
+            sa.event.listen(engine, 'checkout', _ping_listener)
+
+        _ENGINE = engine
+
+    return _ENGINE
+
+
+def get_maker():
+    """
+    Retrieve the session maker.  Sessions are created in autocommit
+    mode, so they only hold a pooled connection while a transaction
+    is open, and do not expire loaded objects on commit, so reading
+    an object after a commit does not cost another round trip.
+    """
+
+    global _MAKER
+
+    if _MAKER is None:
+        _MAKER = orm.sessionmaker(bind=get_engine(), autocommit=True,
+                                  expire_on_commit=False)
+
+    return _MAKER
+
+
+def get_session():
+    """
+    Allocate a new session.
+    """
+
+    return get_maker()()
+
+
+def cleanup():
+    """
+    Dispose of the engine and session maker.  Pooled connections are
+    closed, and the next call to ``get_engine()`` will build a new
+    engine from the current configuration.
+    """
+
+    global _ENGINE
+    global _MAKER
+
+    if _ENGINE is not None:
+        _ENGINE.dispose()
+
+    _ENGINE = None
+    _MAKER = None
@@ -52,3 +52,57 @@ class AmbiguousFieldUpdate(BosonException):
 
 class Duplicate(BosonException):
     message = _("Duplicate object for %(klass)s")
+
+
+class InUse(BosonException):
+    message = _("%(klass)s is still referenced by other objects")
+
+
+class RefreshMismatch(BosonException):
+    message = _("Refresh %(refresh_id)r does not match the pending refresh "
+                "of usage %(usage_id)s")
+
+
+class UsageRefreshNeeded(BosonException):
+    """
+    Raised when a reservation is rejected because the usage
+    information it depends on is stale.  The ``usages`` attribute
+    lists all the stale usages; the service should send fresh usage
+    information for each, quoting its ``refresh_id``, and then retry
+    the reservation.
+    """
+
+    message = _("Usage information must be refreshed for %(count)d "
+                "usage(s)")
+
+    def __init__(self, usages):
+        """
+        Initialize a UsageRefreshNeeded exception.
+
+        :param usages: A list of the stale ``boson.db.models.Usage``
+                       objects.
+        """
+
+        super(UsageRefreshNeeded, self).__init__(count=len(usages))
+        self.usages = usages
+
+
+class QuotaExceeded(BosonException):
+    """
+    Raised when a request exceeds the quota limits of one or more
+    resources.  The ``resources`` attribute lists the IDs of all the
+    resources whose limits would be exceeded.
+    """
+
+    message = _("Quota exceeded for %(count)d resource(s)")
+
+    def __init__(self, resources):
+        """
+        Initialize a QuotaExceeded exception.
+
+        :param resources: A list of the IDs of the resources whose
+                          limits would be exceeded.
+        """
+
+        super(QuotaExceeded, self).__init__(count=len(resources))
+        self.resources = resources
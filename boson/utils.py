@@ -15,12 +15,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import re
 import uuid
 
 
-serialize_re = re.compile(r"""[/%="']""")
-deserialize_re = re.compile(r'%([0-9A-Fa-f]{2})')
+# Maximum number of strings memoized by each of dict_serialize() and
+# dict_deserialize()
+CODEC_CACHE_SIZE = 1024
+
+# The characters escaped in serialized strings, and their escapes.
+# The escape character itself must be replaced first.
+_ESCAPES = (('%', '%25'), ('/', '%2F'), ('=', '%3D'), ('"', '%22'),
+            ("'", '%27'))
+_escape_re = re.compile(r"""[/%="']""")
+
+# Maps two hexadecimal digits, in either case, to the character they
+# encode
+_HEX_DIGITS = '0123456789abcdefABCDEF'
+_UNESCAPES = dict((a + b, chr(int(a + b, 16)))
+                  for a in _HEX_DIGITS for b in _HEX_DIGITS)
+
+_CONSTANTS = {'null': None, 'true': True, 'false': False}
+
+_serialize_cache = {}
+_deserialize_cache = {}
 
 
 def _serialize(value):
@@ -29,7 +48,14 @@ def _serialize(value):
     JSON except for floats.  Returns an encoded string.
     """
 
-    if value is None:
+    # Strings are the most common values
+    if isinstance(value, basestring):
+        if _escape_re.search(value):
+            for char, escape in _ESCAPES:
+                if char in value:
+                    value = value.replace(char, escape)
+        return '"%s"' % value
+    elif value is None:
         return 'null'
     elif value is True:
         return 'true'
@@ -37,27 +63,47 @@ def _serialize(value):
         return 'false'
     elif isinstance(value, (int, long)):
         return str(value)
-    elif isinstance(value, basestring):
-        return '"%s"' % serialize_re.sub(lambda x: '%%%02X' % ord(x.group(0)),
-                                         value)
     else:
         raise ValueError("Cannot encode value %r" % value)
 
 
+def _unescape(value):
+    """
+    Decode the escapes in a serialized string.  A '%' not followed by
+    two hexadecimal digits is left as is.
+    """
+
+    if '%' not in value:
+        return value
+
+    parts = value.split('%')
+    result = [parts[0]]
+    for part in parts[1:]:
+        char = _UNESCAPES.get(part[:2])
+        if char is None:
+            result.append('%')
+            result.append(part)
+        else:
+            result.append(char)
+            result.append(part[2:])
+
+    return ''.join(result)
+
+
 def _deserialize(value):
     """
     Deserialize a single value.  Accepts all value types recognized by
     JSON except for floats.  Returns the decoded value.
     """
 
-    if (value[:1], value[-1:]) in [('"', '"'), ("'", "'")]:
-        return deserialize_re.sub(lambda x: chr(int(x.group(1), 16)),
-                                  value[1:-1])
+    quote = value[:1]
+    if quote in ('"', "'") and value[-1:] == quote:
+        return _unescape(value[1:-1])
     elif value.isdigit():
         return int(value)
     else:
         try:
-            return dict(null=None, true=True, false=False)[value.lower()]
+            return _CONSTANTS[value.lower()]
         except KeyError:
             raise ValueError("Cannot decode value %r" % value)
 
@@ -68,24 +114,70 @@ def dict_serialize(data):
     key ordering.  This format is suitable for table searching.
     """
 
-    result = ['%s=%s' % (k, _serialize(v)) for k, v in
-              sorted(data.items(), key=lambda x: x[0])]
+    items = sorted(data.items())
+    key = tuple(items)
+    try:
+        return _serialize_cache[key]
+    except (KeyError, TypeError):
+        pass
+
+    result = '/'.join(['%s=%s' % (k, _serialize(v)) for k, v in items])
+
+    # Only dictionaries of strings are memoized; since True == 1, a
+    # dictionary containing a number could otherwise be mistaken for
+    # one containing a boolean
+    for _k, v in items:
+        if v is not None and not isinstance(v, basestring):
+            break
+    else:
+        # Keep the cache bounded
+        if len(_serialize_cache) >= CODEC_CACHE_SIZE:
+            _serialize_cache.clear()
+        _serialize_cache[key] = result
 
-    return '/'.join(result)
+    return result
 
 
 def dict_deserialize(data):
     """
     Deserialize a data string, as generated by dict_serialize(), into
-    an appropriate data dictionary.
+    an appropriate data dictionary.  Each call returns a new
+    dictionary.
     """
 
-    result = {}
-    for comp in data.split('/'):
-        key, value = comp.split('=')
-        result[key] = _deserialize(value)
+    if not data:
+        # dict_serialize() produces an empty string for an empty
+        # dictionary
+        return {}
 
-    return result
+    result = _deserialize_cache.get(data)
+    if result is None:
+        result = {}
+        for comp in data.split('/'):
+            key, value = comp.split('=')
+            result[key] = _deserialize(value)
+
+        # Keep the cache bounded
+        if len(_deserialize_cache) >= CODEC_CACHE_SIZE:
+            _deserialize_cache.clear()
+        _deserialize_cache[data] = result
+
+    return dict(result)
+
+
+def dict_digest(data):
+    """
+    Compute a fixed-width digest of a data dictionary.  The digest is
+    computed over the dict_serialize() form of the dictionary, so
+    equal dictionaries always have equal digests.  Returns a string of
+    40 hexadecimal digits.
+    """
+
+    serialized = dict_serialize(data)
+    if isinstance(serialized, unicode):
+        serialized = serialized.encode('utf-8')
+
+    return hashlib.sha1(serialized).hexdigest()
 
 
 def generate_uuid():
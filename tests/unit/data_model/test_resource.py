@@ -0,0 +1,81 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.data_model import resource
+
+import tests
+
+
+class SpecificResourceTestCase(tests.TestCase):
+    def setUp(self):
+        super(SpecificResourceTestCase, self).setUp()
+
+        self.res = resource.Resource(mock.Mock(), 'images', ['zone'])
+        self.res.service.name = 'glance'
+
+    def test_name(self):
+        spc = resource.SpecificResource(self.res,
+                                        dict(zone='east', spam='eggs'))
+
+        self.assertEqual(spc.name, "glance/images/zone='east'")
+        self.assertEqual(spc.param_data, dict(zone='east'))
+        self.assertEqual(hash(spc), hash(spc.name))
+
+    def test_missing(self):
+        self.assertRaises(ValueError, resource.SpecificResource, self.res,
+                          dict(spam='eggs'))
+
+    def test_interned(self):
+        spc1 = resource.SpecificResource(self.res,
+                                         dict(zone='east', spam='eggs'))
+        spc2 = resource.SpecificResource(self.res, dict(zone='east'))
+        spc3 = resource.SpecificResource(self.res, dict(zone='west'))
+
+        self.assertIs(spc1, spc2)
+        self.assertIsNot(spc1, spc3)
+        self.assertEqual(len(dict.fromkeys([spc1, spc2, spc3])), 2)
+
+    def test_interned_by_type(self):
+        spc1 = resource.SpecificResource(self.res, dict(zone=1))
+        spc2 = resource.SpecificResource(self.res, dict(zone=True))
+        spc3 = resource.SpecificResource(self.res, dict(zone='x'))
+        spc4 = resource.SpecificResource(self.res, dict(zone=u'x'))
+
+        self.assertIsNot(spc1, spc2)
+        self.assertEqual(spc2.name, 'glance/images/zone=True')
+        self.assertIsNot(spc3, spc4)
+        self.assertEqual(spc4.name, "glance/images/zone=u'x'")
+
+    def test_equal_not_interned(self):
+        other = resource.Resource(self.res.service, 'images', ['zone'])
+
+        spc1 = resource.SpecificResource(self.res, dict(zone='east'))
+        spc2 = resource.SpecificResource(other, dict(zone='east'))
+
+        self.assertIsNot(spc1, spc2)
+        self.assertEqual(spc1, spc2)
+        self.assertFalse(spc1 != spc2)
+        self.assertEqual(hash(spc1), hash(spc2))
+
+    def test_unhashable(self):
+        spc1 = resource.SpecificResource(self.res, dict(zone=['east']))
+        spc2 = resource.SpecificResource(self.res, dict(zone=['east']))
+
+        self.assertIsNot(spc1, spc2)
+        self.assertEqual(spc1, spc2)
@@ -0,0 +1,728 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+from boson import context
+from boson.db.memory import api
+from boson.db import models
+from boson import exceptions
+from boson.openstack.common import cfg
+
+import tests
+
+
+class BaseMemoryTestCase(tests.TestCase):
+    def setUp(self):
+        super(BaseMemoryTestCase, self).setUp()
+
+        self.dbapi = api.API()
+        self.context = context.Context('user', 'tenant')
+
+        self.svc = self.dbapi.create_service(self.context, 'nova',
+                                             ['tenant_id', 'quota_class'])
+        self.cat = self.dbapi.create_category(
+            self.context, self.svc, 'tenant', ['tenant_id'],
+            [['tenant_id'], ['quota_class'], []])
+        self.res = self.dbapi.create_resource(self.context, self.svc,
+                                              self.cat.id, 'instances', [])
+
+
+class RegistryTestCase(BaseMemoryTestCase):
+    def test_get_service(self):
+        by_id = self.dbapi.get_service(self.context, id=self.svc.id)
+        by_name = self.dbapi.get_service(self.context, name='nova')
+
+        self.assertIsInstance(by_id, models.Service)
+        self.assertEqual(by_id.id, self.svc.id)
+        self.assertEqual(by_name.id, self.svc.id)
+        self.assertEqual(by_name.auth_fields,
+                         set(['tenant_id', 'quota_class']))
+
+    def test_get_service_badargs(self):
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context)
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context,
+                          id=self.svc.id, name='nova')
+
+    def test_get_service_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          name='glance')
+
+    def test_get_category(self):
+        cat = self.dbapi.get_category(self.context, service=self.svc.id,
+                                      name='tenant')
+
+        self.assertEqual(cat.id, self.cat.id)
+        self.assertEqual(cat.usage_fset, set(['tenant_id']))
+        self.assertEqual(cat.quota_fsets,
+                         [set(['tenant_id']), set(['quota_class']), set()])
+        self.assertEqual(cat.service.id, self.svc.id)
+
+    def test_get_category_badargs(self):
+        self.assertRaises(TypeError, self.dbapi.get_category, self.context,
+                          service=self.svc)
+
+    def test_get_resource(self):
+        res = self.dbapi.get_resource(self.context, service=self.svc,
+                                      name='instances')
+
+        self.assertEqual(res.id, self.res.id)
+        self.assertEqual(res.parameters, set())
+        self.assertEqual(res.absolute, False)
+        self.assertEqual(res.category.id, self.cat.id)
+
+    def test_list_refs(self):
+        svc = self.dbapi.get_service(self.context, id=self.svc.id)
+
+        self.assertEqual([c.id for c in svc.categories], [self.cat.id])
+        self.assertEqual([r.id for r in svc.resources], [self.res.id])
+        self.assertEqual([r.id for r in self.cat.resources], [self.res.id])
+
+    def test_duplicate_service(self):
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_service,
+                          self.context, 'nova', ['tenant_id'])
+
+    def test_duplicate_resource(self):
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_resource,
+                          self.context, self.svc, self.cat, 'instances', [])
+        self.assertEqual(len(self.dbapi.get_resources(self.context,
+                                                      self.svc)), 1)
+
+    def test_returned_copies(self):
+        svc = self.dbapi.get_service(self.context, id=self.svc.id)
+
+        svc.auth_fields.add('user_id')
+        self.context.session = None
+
+        self.assertEqual(self.dbapi.get_service(
+            self.context, id=self.svc.id).auth_fields,
+            set(['tenant_id', 'quota_class']))
+
+
+class TransactionTestCase(BaseMemoryTestCase):
+    def test_commit(self):
+        with self.dbapi.transaction(self.context):
+            self.dbapi.create_service(self.context, 'glance', ['tenant_id'])
+
+        self.assertEqual(self.context.session.undo, [])
+        self.assertEqual(len(self.dbapi.get_services(self.context)), 2)
+
+    def test_rollback(self):
+        other = self.dbapi.create_category(self.context, self.svc, 'other',
+                                           [], [[]])
+
+        try:
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_service(self.context, 'glance',
+                                          ['tenant_id'])
+                self.res.name = 'servers'
+                other.delete()
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertEqual([s.name for s in self.dbapi.get_services(
+            self.context)], ['nova'])
+        self.assertEqual(self.dbapi.get_resource(
+            self.context, service=self.svc, name='instances').id,
+            self.res.id)
+        self.assertRaises(KeyError, self.dbapi.get_resource, self.context,
+                          service=self.svc, name='servers')
+        self.assertEqual(self.dbapi.get_category(
+            self.context, id=other.id).name, 'other')
+
+    def test_rollback_nested(self):
+        with self.dbapi.transaction(self.context):
+            self.dbapi.create_service(self.context, 'glance', ['tenant_id'])
+            try:
+                with self.dbapi.transaction(self.context):
+                    self.dbapi.create_service(self.context, 'cinder',
+                                              ['tenant_id'])
+                    raise ValueError('spam')
+            except ValueError:
+                pass
+
+        self.assertEqual(sorted(s.name for s in self.dbapi.get_services(
+            self.context)), ['glance', 'nova'])
+
+    def test_duplicate_in_transaction(self):
+        def create():
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_category(self.context, self.svc, 'other',
+                                           [], [[]])
+                self.dbapi.create_category(self.context, self.svc, 'tenant',
+                                           [], [[]])
+
+        self.assertRaises(exceptions.Duplicate, create)
+        self.assertEqual([c.name for c in self.dbapi.get_categories(
+            self.context, self.svc)], ['tenant'])
+
+    def test_duplicate_save(self):
+        res = self.dbapi.create_resource(self.context, self.svc, self.cat,
+                                         'cores', [])
+
+        self.assertRaises(exceptions.Duplicate, setattr, res, 'name',
+                          'instances')
+        self.assertEqual(self.dbapi.get_resource(
+            self.context, service=self.svc, name='cores').id, res.id)
+
+
+class UsageQuotaTestCase(BaseMemoryTestCase):
+    def test_usage(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'), used=3)
+
+        result = self.dbapi.get_usage(self.context, resource=self.res.id,
+                                      param_data={},
+                                      auth_data=dict(tenant_id='spam'))
+
+        self.assertEqual(result.id, usage.id)
+        self.assertEqual(result.used, 3)
+        self.assertEqual(result.reserved, 0)
+        self.assertEqual(result.resource.id, self.res.id)
+        self.assertEqual(len(self.dbapi.get_usages(
+            self.context, auth_data=dict(tenant_id='spam'))), 1)
+        self.assertEqual(self.dbapi.get_usages(
+            self.context, auth_data=dict(tenant_id='eggs')), [])
+
+    def test_usage_changed_key(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+
+        usage.auth_data = dict(tenant_id='eggs')
+
+        self.assertRaises(KeyError, self.dbapi.get_usage, self.context,
+                          resource=self.res, param_data={},
+                          auth_data=dict(tenant_id='spam'))
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, resource=self.res, param_data={},
+            auth_data=dict(tenant_id='eggs')).id, usage.id)
+
+    def test_duplicate_usage(self):
+        self.dbapi.create_usage(self.context, self.res, {},
+                                dict(tenant_id='spam'))
+
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_usage,
+                          self.context, self.res, {}, dict(tenant_id='spam'))
+
+    def test_quota(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.limit = 20
+
+        result = self.dbapi.get_quota(self.context, resource=self.res,
+                                      auth_data={})
+        self.assertEqual(result.id, quota.id)
+        self.assertEqual(result.limit, 20)
+        self.assertEqual([q.id for q in self.res.quotas], [quota.id])
+
+    def test_delete(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.delete()
+
+        self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                          id=quota.id)
+        self.assertEqual(self.dbapi.get_quotas(self.context), [])
+
+    def test_effective_quotas(self):
+        cores = self.dbapi.create_resource(self.context, self.svc, self.cat,
+                                           'cores', [])
+        self.dbapi.create_quota(self.context, self.res, {}, 10)
+        self.dbapi.create_quota(self.context, self.res,
+                                dict(quota_class='gold'), 20)
+        self.dbapi.create_quota(self.context, self.res,
+                                dict(tenant_id='spam'), 30)
+
+        result = self.dbapi.get_effective_quotas(
+            self.context, [self.res, cores.id],
+            dict(tenant_id='eggs', quota_class='gold'))
+
+        self.assertEqual(result[self.res.id].limit, 20)
+        self.assertEqual(result[cores.id], None)
+        self.assertRaises(KeyError, self.dbapi.get_effective_quotas,
+                          self.context, ['missing'], {})
+
+
+class PaginationTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+
+        for i in range(5):
+            self.dbapi.create_usage(self.context, self.res, {},
+                                    dict(tenant_id='tenant%d' % i))
+
+        self.ids = sorted(usage.id for usage in
+                          self.dbapi.get_usages(self.context))
+
+    def test_marker_limit(self):
+        result = self.dbapi.get_usages(self.context, marker=self.ids[1],
+                                       limit=2)
+
+        self.assertEqual([usage.id for usage in result], self.ids[2:4])
+
+    def test_iter_usages(self):
+        result = self.dbapi.iter_usages(self.context, resource=self.res,
+                                        chunk_size=2)
+
+        self.assertEqual([usage.id for usage in result], self.ids)
+
+
+class ReserveTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(ReserveTestCase, self).setUp()
+
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+    def test_reserve_many(self):
+        items = self.dbapi.reserve_many(self.context, self.resv, [
+            (self.res, self.usage, 2),
+            (self.res, self.usage.id, -1),
+            (self.res, self.usage, 1),
+        ])
+
+        self.assertEqual([i.delta for i in items], [2, -1, 1])
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 3)
+        resv = self.dbapi.get_reservation(self.context, self.resv.id)
+        self.assertEqual(len(resv.reserved_items), 3)
+        self.assertEqual(items[0].usage.id, self.usage.id)
+
+    def test_reserve_many_missing_usage(self):
+        self.assertRaises(KeyError, self.dbapi.reserve_many, self.context,
+                          self.resv, [(self.res, 'missing', 1)])
+        self.assertEqual(self.dbapi.get_reservation(
+            self.context, self.resv.id).reserved_items, [])
+
+    def test_reserve_many_missing_reservation(self):
+        self.assertRaises(KeyError, self.dbapi.reserve_many, self.context,
+                          'missing', [(self.res, self.usage, 1)])
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 0)
+        self.assertEqual(self.dbapi._tables[
+            models.ReservedItem].records, {})
+
+    def test_delete_referenced(self):
+        self.dbapi.reserve(self.context, self.resv, self.res, self.usage, 2)
+
+        self.assertRaises(exceptions.InUse, self.usage.delete)
+        self.assertRaises(exceptions.InUse, self.resv.delete)
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 2)
+        self.assertEqual(len(self.dbapi.get_reservation(
+            self.context, self.resv.id).reserved_items), 1)
+
+    def test_expire(self):
+        self.dbapi.reserve(self.context, self.resv, self.res, self.usage, 2)
+        live = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2100, 1, 1))
+        self.dbapi.reserve(self.context, live, self.res, self.usage, 3)
+
+        self.assertEqual(self.dbapi.expire_reservations(self.context), 1)
+
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 3)
+        self.assertRaises(KeyError, self.dbapi.get_reservation,
+                          self.context, self.resv.id)
+        self.assertEqual(self.dbapi.expire_reservations(self.context), 0)
+
+
+class AbsoluteCheckTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(AbsoluteCheckTestCase, self).setUp()
+
+        self.files = self.dbapi.create_resource(
+            self.context, self.svc, self.cat, 'injected_files', [],
+            absolute=True)
+        self.dbapi.create_quota(self.context, self.files,
+                                dict(tenant_id='spam'), 5)
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+    def test_check_absolute(self):
+        self.dbapi.check_absolute(self.context, [(self.files, 5)],
+                                  dict(tenant_id='spam'))
+
+        with self.assertRaises(exceptions.QuotaExceeded) as cm:
+            self.dbapi.check_absolute(self.context, [(self.files, 3),
+                                                     (self.files.id, 3)],
+                                      dict(tenant_id='spam'))
+        self.assertEqual(cm.exception.resources, [self.files.id])
+
+    def test_check_reserve(self):
+        items = self.dbapi.check_reserve(self.context, self.resv, [
+            (self.files, None, 4),
+            (self.res, self.usage, 2),
+        ], dict(tenant_id='spam'))
+
+        self.assertEqual([(i.resource_id, i.delta) for i in items],
+                         [(self.res.id, 2)])
+        self.assertRaises(exceptions.QuotaExceeded,
+                          self.dbapi.check_reserve, self.context, self.resv,
+                          [(self.files.id, None, 6),
+                           (self.res.id, self.usage.id, 2)],
+                          dict(tenant_id='spam'))
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 2)
+
+
+class UsageRefreshTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(UsageRefreshTestCase, self).setUp()
+
+        cfg.CONF.set_override('usage_refresh_interval', 2)
+        cfg.CONF.set_override('usage_refresh_jitter', 0)
+
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+    def tearDown(self):
+        cfg.CONF.clear_override('usage_refresh_interval')
+        cfg.CONF.clear_override('usage_refresh_jitter')
+
+        super(UsageRefreshTestCase, self).tearDown()
+
+    def _reserve(self):
+        return self.dbapi.reserve_many(self.context, self.resv,
+                                       [(self.res, self.usage, 1)])
+
+    def test_count_down(self):
+        for i in range(2):
+            self._reserve()
+
+        with self.assertRaises(exceptions.UsageRefreshNeeded) as cm:
+            self._reserve()
+
+        self.assertEqual([u.id for u in cm.exception.usages],
+                         [self.usage.id])
+        usage = self.dbapi.get_usage(self.context, id=self.usage.id)
+        self.assertEqual(usage.reserved, 2)
+        self.assertEqual(usage.until_refresh, 0)
+        self.assertEqual(usage.refresh_id, cm.exception.usages[0].refresh_id)
+        self.assertIsNotNone(usage.refresh_id)
+
+    def test_refresh(self):
+        for i in range(2):
+            self._reserve()
+        with self.assertRaises(exceptions.UsageRefreshNeeded) as cm:
+            self._reserve()
+        refresh_id = cm.exception.usages[0].refresh_id
+
+        self.assertRaises(exceptions.RefreshMismatch,
+                          self.dbapi.refresh_usage, self.context,
+                          self.usage.id, 'wrong', 5)
+        usage = self.dbapi.refresh_usage(self.context, self.usage,
+                                         refresh_id, 5)
+
+        self.assertEqual(usage.used, 5)
+        self.assertEqual(usage.until_refresh, 2)
+        self.assertIsNone(usage.refresh_id)
+        self.assertEqual(len(self._reserve()), 1)
+
+    def test_stale_in_transaction(self):
+        for i in range(2):
+            self._reserve()
+
+        def reserve():
+            with self.dbapi.transaction(self.context):
+                self._reserve()
+
+        self.assertRaises(exceptions.UsageRefreshNeeded, reserve)
+
+        usage = self.dbapi.get_usage(self.context, id=self.usage.id)
+        self.assertIsNotNone(usage.refresh_id)
+        self.dbapi.refresh_usage(self.context, usage, usage.refresh_id, 1)
+
+
+class AggregateUsageTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(AggregateUsageTestCase, self).setUp()
+
+        self.chicago = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=3,
+            reserved=1, instance='chicago')
+        self.london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=2,
+            instance='london')
+
+    def _aggregate(self):
+        return self.dbapi.get_usage(self.context, resource=self.res,
+                                    param_data={},
+                                    auth_data=dict(tenant_id='spam'))
+
+    def test_create(self):
+        aggregate = self._aggregate()
+
+        self.assertEqual(aggregate.used, 5)
+        self.assertEqual(aggregate.reserved, 1)
+        self.assertEqual(self.london.aggregate.id, aggregate.id)
+        self.assertEqual(sorted(u.instance for u in aggregate.instances),
+                         ['chicago', 'london'])
+
+    def test_reserve_expire(self):
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+        self.dbapi.reserve_many(self.context, resv, [
+            (self.res, self.chicago, 2),
+            (self.res, self.london, 4),
+            (self.res, self.london, -1),
+        ])
+
+        self.assertEqual(self._aggregate().reserved, 7)
+
+        self.dbapi.expire_reservations(self.context)
+
+        self.assertEqual(self._aggregate().reserved, 1)
+
+    def test_save_delete(self):
+        self.london.used = 6
+        self.assertEqual(self._aggregate().used, 9)
+
+        self.chicago.delete()
+        self.assertEqual(self._aggregate().used, 6)
+        self.assertEqual(self._aggregate().reserved, 0)
+
+    def test_delete_aggregate(self):
+        self._aggregate().delete()
+
+        self.assertIsNone(self.dbapi.get_usage(
+            self.context, id=self.chicago.id).aggregate_id)
+
+
+class CommitDeltasTestCase(BaseMemoryTestCase):
+    def test_commit_deltas(self):
+        chicago = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=3,
+            instance='chicago')
+        london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=2,
+            instance='london')
+
+        self.dbapi.commit_deltas(self.context, [(chicago, -2),
+                                                (london.id, -1)])
+
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=chicago.id).used, 1)
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=london.aggregate_id).used, 2)
+        self.assertEqual(self.dbapi._tables[
+            models.ReservedItem].records, {})
+
+    def test_missing_usage(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'), used=3)
+
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [(usage, -1), ('missing', -1)])
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [('missing', 0)])
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [('missing', 1), ('missing', -1)])
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=usage.id).used, 3)
+
+
+class UnitOfWorkTestCase(BaseMemoryTestCase):
+    def setUp(self):
+        super(UnitOfWorkTestCase, self).setUp()
+
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+
+    def _get(self, usage_id):
+        return self.dbapi.get_usage(self.context, id=usage_id)
+
+    def test_coalesced(self):
+        with self.dbapi.transaction(self.context):
+            self.usage.used = 3
+            self.usage.reserved = 2
+            stored = self.dbapi._tables[models.Usage].records[self.usage.id]
+            self.assertEqual(stored['used'], 0)
+            self.assertEqual(len(self.context.session.pending), 1)
+
+        result = self._get(self.usage.id)
+        self.assertEqual((result.used, result.reserved), (3, 2))
+        self.assertEqual(self.context.session.pending, [])
+
+    def test_only_changed_fields(self):
+        other = self.dbapi.get_usage(context.Context('user', 'tenant'),
+                                     id=self.usage.id)
+
+        with self.dbapi.transaction(self.context):
+            self.usage.used = 3
+            other.reserved = 2
+
+        result = self._get(self.usage.id)
+        self.assertEqual((result.used, result.reserved), (3, 2))
+
+    def test_flush(self):
+        with self.dbapi.transaction(self.context) as trans:
+            self.usage.used = 3
+            trans.flush()
+            self.assertEqual(self._get(self.usage.id).used, 3)
+
+    def test_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.usage.used = 3
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertEqual(self._get(self.usage.id).used, 0)
+        self.assertEqual(self.context.session.pending, [])
+
+    def test_rollback_nested(self):
+        with self.dbapi.transaction(self.context):
+            self.usage.used = 3
+            try:
+                with self.dbapi.transaction(self.context):
+                    self.usage.reserved = 2
+                    raise ValueError('spam')
+            except ValueError:
+                pass
+
+        result = self._get(self.usage.id)
+        self.assertEqual((result.used, result.reserved), (3, 0))
+
+    def test_rollback_interleaved(self):
+        london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='eggs'), used=2,
+            instance='london')
+        chicago = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='eggs'), used=1,
+            instance='chicago')
+        other = context.Context('user', 'tenant')
+
+        try:
+            with self.dbapi.transaction(self.context):
+                london.used = 4
+                london.until_refresh = 5
+                self.dbapi.flush(self.context)
+
+                # Another context changes the same records before the
+                # transaction is rolled back
+                self.dbapi.commit_deltas(other, [(london.id, 3),
+                                                 (chicago.id, 1)])
+                usage = self.dbapi.get_usage(other, id=london.id)
+                usage.refresh_id = 'refresh'
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        result = self._get(london.id)
+        self.assertEqual((result.used, result.until_refresh,
+                          result.refresh_id), (5, 0, 'refresh'))
+        self.assertEqual(self._get(london.aggregate_id).used, 7)
+
+    def test_rollback_removed(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.usage.used = 3
+                self.dbapi.flush(self.context)
+                self.dbapi.get_usage(context.Context('user', 'tenant'),
+                                     id=self.usage.id).delete()
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertRaises(KeyError, self._get, self.usage.id)
+
+    def test_commit_fails(self):
+        other = self.dbapi.create_resource(self.context, self.svc, self.cat,
+                                           'cores', [])
+
+        def rename():
+            with self.dbapi.transaction(self.context):
+                self.usage.used = 3
+                other.name = 'instances'
+
+        self.assertRaises(exceptions.Duplicate, rename)
+        self.assertEqual(self.context.session.marks, [])
+        self.assertEqual(self._get(self.usage.id).used, 0)
+
+    def test_aggregate(self):
+        london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='eggs'), used=2,
+            instance='london')
+
+        with self.dbapi.transaction(self.context):
+            london.used = 4
+            london.used = 5
+
+        self.assertEqual(self._get(london.aggregate_id).used, 5)
+
+        with self.dbapi.transaction(self.context):
+            london.used = 6
+            london.delete()
+
+        self.assertEqual(self._get(london.aggregate_id).used, 0)
+
+
+class IdentityMapTestCase(BaseMemoryTestCase):
+    def test_same_object(self):
+        by_id = self.dbapi.get_resource(self.context, id=self.res.id)
+        by_name = self.dbapi.get_resource(self.context, service=self.svc,
+                                          name='instances')
+
+        self.assertIs(by_id, self.res)
+        self.assertIs(by_name, self.res)
+        self.assertIs(self.res.category, self.cat)
+
+    def test_refreshed(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+        items = self.dbapi.reserve_many(self.context, resv, [
+            (self.res, usage, 2),
+            (self.res, usage, 1),
+        ])
+
+        self.assertIs(items[0].usage, items[1].usage)
+        self.assertIs(items[0].usage, usage)
+        self.assertEqual(usage.reserved, 3)
+
+    def test_deleted(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.delete()
+
+        self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                          id=quota.id)
+
+    def test_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                svc = self.dbapi.create_service(self.context, 'glance', [])
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          id=svc.id)
+        self.assertIsNot(self.dbapi.get_service(self.context, id=self.svc.id),
+                         self.svc)
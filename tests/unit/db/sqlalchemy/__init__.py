@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sqlalchemy as sa
+
+from boson import context
+from boson.db.sqlalchemy import api
+from boson.db.sqlalchemy import models as sa_models
+from boson.db.sqlalchemy import session
+from boson.openstack.common import cfg
+
+import tests
+
+
+class DBTestCase(tests.TestCase):
+    """
+    Base class for tests which need a real database.  Each test gets
+    a fresh in-memory SQLite database with all tables created.
+    """
+
+    def setUp(self):
+        super(DBTestCase, self).setUp()
+
+        cfg.CONF.set_override('sql_connection', 'sqlite://')
+        session.cleanup()
+        engine = session.get_engine()
+        sa_models.BASE.metadata.create_all(engine)
+
+        # Record the statements issued, for counting queries
+        self.statements = []
+        sa.event.listen(engine, 'before_cursor_execute', self._record)
+
+        api._REGISTRY.clear()
+        api._QUOTAS.clear()
+        self.dbapi = api.API()
+        self.context = context.Context('user', 'tenant')
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    def tearDown(self):
+        session.cleanup()
+        cfg.CONF.clear_override('sql_connection')
+
+        super(DBTestCase, self).tearDown()
@@ -0,0 +1,1742 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+
+from boson import context
+from boson.db.memory import api as memory_api
+from boson.db import models
+from boson.db.sqlalchemy import api
+from boson import exceptions
+from boson.openstack.common import cfg
+from boson import utils
+
+from tests.unit.db import sqlalchemy as db_tests
+
+
+class GetIdTestCase(db_tests.DBTestCase):
+    def test_uuid(self):
+        self.assertEqual(api._get_id('uuid'), 'uuid')
+
+    def test_model(self):
+        svc = self.dbapi.create_service(self.context, 'nova', ['tenant_id'])
+
+        self.assertEqual(api._get_id(svc), svc.id)
+
+
+class SessionTestCase(db_tests.DBTestCase):
+    def test_session_reused(self):
+        self.dbapi.create_service(self.context, 'nova', ['tenant_id'])
+        sess = self.context.session
+
+        self.dbapi.get_service(self.context, name='nova')
+
+        self.assertIsNotNone(sess)
+        self.assertEqual(id(self.context.session), id(sess))
+
+    def test_transaction_commit(self):
+        with self.dbapi.transaction(self.context):
+            self.dbapi.create_service(self.context, 'nova', ['tenant_id'])
+
+        self.assertFalse(self.context.session.is_active)
+        self.assertEqual(len(self.dbapi.get_services(self.context)), 1)
+
+    def test_transaction_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_service(self.context, 'nova',
+                                          ['tenant_id'])
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertEqual(self.dbapi.get_services(self.context), [])
+
+    def test_transaction_nested(self):
+        with self.dbapi.transaction(self.context):
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_service(self.context, 'nova',
+                                          ['tenant_id'])
+
+            # Still inside the outer transaction
+            self.assertTrue(self.context.session.is_active)
+
+        self.assertEqual(len(self.dbapi.get_services(self.context)), 1)
+
+
+class BaseRegistryTestCase(db_tests.DBTestCase):
+    def setUp(self):
+        super(BaseRegistryTestCase, self).setUp()
+
+        self.svc = self.dbapi.create_service(self.context, 'nova',
+                                             ['tenant_id', 'quota_class'])
+        self.cat = self.dbapi.create_category(
+            self.context, self.svc, 'tenant', ['tenant_id'],
+            [['tenant_id'], ['quota_class'], []])
+        self.res = self.dbapi.create_resource(self.context, self.svc,
+                                              self.cat.id, 'instances', [])
+
+
+class RegistryTestCase(BaseRegistryTestCase):
+    def test_get_service(self):
+        by_id = self.dbapi.get_service(self.context, id=self.svc.id)
+        by_name = self.dbapi.get_service(self.context, name='nova')
+
+        self.assertIsInstance(by_id, models.Service)
+        self.assertEqual(by_id.id, self.svc.id)
+        self.assertEqual(by_name.id, self.svc.id)
+        self.assertEqual(by_name.auth_fields,
+                         set(['tenant_id', 'quota_class']))
+
+    def test_get_service_badargs(self):
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context)
+        self.assertRaises(TypeError, self.dbapi.get_service, self.context,
+                          id=self.svc.id, name='nova')
+
+    def test_get_service_missing(self):
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          name='glance')
+
+    def test_get_category(self):
+        cat = self.dbapi.get_category(self.context, service=self.svc.id,
+                                      name='tenant')
+
+        self.assertEqual(cat.id, self.cat.id)
+        self.assertEqual(cat.usage_fset, set(['tenant_id']))
+        self.assertEqual(cat.quota_fsets,
+                         [set(['tenant_id']), set(['quota_class']), set()])
+        self.assertEqual(cat.service.id, self.svc.id)
+
+    def test_get_category_badargs(self):
+        self.assertRaises(TypeError, self.dbapi.get_category, self.context,
+                          service=self.svc)
+
+    def test_get_resource(self):
+        res = self.dbapi.get_resource(self.context, service=self.svc,
+                                      name='instances')
+
+        self.assertEqual(res.id, self.res.id)
+        self.assertEqual(res.parameters, set())
+        self.assertEqual(res.absolute, False)
+        self.assertEqual(res.category.id, self.cat.id)
+
+    def test_list_refs(self):
+        svc = self.dbapi.get_service(self.context, id=self.svc.id)
+
+        self.assertEqual([c.id for c in svc.categories], [self.cat.id])
+        self.assertEqual([r.id for r in svc.resources], [self.res.id])
+
+    def test_duplicate_service(self):
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_service,
+                          self.context, 'nova', ['tenant_id'])
+
+    def test_duplicate_resource(self):
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_resource,
+                          self.context, self.svc, self.cat, 'instances', [])
+
+        # The session is still usable
+        self.assertEqual(len(self.dbapi.get_resources(self.context,
+                                                      self.svc)), 1)
+
+    def test_duplicate_in_transaction(self):
+        def create():
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_category(self.context, self.svc, 'other',
+                                           [], [[]])
+                self.dbapi.create_category(self.context, self.svc, 'tenant',
+                                           [], [[]])
+
+        self.assertRaises(exceptions.Duplicate, create)
+        self.assertEqual([c.name for c in self.dbapi.get_categories(
+            self.context, self.svc)], ['tenant'])
+
+
+class RegistryCacheTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(RegistryCacheTestCase, self).setUp()
+
+        # Start over with an empty session
+        self.context.session = None
+
+    def _count(self, func, *args, **kwargs):
+        before = len(self.statements)
+        result = func(*args, **kwargs)
+
+        return result, len(self.statements) - before
+
+    def test_get_service(self):
+        self.dbapi.get_service(self.context, name='nova')
+        self.context.session = None
+
+        by_name, count = self._count(self.dbapi.get_service, self.context,
+                                     name='nova')
+        by_id, id_count = self._count(self.dbapi.get_service, self.context,
+                                      id=self.svc.id)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(id_count, 0)
+        self.assertEqual(by_name.id, self.svc.id)
+        self.assertEqual(by_name.auth_fields,
+                         set(['tenant_id', 'quota_class']))
+        self.assertEqual([r.id for r in by_id.resources], [self.res.id])
+
+    def test_get_resource(self):
+        self.dbapi.get_resource(self.context, service=self.svc,
+                                name='instances')
+        self.dbapi.get_category(self.context, id=self.cat.id)
+        self.context.session = None
+
+        res, count = self._count(self.dbapi.get_resource, self.context,
+                                 service=self.svc.id, name='instances')
+        cat, ref_count = self._count(lambda: res.category)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(ref_count, 0)
+        self.assertEqual(res.id, self.res.id)
+        self.assertEqual(cat.id, self.cat.id)
+        self.assertEqual(cat.quota_fsets,
+                         [set(['tenant_id']), set(['quota_class']), set()])
+
+    def test_lazy_get_fills_cache(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        usage.resource
+        self.context.session = None
+
+        res, count = self._count(self.dbapi.get_resource, self.context,
+                                 id=self.res.id)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(res.name, 'instances')
+
+    def test_hints_bypass_cache(self):
+        self.dbapi.get_service(self.context, name='nova')
+        self.context.session = None
+
+        svc, count = self._count(self.dbapi.get_service, self.context,
+                                 name='nova', hints=['categories'])
+
+        self.assertEqual(count, 2)
+        self.assertEqual([c.id for c in svc.categories], [self.cat.id])
+
+    def test_create_invalidates(self):
+        self.dbapi.get_service(self.context, name='nova')
+
+        self.dbapi.create_service(self.context, 'glance', [])
+        self.context.session = None
+        svc, count = self._count(self.dbapi.get_service, self.context,
+                                 name='nova')
+
+        self.assertEqual(count, 1)
+
+    def test_save_invalidates(self):
+        res = self.dbapi.get_resource(self.context, id=self.res.id)
+
+        res.absolute = True
+        self.context.session = None
+
+        res = self.dbapi.get_resource(self.context, id=self.res.id)
+        self.assertEqual(res.absolute, True)
+
+    def test_uncommitted_not_cached(self):
+        with self.dbapi.transaction(self.context):
+            self.dbapi.create_service(self.context, 'glance', [])
+            self.dbapi.get_service(self.context, name='glance')
+
+            self.assertEqual(api._REGISTRY.get(api.sa_models.Service,
+                                               name='glance'), None)
+
+        self.dbapi.get_service(self.context, name='glance')
+        self.assertNotEqual(api._REGISTRY.get(api.sa_models.Service,
+                                              name='glance'), None)
+
+    def test_rollback_invalidates(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_service(self.context, 'glance', [])
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          name='glance')
+
+    def test_disabled(self):
+        cfg.CONF.set_override('registry_cache_ttl', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'registry_cache_ttl')
+
+        self.dbapi.get_service(self.context, name='nova')
+        self.context.session = None
+        svc, count = self._count(self.dbapi.get_service, self.context,
+                                 name='nova')
+
+        self.assertEqual(count, 1)
+
+
+class UsageQuotaTestCase(BaseRegistryTestCase):
+    def test_usage(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'), used=3)
+
+        result = self.dbapi.get_usage(self.context, resource=self.res.id,
+                                      param_data={},
+                                      auth_data=dict(tenant_id='spam'))
+
+        self.assertEqual(result.id, usage.id)
+        self.assertEqual(result.used, 3)
+        self.assertEqual(result.reserved, 0)
+        self.assertEqual(result.auth_data, dict(tenant_id='spam'))
+        self.assertEqual(len(self.dbapi.get_usages(
+            self.context, auth_data=dict(tenant_id='spam'))), 1)
+        self.assertEqual(self.dbapi.get_usages(
+            self.context, auth_data=dict(tenant_id='eggs')), [])
+
+    def test_usage_digests(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+
+        self.assertEqual(usage._base_obj.parameter_digest,
+                         utils.dict_digest({}))
+        self.assertEqual(usage._base_obj.auth_digest,
+                         utils.dict_digest(dict(tenant_id='spam')))
+
+        usage.auth_data = dict(tenant_id='eggs')
+
+        self.assertEqual(usage._base_obj.auth_digest,
+                         utils.dict_digest(dict(tenant_id='eggs')))
+        result = self.dbapi.get_usage(self.context, resource=self.res,
+                                      param_data={},
+                                      auth_data=dict(tenant_id='eggs'))
+        self.assertEqual(result.id, usage.id)
+
+    def test_usage_digest_collision(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+
+        # Simulate a digest collision
+        usage._base_obj.auth_data = dict(tenant_id='eggs')
+        usage._base_obj.auth_digest = utils.dict_digest(
+            dict(tenant_id='spam'))
+        self.dbapi._save(self.context, usage._base_obj)
+
+        self.assertRaises(KeyError, self.dbapi.get_usage, self.context,
+                          resource=self.res, param_data={},
+                          auth_data=dict(tenant_id='spam'))
+        self.assertEqual(self.dbapi.get_usages(
+            self.context, auth_data=dict(tenant_id='spam')), [])
+
+    def test_duplicate_usage(self):
+        self.dbapi.create_usage(self.context, self.res, {},
+                                dict(tenant_id='spam'))
+
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_usage,
+                          self.context, self.res, {}, dict(tenant_id='spam'))
+
+    def test_quota(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        result = self.dbapi.get_quota(self.context, resource=self.res,
+                                      auth_data={})
+
+        self.assertEqual(result.id, quota.id)
+        self.assertEqual(result.limit, 10)
+
+    def test_duplicate_quota(self):
+        self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_quota,
+                          self.context, self.res, {}, 20)
+
+    def test_save(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.limit = 20
+        self.context.session.expunge_all()
+
+        result = self.dbapi.get_quota(self.context, id=quota.id)
+        self.assertEqual(result.limit, 20)
+
+    def test_delete(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.delete()
+
+        self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                          id=quota.id)
+
+
+class BaseQuotaTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(BaseQuotaTestCase, self).setUp()
+
+        self.cores = self.dbapi.create_resource(self.context, self.svc,
+                                                self.cat, 'cores', [])
+        self.ram = self.dbapi.create_resource(self.context, self.svc,
+                                              self.cat, 'ram', [])
+        self.dbapi.create_quota(self.context, self.res, {}, 10)
+        self.dbapi.create_quota(self.context, self.res,
+                                dict(quota_class='gold'), 20)
+        self.dbapi.create_quota(self.context, self.res,
+                                dict(tenant_id='spam'), 30)
+        self.dbapi.create_quota(self.context, self.cores, {}, 40)
+        self.dbapi.create_quota(self.context, self.cores,
+                                dict(tenant_id='eggs'), 50)
+
+
+class EffectiveQuotasTestCase(BaseQuotaTestCase):
+    def _limits(self, auth_data):
+        result = self.dbapi.get_effective_quotas(
+            self.context, [self.res, self.cores.id, self.ram], auth_data)
+
+        return dict((res_id, quota and quota.limit)
+                    for res_id, quota in result.items())
+
+    def test_most_specific(self):
+        self.assertEqual(self._limits(dict(tenant_id='spam',
+                                           quota_class='gold')),
+                         {self.res.id: 30, self.cores.id: 40,
+                          self.ram.id: None})
+
+    def test_quota_class(self):
+        self.assertEqual(self._limits(dict(tenant_id='eggs',
+                                           quota_class='gold')),
+                         {self.res.id: 20, self.cores.id: 50,
+                          self.ram.id: None})
+
+    def test_missing_fields(self):
+        self.assertEqual(self._limits({}),
+                         {self.res.id: 10, self.cores.id: 40,
+                          self.ram.id: None})
+
+    def test_single_query(self):
+        resources = [self.res.id, self.cores.id, self.ram.id]
+
+        # Warm up the registry cache, from a session which has not
+        # seen the objects yet
+        self.context.session = None
+        self.dbapi.get_effective_quotas(self.context, resources, {})
+        self.context.session = None
+        before = len(self.statements)
+
+        result = self.dbapi.get_effective_quotas(
+            self.context, resources,
+            dict(tenant_id='spam', quota_class='gold'))
+
+        self.assertEqual(len(self.statements) - before, 1)
+        self.assertIsInstance(result[self.res.id], models.Quota)
+        self.assertEqual(result[self.res.id].auth_data,
+                         dict(tenant_id='spam'))
+
+    def test_no_resources(self):
+        self.assertEqual(self.dbapi.get_effective_quotas(
+            self.context, [], dict(tenant_id='spam')), {})
+
+
+class QuotaIndexTestCase(BaseQuotaTestCase):
+    def setUp(self):
+        super(QuotaIndexTestCase, self).setUp()
+
+        self.resources = [self.res.id, self.cores.id, self.ram.id]
+        self.auth_data = dict(tenant_id='spam', quota_class='gold')
+
+        # Warm up the registry cache and the quota index, from a
+        # session which has not seen the objects yet
+        self.context.session = None
+        self.dbapi.get_effective_quotas(self.context, self.resources,
+                                        self.auth_data)
+        self.context.session = None
+
+    def _resolve(self):
+        before = len(self.statements)
+        result = self.dbapi.get_effective_quotas(
+            self.context, self.resources, self.auth_data)
+
+        limits = dict((res_id, quota and quota.limit)
+                      for res_id, quota in result.items())
+        return limits, len(self.statements) - before
+
+    def test_repeat(self):
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(limits, {self.res.id: 30, self.cores.id: 40,
+                                  self.ram.id: None})
+
+    def test_hints_bypass_index(self):
+        before = len(self.statements)
+
+        result = self.dbapi.get_effective_quotas(
+            self.context, self.resources, self.auth_data,
+            hints=['resource'])
+
+        self.assertEqual(len(self.statements) - before, 1)
+        self.assertEqual(result[self.res.id].resource.name, 'instances')
+
+    def test_create_quota(self):
+        self.dbapi.create_quota(self.context, self.ram,
+                                dict(quota_class='gold'), 60)
+        self.context.session = None
+
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(limits[self.ram.id], 60)
+
+    def test_update_limit(self):
+        quota = self.dbapi.get_quota(self.context, resource=self.cores,
+                                     auth_data={})
+
+        quota.limit = 45
+        self.context.session = None
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(limits[self.cores.id], 45)
+
+    def test_delete_quota(self):
+        quota = self.dbapi.get_quota(self.context, resource=self.res,
+                                     auth_data=dict(tenant_id='spam'))
+
+        quota.delete()
+        self.context.session = None
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(limits[self.res.id], 20)
+
+    def test_transaction(self):
+        with self.dbapi.transaction(self.context):
+            self.dbapi.create_quota(self.context, self.ram, {}, 70)
+
+            # Not published before the commit
+            self.assertEqual(api._QUOTAS.get(self.ram.id,
+                                             utils.dict_digest({})),
+                             (False, None))
+
+            limits, count = self._resolve()
+            self.assertEqual(count, 1)
+            self.assertEqual(limits[self.ram.id], 70)
+
+        limits, count = self._resolve()
+        self.assertEqual(count, 0)
+        self.assertEqual(limits[self.ram.id], 70)
+
+    def test_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.dbapi.create_quota(self.context, self.ram, {}, 70)
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 1)
+        self.assertEqual(limits[self.ram.id], None)
+
+    def test_disabled(self):
+        cfg.CONF.set_override('quota_cache_ttl', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'quota_cache_ttl')
+        api._QUOTAS.clear()
+
+        self._resolve()
+        limits, count = self._resolve()
+
+        self.assertEqual(count, 1)
+
+
+class AbsoluteCheckTestCase(BaseQuotaTestCase):
+    def setUp(self):
+        super(AbsoluteCheckTestCase, self).setUp()
+
+        self.files = self.dbapi.create_resource(
+            self.context, self.svc, self.cat, 'injected_files', [],
+            absolute=True)
+        self.dbapi.create_quota(self.context, self.files,
+                                dict(tenant_id='spam'), 5)
+        self.usage = self.dbapi.create_usage(self.context, self.cores, {},
+                                             dict(tenant_id='spam'))
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2012, 1, 1))
+        self.auth_data = dict(tenant_id='spam')
+
+        # Warm up the registry cache and the quota index
+        self.context.session = None
+        self.dbapi.check_absolute(self.context, [(self.files.id, 0)],
+                                  self.auth_data)
+        self.dbapi.get_resource(self.context, id=self.cores.id)
+        self.context.session = None
+
+    def test_within_limit(self):
+        before = len(self.statements)
+
+        self.dbapi.check_absolute(self.context, [(self.files, 3),
+                                                 (self.files.id, 2)],
+                                  self.auth_data)
+
+        self.assertEqual(len(self.statements), before)
+        self.assertFalse(self.context.session.is_active)
+
+    def test_exceeded(self):
+        lines = self.dbapi.create_resource(
+            self.context, self.svc, self.cat, 'injected_file_lines', [],
+            absolute=True)
+        self.dbapi.create_quota(self.context, lines, {}, 100)
+        unlimited = self.dbapi.create_resource(
+            self.context, self.svc, self.cat, 'metadata_items', [],
+            absolute=True)
+
+        with self.assertRaises(exceptions.QuotaExceeded) as cm:
+            self.dbapi.check_absolute(self.context, [(self.files.id, 6),
+                                                     (lines, 101),
+                                                     (unlimited, 1000)],
+                                      self.auth_data)
+
+        self.assertEqual(cm.exception.resources,
+                         sorted([self.files.id, lines.id]))
+
+    def test_not_absolute(self):
+        self.assertRaises(ValueError, self.dbapi.check_absolute,
+                          self.context, [(self.files, 1), (self.cores.id, 1)],
+                          self.auth_data)
+
+    def test_mixed(self):
+        before = len(self.statements)
+
+        items = self.dbapi.check_reserve(self.context, self.resv, [
+            (self.files.id, None, 4),
+            (self.cores.id, self.usage.id, 2),
+        ], self.auth_data)
+
+        # One aggregate lookup, one lock, one insert, one update
+        self.assertEqual(len(self.statements) - before, 4)
+        self.assertEqual([(i.resource_id, i.delta) for i in items],
+                         [(self.cores.id, 2)])
+
+    def test_mixed_exceeded(self):
+        self.assertRaises(exceptions.QuotaExceeded,
+                          self.dbapi.check_reserve, self.context, self.resv,
+                          [(self.files, None, 6),
+                           (self.cores, self.usage, 2)], self.auth_data)
+
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usage.id).reserved, 0)
+
+    def test_absolute_only(self):
+        before = len(self.statements)
+
+        self.assertEqual(self.dbapi.check_reserve(
+            self.context, self.resv, [(self.files.id, None, 5)],
+            self.auth_data), [])
+        self.assertEqual(len(self.statements), before)
+
+
+class ReserveTestCase(BaseRegistryTestCase):
+    def test_reserve(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2012, 1, 1))
+
+        with self.dbapi.transaction(self.context):
+            item = self.dbapi.reserve(self.context, resv, self.res, usage, 2)
+            self.dbapi.reserve(self.context, resv.id, self.res.id, usage.id,
+                               -1)
+
+        self.assertIsInstance(item, models.ReservedItem)
+        self.assertEqual(item.delta, 2)
+        result = self.dbapi.get_usage(self.context, id=usage.id)
+        self.assertEqual(result.reserved, 2)
+        resv = self.dbapi.get_reservation(self.context, resv.id)
+        self.assertEqual(sorted(i.delta for i in resv.reserved_items),
+                         [-1, 2])
+
+    def _setup_many(self):
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2012, 1, 1))
+        self.usages = []
+        self.resources = []
+        for name in ('cores', 'ram'):
+            res = self.dbapi.create_resource(self.context, self.svc,
+                                             self.cat, name, [])
+            self.resources.append(res)
+            self.usages.append(self.dbapi.create_usage(
+                self.context, res, {}, dict(tenant_id='spam')))
+
+    def test_reserve_many(self):
+        self._setup_many()
+        before = len(self.statements)
+
+        with self.dbapi.transaction(self.context):
+            items = self.dbapi.reserve_many(self.context, self.resv, [
+                (self.resources[1], self.usages[1], 2048),
+                (self.resources[0], self.usages[0].id, 2),
+                (self.resources[1], self.usages[1], -512),
+                (self.resources[0], self.usages[0], 1),
+            ])
+
+        # One lock, one insert, one update
+        self.assertEqual(len(self.statements) - before, 3)
+        self.assertEqual([i.delta for i in items], [2048, 2, -512, 1])
+
+        self.context.session = None
+        for usage, reserved in zip(self.usages, (3, 2048)):
+            result = self.dbapi.get_usage(self.context, id=usage.id)
+            self.assertEqual(result.reserved, reserved)
+        resv = self.dbapi.get_reservation(self.context, self.resv.id)
+        self.assertEqual(len(resv.reserved_items), 4)
+
+    def test_reserve_many_lock_order(self):
+        self._setup_many()
+
+        self.dbapi.reserve_many(self.context, self.resv, [
+            (self.resources[1], self.usages[1], 1),
+            (self.resources[0], self.usages[0], 1),
+        ])
+
+        lock = [s for s in self.statements if 'FROM usages' in s][-1]
+        self.assertIn('ORDER BY usages.id', lock)
+
+    def test_reserve_many_missing_usage(self):
+        self._setup_many()
+
+        self.assertRaises(KeyError, self.dbapi.reserve_many, self.context,
+                          self.resv, [(self.resources[0], 'missing', 1)])
+        self.assertEqual(self.dbapi.get_reservation(
+            self.context, self.resv.id).reserved_items, [])
+
+    def test_reserve_many_missing_reservation(self):
+        self._setup_many()
+
+        self.assertRaises(KeyError, self.dbapi.reserve_many, self.context,
+                          'missing', [(self.resources[0], self.usages[0], 1)])
+        self.context.session = None
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usages[0].id).reserved, 0)
+
+    def test_delete_referenced(self):
+        self._setup_many()
+        self.dbapi.reserve(self.context, self.resv, self.resources[0],
+                           self.usages[0], 2)
+
+        self.assertRaises(exceptions.InUse, self.usages[0].delete)
+        self.assertRaises(exceptions.InUse, self.resv.delete)
+        self.context.session = None
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.usages[0].id).reserved, 2)
+        self.assertEqual(len(self.dbapi.get_reservation(
+            self.context, self.resv.id).reserved_items), 1)
+
+    def test_reserve_many_empty(self):
+        self.assertEqual(self.dbapi.reserve_many(self.context, 'resv', []),
+                         [])
+
+
+class UsageRefreshTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(UsageRefreshTestCase, self).setUp()
+
+        cfg.CONF.set_override('usage_refresh_interval', 2)
+        cfg.CONF.set_override('usage_refresh_jitter', 0)
+
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2012, 1, 1))
+        self.resources = [self.res, self.dbapi.create_resource(
+            self.context, self.svc, self.cat, 'cores', [])]
+        self.usages = [self.dbapi.create_usage(self.context, res, {},
+                                               dict(tenant_id='spam'))
+                       for res in self.resources]
+
+    def tearDown(self):
+        cfg.CONF.clear_override('usage_refresh_interval')
+        cfg.CONF.clear_override('usage_refresh_jitter')
+
+        super(UsageRefreshTestCase, self).tearDown()
+
+    def _reserve(self, *usages):
+        return self.dbapi.reserve_many(self.context, self.resv, [
+            (self.resources[self.usages.index(usage)], usage, 1)
+            for usage in usages])
+
+    def _reserve_stale(self, *usages):
+        with self.assertRaises(exceptions.UsageRefreshNeeded) as cm:
+            self._reserve(*usages)
+        return cm.exception
+
+    def _get_usage(self, usage):
+        self.context.session = None
+        return self.dbapi.get_usage(self.context, id=usage.id)
+
+    def test_count_down(self):
+        usage = self.usages[0]
+
+        self._reserve(usage)
+        self.assertEqual(self._get_usage(usage).until_refresh, 1)
+        self._reserve(usage)
+        refreshing = self._get_usage(usage)
+        self.assertEqual(refreshing.until_refresh, 0)
+        self.assertIsNotNone(refreshing.refresh_id)
+
+        exc = self._reserve_stale(usage)
+
+        self.assertEqual([u.id for u in exc.usages], [usage.id])
+        self.assertIsNotNone(exc.usages[0].refresh_id)
+        result = self._get_usage(usage)
+        self.assertEqual(result.reserved, 2)
+        self.assertEqual(result.until_refresh, 0)
+        self.assertEqual(result.refresh_id, exc.usages[0].refresh_id)
+        self.assertEqual(len(self.dbapi.get_reservation(
+            self.context, self.resv.id).reserved_items), 2)
+
+    def test_count_down_concurrent(self):
+        usage = self.usages[0]
+        self._reserve(usage)
+        loaded = self.dbapi.get_usage(self.context, id=usage.id)
+        self.assertEqual(loaded.until_refresh, 1)
+
+        # Another context counts down the usage loaded in this one
+        other = context.Context('user', 'tenant')
+        self.dbapi.reserve(other, self.resv, self.resources[0], usage.id, 1)
+
+        exc = self._reserve_stale(usage)
+
+        self.assertEqual(exc.usages[0].refresh_id,
+                         self._get_usage(usage).refresh_id)
+
+    def test_all_stale_listed(self):
+        for i in range(2):
+            self._reserve(*self.usages)
+
+        exc = self._reserve_stale(*self.usages)
+
+        self.assertEqual(sorted(u.id for u in exc.usages),
+                         sorted(u.id for u in self.usages))
+        self.assertEqual(len(set(u.refresh_id for u in exc.usages)), 2)
+
+    def test_disabled(self):
+        cfg.CONF.set_override('usage_refresh_interval', 0)
+
+        for i in range(5):
+            self._reserve(self.usages[0])
+
+        result = self._get_usage(self.usages[0])
+        self.assertEqual(result.reserved, 5)
+        self.assertEqual(result.until_refresh, 0)
+
+    def test_refresh_mismatch(self):
+        usage = self.usages[0]
+        for i in range(2):
+            self._reserve(usage)
+        exc = self._reserve_stale(usage)
+
+        self.assertRaises(exceptions.RefreshMismatch,
+                          self.dbapi.refresh_usage, self.context,
+                          usage.id, 'wrong', 5)
+        self.assertRaises(exceptions.RefreshMismatch,
+                          self.dbapi.refresh_usage, self.context,
+                          usage.id, None, 5)
+        result = self._get_usage(usage)
+        self.assertEqual(result.refresh_id, exc.usages[0].refresh_id)
+        self.assertEqual(result.used, 0)
+
+    def test_refresh(self):
+        usage = self.usages[0]
+        for i in range(2):
+            self._reserve(usage)
+        exc = self._reserve_stale(usage)
+        refresh_id = exc.usages[0].refresh_id
+
+        result = self.dbapi.refresh_usage(self.context, usage.id,
+                                          refresh_id, 5)
+
+        self.assertEqual(result.used, 5)
+        self.assertEqual(result.until_refresh, 2)
+        self.assertIsNone(result.refresh_id)
+        self.assertRaises(exceptions.RefreshMismatch,
+                          self.dbapi.refresh_usage, self.context,
+                          usage.id, refresh_id, 7)
+        self._reserve(usage)
+        result = self._get_usage(usage)
+        self.assertEqual(result.used, 5)
+        self.assertEqual(result.reserved, 3)
+        self.assertEqual(result.until_refresh, 1)
+
+    def test_stale_in_transaction(self):
+        usage = self.usages[0]
+        for i in range(2):
+            self._reserve(usage)
+
+        def reserve():
+            with self.dbapi.transaction(self.context):
+                self._reserve(*self.usages)
+
+        self.assertRaises(exceptions.UsageRefreshNeeded, reserve)
+
+        # The rollback loses nothing the refresh depends on
+        result = self._get_usage(usage)
+        self.assertIsNotNone(result.refresh_id)
+        self.assertEqual(self._get_usage(self.usages[1]).until_refresh, 0)
+        self.dbapi.refresh_usage(self.context, usage, result.refresh_id, 1)
+
+    def test_refresh_aggregate(self):
+        instance = self.dbapi.create_usage(self.context, self.res, {},
+                                           dict(tenant_id='eggs'), used=3,
+                                           instance='chicago')
+        aggregate = self.dbapi.get_usage(self.context,
+                                         id=instance.aggregate_id)
+        self.assertEqual(aggregate.used, 3)
+        self.resources.append(self.res)
+        self.usages.append(instance)
+        for i in range(2):
+            self._reserve(instance)
+        exc = self._reserve_stale(instance)
+
+        self.dbapi.refresh_usage(self.context, instance,
+                                 exc.usages[0].refresh_id, 5)
+
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=instance.aggregate_id).used, 5)
+        self.assertEqual(self._get_usage(aggregate).used, 5)
+
+    def test_refresh_missing(self):
+        self.assertRaises(KeyError, self.dbapi.refresh_usage, self.context,
+                          'missing', 'refresh', 5)
+
+
+class ExpireReservationsTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(ExpireReservationsTestCase, self).setUp()
+
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+        past = datetime.datetime(2000, 1, 1)
+        future = datetime.datetime(2100, 1, 1)
+
+        self.expired = []
+        for i in range(5):
+            resv = self.dbapi.create_reservation(self.context, past)
+            self.dbapi.reserve_many(self.context, resv, [
+                (self.res, self.usage, 2),
+                (self.res, self.usage, -1),
+            ])
+            self.expired.append(resv.id)
+
+        self.live = self.dbapi.create_reservation(self.context, future)
+        self.dbapi.reserve(self.context, self.live, self.res, self.usage, 3)
+
+    def tearDown(self):
+        cfg.CONF.clear_override('reservation_expire_batch_size')
+        super(ExpireReservationsTestCase, self).tearDown()
+
+    def _check(self):
+        self.context.session = None
+        usage = self.dbapi.get_usage(self.context, id=self.usage.id)
+        self.assertEqual(usage.reserved, 3)
+        for resv_id in self.expired:
+            self.assertRaises(KeyError, self.dbapi.get_reservation,
+                              self.context, resv_id)
+        resv = self.dbapi.get_reservation(self.context, self.live.id)
+        self.assertEqual([i.delta for i in resv.reserved_items], [3])
+
+    def test_expire(self):
+        result = self.dbapi.expire_reservations(self.context)
+
+        self.assertEqual(result, 5)
+        self._check()
+
+    def test_expire_batched(self):
+        cfg.CONF.set_override('reservation_expire_batch_size', 2)
+        before = len(self.statements)
+
+        result = self.dbapi.expire_reservations(self.context)
+
+        self.assertEqual(result, 5)
+        statements = self.statements[before:]
+        self.assertEqual(len([s for s in statements
+                              if s.startswith('DELETE FROM reservations')]),
+                         3)
+        self._check()
+
+    def test_same_session(self):
+        instance = self.dbapi.create_usage(self.context, self.res, {},
+                                           dict(tenant_id='eggs'),
+                                           instance='chicago')
+        self.dbapi.reserve(self.context, self.expired[0], self.res,
+                           instance, 4)
+        usage = self.dbapi.get_usage(self.context, id=self.usage.id)
+        aggregate = self.dbapi.get_usage(self.context,
+                                         id=instance.aggregate_id)
+        self.assertEqual(usage.reserved, 13)
+        self.assertEqual(aggregate.reserved, 4)
+
+        self.dbapi.expire_reservations(self.context)
+
+        # Read back through the session which loaded the usages
+        for usage_id, reserved in ((self.usage.id, 3), (instance.id, 0),
+                                   (instance.aggregate_id, 0)):
+            self.assertEqual(self.dbapi.get_usage(
+                self.context, id=usage_id).reserved, reserved)
+
+    def test_expire_none(self):
+        self.dbapi.expire_reservations(self.context)
+
+        self.assertEqual(self.dbapi.expire_reservations(self.context), 0)
+
+
+class AggregateUsageTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(AggregateUsageTestCase, self).setUp()
+
+        self.chicago = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=3,
+            reserved=1, instance='chicago')
+        self.london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=2,
+            instance='london')
+
+    def _aggregate(self):
+        self.context.session = None
+        return self.dbapi.get_usage(self.context, resource=self.res,
+                                    param_data={},
+                                    auth_data=dict(tenant_id='spam'))
+
+    def test_create(self):
+        aggregate_id = self.london.aggregate.id
+        aggregate = self._aggregate()
+
+        self.assertEqual(aggregate.id, aggregate_id)
+        self.assertEqual(aggregate.instance, '')
+        self.assertEqual(aggregate.aggregate_id, None)
+        self.assertEqual(aggregate.used, 5)
+        self.assertEqual(aggregate.reserved, 1)
+        self.assertEqual(self.chicago.aggregate_id, aggregate.id)
+        self.assertEqual(sorted(u.instance for u in aggregate.instances),
+                         ['chicago', 'london'])
+
+    def test_create_duplicate(self):
+        self.assertRaises(exceptions.Duplicate, self.dbapi.create_usage,
+                          self.context, self.res, {},
+                          dict(tenant_id='spam'), instance='london')
+        self.assertEqual(self._aggregate().used, 5)
+
+    def test_create_race(self):
+        # The first lookup misses the aggregate usage, as it would if a
+        # concurrent transaction created it just afterward
+        calls = []
+
+        def match(obj):
+            calls.append(obj)
+            return len(calls) > 1
+
+        with mock.patch.object(api._DataMatcher, '__call__',
+                               side_effect=match):
+            paris = self.dbapi.create_usage(
+                self.context, self.res, {}, dict(tenant_id='spam'), used=4,
+                instance='paris')
+
+        self.assertEqual(paris.aggregate_id, self.london.aggregate_id)
+        aggregate = self._aggregate()
+        self.assertEqual(aggregate.used, 9)
+        self.assertEqual(len(self.dbapi.get_usages(
+            self.context, resource=self.res, instance='')), 1)
+
+    def test_get_instance(self):
+        usage = self.dbapi.get_usage(self.context, resource=self.res,
+                                     param_data={},
+                                     auth_data=dict(tenant_id='spam'),
+                                     instance='london')
+        usages = self.dbapi.get_usages(self.context, resource=self.res)
+        aggregates = self.dbapi.get_usages(self.context, resource=self.res,
+                                           instance='')
+
+        self.assertEqual(usage.id, self.london.id)
+        self.assertEqual(len(usages), 3)
+        self.assertEqual([u.instance for u in aggregates], [''])
+
+    def test_reserve(self):
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+        self.dbapi.reserve_many(self.context, resv, [
+            (self.res, self.chicago, 2),
+            (self.res, self.london, 4),
+            (self.res, self.london, -1),
+        ])
+
+        self.assertEqual(self._aggregate().reserved, 7)
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.london.id).reserved, 4)
+
+        self.dbapi.expire_reservations(self.context)
+
+        self.assertEqual(self._aggregate().reserved, 1)
+        self.assertEqual(self.dbapi.get_usage(
+            self.context, id=self.london.id).reserved, 0)
+
+    def test_lock(self):
+        sess = self.context.session
+
+        usages = self.dbapi._lock_usages(sess, [self.london.id])
+
+        self.assertEqual(sorted(u.id for u in usages),
+                         sorted([self.london.id, self.london.aggregate_id]))
+        lock = self.statements[-1]
+        self.assertIn('ORDER BY usages.id', lock)
+        self.assertEqual(lock.count('SELECT'), 1)
+        self.assertNotIn(' OR ', lock)
+
+    def test_save(self):
+        self.london.used = 6
+
+        self.assertEqual(self._aggregate().used, 9)
+
+    def test_save_refreshed(self):
+        self.london.refresh_id = 'refresh'
+        self.dbapi.refresh_usage(self.context, self.london, 'refresh', 5)
+
+        self.london.used = 7
+
+        self.assertEqual(self._aggregate().used, 10)
+
+    def _expire(self):
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+        self.dbapi.reserve(self.context, resv, self.res, self.london, 2)
+        self.dbapi.expire_reservations(self.context)
+
+    def test_save_expired(self):
+        self._expire()
+
+        self.london.reserved = 4
+
+        self.assertEqual(self._aggregate().reserved, 5)
+
+    def test_save_expired_in_transaction(self):
+        self._expire()
+
+        with self.dbapi.transaction(self.context):
+            self.london.reserved = 4
+
+        self.assertEqual(self._aggregate().reserved, 5)
+
+    def test_save_projected(self):
+        self.context.session = None
+        usage = self.dbapi.get_usages(self.context, instance='london',
+                                      fields=['reserved'])[0]
+
+        usage.used = 9
+
+        self.assertEqual(self._aggregate().used, 12)
+
+    def test_delete_aggregate(self):
+        self._aggregate().delete()
+
+        self.context.session = None
+        self.assertIsNone(self.dbapi.get_usage(
+            self.context, id=self.chicago.id).aggregate_id)
+
+    def test_delete(self):
+        self.chicago.delete()
+
+        aggregate = self._aggregate()
+        self.assertEqual(aggregate.used, 2)
+        self.assertEqual(aggregate.reserved, 0)
+
+
+class BackendAgreementTestCase(db_tests.DBTestCase):
+    def _run(self, dbapi, scenario):
+        ctx = context.Context('user', 'tenant')
+        svc = dbapi.create_service(ctx, 'nova', ['tenant_id'])
+        cat = dbapi.create_category(ctx, svc, 'tenant', ['tenant_id'],
+                                    [['tenant_id']])
+        res = dbapi.create_resource(ctx, svc, cat, 'instances', [])
+        usage = dbapi.create_usage(ctx, res, {}, dict(tenant_id='spam'),
+                                   used=3, reserved=1, instance='chicago')
+        resv = dbapi.create_reservation(ctx, datetime.datetime(2000, 1, 1))
+
+        scenario(dbapi, ctx, res, usage, resv)
+
+        ctx = context.Context('user', 'tenant')
+        return [(u.used, u.reserved) for u in (
+            dbapi.get_usage(ctx, id=usage.id),
+            dbapi.get_usage(ctx, id=usage.aggregate_id))]
+
+    def _check(self, scenario, expected):
+        result = self._run(self.dbapi, scenario)
+
+        self.assertEqual(result, self._run(memory_api.API(), scenario))
+        self.assertEqual(result, expected)
+
+    def test_reserve_pending(self):
+        def scenario(dbapi, ctx, res, usage, resv):
+            with dbapi.transaction(ctx):
+                usage.reserved = 2
+                dbapi.reserve_many(ctx, resv, [(res, usage, 1)])
+
+        self._check(scenario, [(3, 3), (3, 3)])
+
+    def test_expire_pending(self):
+        def scenario(dbapi, ctx, res, usage, resv):
+            dbapi.reserve(ctx, resv, res, usage, 2)
+            with dbapi.transaction(ctx):
+                usage.reserved = 2
+                dbapi.expire_reservations(ctx)
+
+        self._check(scenario, [(3, 0), (3, 0)])
+
+
+class CommitDeltasTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(CommitDeltasTestCase, self).setUp()
+
+        self.chicago = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=3,
+            reserved=1, instance='chicago')
+        self.london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='spam'), used=2,
+            instance='london')
+
+    def _aggregate(self):
+        self.context.session = None
+        return self.dbapi.get_usage(self.context, id=self.london.aggregate_id)
+
+    def _reservations(self):
+        return [s for s in self.statements
+                if 'reservations' in s or 'reserved_items' in s]
+
+    def test_commit_deltas(self):
+        other = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='eggs'), used=4)
+        self.context.session = None
+        before = len(self.statements)
+
+        self.dbapi.commit_deltas(self.context, [
+            (self.chicago.id, -2),
+            (self.london.id, -1),
+            (other.id, -3),
+            (self.chicago.id, 1),
+        ])
+
+        # One lookup of the aggregates, one update
+        self.assertEqual(len(self.statements) - before, 2)
+        self.assertEqual(self._reservations(), [])
+        for usage, used in ((self.chicago, 2), (self.london, 1),
+                            (other, 1)):
+            self.context.session = None
+            self.assertEqual(self.dbapi.get_usage(
+                self.context, id=usage.id).used, used)
+        self.assertEqual(self._aggregate().used, 3)
+
+    def test_loaded_usages(self):
+        aggregate = self.chicago.aggregate
+        aggregate.used
+        before = len(self.statements)
+
+        self.dbapi.commit_deltas(self.context, [(self.chicago, -3)])
+
+        self.assertEqual(len(self.statements) - before, 1)
+        self.assertEqual(self.chicago._base_obj.used, 0)
+        self.assertEqual(aggregate._base_obj.used, 2)
+        self.assertEqual(self._aggregate().used, 2)
+
+    def test_pending_changes(self):
+        with self.dbapi.transaction(self.context):
+            self.chicago.reserved = 0
+            self.dbapi.commit_deltas(self.context, [(self.chicago, -1)])
+
+        self.context.session = None
+        usage = self.dbapi.get_usage(self.context, id=self.chicago.id)
+        self.assertEqual(usage.used, 2)
+        self.assertEqual(usage.reserved, 0)
+
+    def test_pending_used(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='eggs'), used=3)
+
+        with self.dbapi.transaction(self.context):
+            usage.update(used=10)
+            self.dbapi.commit_deltas(self.context, [(usage, -1)])
+
+        self.assertEqual(usage.used, 9)
+        self.context.session = None
+        self.assertEqual(self.dbapi.get_usage(self.context,
+                                              id=usage.id).used, 9)
+
+    def test_deleted_usage(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='eggs'), used=3)
+        self.context.session = None
+        self.dbapi.get_usage(self.context, id=usage.id).delete()
+
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [(self.chicago.id, -1), (usage, -1)])
+        self.assertEqual(self._aggregate().used, 5)
+
+    def test_missing_usage(self):
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [(self.chicago.id, -1), ('missing', -1)])
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [('missing', 0)])
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [('missing', 1), ('missing', -1)])
+        self.assertEqual(self._aggregate().used, 5)
+
+    def test_deleted_usage_no_change(self):
+        self.context.session = None
+        self.dbapi.get_usage(self.context, id=self.london.id).delete()
+
+        self.assertRaises(KeyError, self.dbapi.commit_deltas, self.context,
+                          [(self.london, 0)])
+
+    def test_no_change(self):
+        before = len(self.statements)
+
+        self.dbapi.commit_deltas(self.context, [(self.chicago.id, 1),
+                                                (self.chicago.id, -1)])
+
+        # Only the check that the usage exists
+        statements = self.statements[before:]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('SELECT'))
+
+
+class UnitOfWorkTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(UnitOfWorkTestCase, self).setUp()
+
+        self.usage = self.dbapi.create_usage(self.context, self.res, {},
+                                             dict(tenant_id='spam'))
+
+    def _updates(self, before):
+        return [s for s in self.statements[before:]
+                if s.startswith('UPDATE usages')]
+
+    def _reload(self, usage_id):
+        self.context.session = None
+        return self.dbapi.get_usage(self.context, id=usage_id)
+
+    def test_outside_transaction(self):
+        before = len(self.statements)
+
+        self.usage.used = 3
+        self.usage.reserved = 2
+
+        self.assertEqual(len(self._updates(before)), 2)
+
+    def test_coalesced(self):
+        before = len(self.statements)
+
+        with self.dbapi.transaction(self.context):
+            self.usage.used = 3
+            self.usage.reserved = 2
+            self.usage.until_refresh = 5
+            self.assertEqual(self._updates(before), [])
+
+        self.assertEqual(len(self._updates(before)), 1)
+        result = self._reload(self.usage.id)
+        self.assertEqual((result.used, result.reserved, result.until_refresh),
+                         (3, 2, 5))
+
+    def test_flush(self):
+        before = len(self.statements)
+
+        with self.dbapi.transaction(self.context) as trans:
+            self.usage.used = 3
+            trans.flush()
+            self.assertEqual(len(self._updates(before)), 1)
+
+        self.assertEqual(len(self._updates(before)), 1)
+
+    def test_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                self.usage.used = 3
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertEqual(self.context.session.info.get('unflushed'), None)
+        self.assertEqual(self._reload(self.usage.id).used, 0)
+
+    def test_commit_fails(self):
+        other = self.dbapi.create_resource(self.context, self.svc, self.cat,
+                                           'cores', [])
+
+        def rename():
+            with self.dbapi.transaction(self.context):
+                other.name = 'instances'
+
+        self.assertRaises(exceptions.Duplicate, rename)
+        self.assertFalse(self.context.session.is_active)
+        self.context.session = None
+        self.assertEqual(self.dbapi.get_resource(
+            self.context, id=other.id).name, 'cores')
+
+    def test_aggregate(self):
+        london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='eggs'), used=2,
+            instance='london')
+
+        with self.dbapi.transaction(self.context):
+            london.used = 4
+            london.reserved = 1
+            london.used = 5
+
+        aggregate = self._reload(london.aggregate_id)
+        self.assertEqual((aggregate.used, aggregate.reserved), (5, 1))
+
+    def test_aggregate_delete(self):
+        london = self.dbapi.create_usage(
+            self.context, self.res, {}, dict(tenant_id='eggs'), used=2,
+            instance='london')
+        aggregate_id = london.aggregate_id
+
+        with self.dbapi.transaction(self.context):
+            london.used = 4
+            london.delete()
+
+        self.assertEqual(self._reload(aggregate_id).used, 0)
+
+
+class IdentityMapTestCase(BaseRegistryTestCase):
+    def test_same_object(self):
+        before = len(self.statements)
+
+        by_id = self.dbapi.get_resource(self.context, id=self.res.id)
+        category = by_id.category
+
+        self.assertEqual(len(self.statements), before)
+        self.assertIs(by_id, self.res)
+        self.assertIs(category, self.cat)
+
+    def test_by_key(self):
+        self.context.session = None
+
+        by_id = self.dbapi.get_resource(self.context, id=self.res.id)
+        by_name = self.dbapi.get_resource(self.context, service=self.svc,
+                                          name='instances')
+
+        self.assertIs(by_name, by_id)
+
+    def test_refs(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+        self.dbapi.reserve_many(self.context, resv, [
+            (self.res, usage, 2),
+            (self.res, usage, 1),
+        ])
+        self.context.session = None
+
+        items = self.dbapi.get_reservation(self.context,
+                                           resv.id).reserved_items
+        before = len(self.statements)
+
+        self.assertIs(items[0].usage, items[1].usage)
+        self.assertEqual(len(self.statements) - before, 1)
+        self.assertEqual(items[0].usage.reserved, 3)
+
+    def test_refreshed(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+        self.dbapi.reserve(self.context, resv, self.res, usage, 2)
+
+        self.assertIs(self.dbapi.get_usage(self.context, id=usage.id),
+                      usage)
+        self.assertEqual(usage.reserved, 2)
+
+    def test_deleted(self):
+        quota = self.dbapi.create_quota(self.context, self.res, {}, 10)
+
+        quota.delete()
+
+        self.assertRaises(KeyError, self.dbapi.get_quota, self.context,
+                          id=quota.id)
+
+    def test_expired(self):
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+
+        self.dbapi.expire_reservations(self.context)
+
+        self.assertRaises(KeyError, self.dbapi.get_reservation,
+                          self.context, resv.id)
+
+    def test_expired_items(self):
+        usage = self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='spam'))
+        resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2000, 1, 1))
+        self.dbapi.reserve(self.context, resv, self.res, usage, 2)
+        items = self.dbapi.get_reservation(self.context,
+                                           resv.id).reserved_items
+        self.assertEqual(len(usage.reserved_items), 1)
+
+        self.dbapi.expire_reservations(self.context)
+
+        self.assertIsNone(self.dbapi._cached_model(
+            self.context, models.ReservedItem, items[0].id))
+        self.assertNotIn(items[0]._base_obj,
+                         self.dbapi._get_session(self.context))
+        self.assertEqual(usage.reserved_items, [])
+
+    def test_rollback(self):
+        try:
+            with self.dbapi.transaction(self.context):
+                svc = self.dbapi.create_service(self.context, 'glance', [])
+                raise ValueError('spam')
+        except ValueError:
+            pass
+
+        self.assertRaises(KeyError, self.dbapi.get_service, self.context,
+                          id=svc.id)
+
+
+class PaginationTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+
+        with self.dbapi.transaction(self.context):
+            for i in range(5):
+                self.dbapi.create_usage(self.context, self.res, {},
+                                        dict(tenant_id='tenant%d' % i))
+                self.dbapi.create_quota(self.context, self.res,
+                                        dict(tenant_id='tenant%d' % i), i)
+
+        self.ids = sorted(usage.id for usage in
+                          self.dbapi.get_usages(self.context))
+
+    def test_limit(self):
+        result = self.dbapi.get_usages(self.context, limit=2)
+
+        self.assertEqual([usage.id for usage in result], self.ids[:2])
+
+    def test_marker(self):
+        marker = self.dbapi.get_usage(self.context, id=self.ids[1])
+
+        by_id = self.dbapi.get_usages(self.context, marker=self.ids[1],
+                                      limit=2)
+        by_obj = self.dbapi.get_usages(self.context, marker=marker)
+
+        self.assertEqual([usage.id for usage in by_id], self.ids[2:4])
+        self.assertEqual([usage.id for usage in by_obj], self.ids[2:])
+
+    def test_filtered(self):
+        result = self.dbapi.get_quotas(self.context,
+                                       auth_data=dict(tenant_id='tenant3'),
+                                       marker='', limit=2)
+
+        self.assertEqual([quota.limit for quota in result], [3])
+
+    def test_filtered_rows_dropped(self):
+        # Drop rows as a digest collision would, after the limit
+        dropped = set(self.ids[:3])
+
+        def matcher(match, obj):
+            return obj.id not in dropped
+
+        with mock.patch.object(api._DataMatcher, '__call__', matcher):
+            page = self.dbapi.get_usages(self.context, param_data={},
+                                         limit=2)
+            result = self.dbapi.iter_usages(self.context, param_data={},
+                                            chunk_size=2)
+
+            self.assertEqual([usage.id for usage in page], self.ids[3:])
+            self.assertEqual([usage.id for usage in result], self.ids[3:])
+
+    def test_iter_usages(self):
+        before = len(self.statements)
+
+        result = [usage.id for usage in
+                  self.dbapi.iter_usages(self.context, chunk_size=2)]
+
+        self.assertEqual(result, self.ids)
+        self.assertEqual(len(self.statements) - before, 3)
+
+    def test_iter_quotas(self):
+        result = self.dbapi.iter_quotas(self.context, resource=self.res,
+                                        chunk_size=5)
+
+        self.assertEqual(sorted(quota.limit for quota in result),
+                         range(5))
+
+    def test_iter_services(self):
+        result = self.dbapi.iter_services(self.context, hints=['resources'])
+
+        self.assertEqual([svc.id for svc in result], [self.svc.id])
+
+
+class ProjectionTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(ProjectionTestCase, self).setUp()
+
+        with self.dbapi.transaction(self.context):
+            for i in range(3):
+                self.dbapi.create_usage(self.context, self.res,
+                                        dict(zone='zone%d' % i),
+                                        dict(tenant_id='spam'), used=i)
+
+        # Start over with an empty session
+        self.context.session = None
+
+    def test_fields(self):
+        result = self.dbapi.get_usages(self.context, fields=['used'])
+        query = self.statements[-1]
+        before = len(self.statements)
+
+        self.assertEqual(sorted(usage.used for usage in result), [0, 1, 2])
+        self.assertEqual(len(self.statements), before)
+        self.assertIn('usages.used', query)
+        self.assertIn('usages.resource_id', query)
+        self.assertNotIn('usages.auth_data', query)
+        self.assertEqual(result[0].auth_data, dict(tenant_id='spam'))
+        self.assertEqual(len(self.statements) - before, 1)
+
+    def test_fields_matched(self):
+        result = self.dbapi.get_usages(self.context,
+                                       param_data=dict(zone='zone1'),
+                                       fields=['used'])
+        query = self.statements[-1]
+
+        self.assertEqual([usage.used for usage in result], [1])
+        self.assertIn('usages.parameter_data', query)
+        self.assertNotIn('usages.auth_data', query)
+
+    def test_unknown_fields(self):
+        result = self.dbapi.get_usages(self.context,
+                                       fields=['resource', 'spam'])
+
+        self.assertEqual(len(result), 3)
+
+
+class BatchLoadTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(BatchLoadTestCase, self).setUp()
+
+        with self.dbapi.transaction(self.context):
+            for i in range(5):
+                res = self.dbapi.create_resource(self.context, self.svc,
+                                                 self.cat, 'res%d' % i, [])
+                self.dbapi.create_usage(self.context, res, {},
+                                        dict(tenant_id='spam'))
+
+        # Start over with an empty session and registry cache
+        self.context.session = None
+        api._REGISTRY.clear()
+
+    def tearDown(self):
+        cfg.CONF.clear_override('lazy_load_batch_size')
+        super(BatchLoadTestCase, self).tearDown()
+
+    def _walk(self):
+        usages = self.dbapi.get_usages(self.context)
+        before = len(self.statements)
+
+        return (sorted(usage.resource.name for usage in usages),
+                len(self.statements) - before)
+
+    def test_single_query(self):
+        result, queries = self._walk()
+
+        self.assertEqual(result, ['res%d' % i for i in range(5)])
+        self.assertEqual(queries, 1)
+
+    def test_batch_size(self):
+        cfg.CONF.set_override('lazy_load_batch_size', 2)
+
+        result, queries = self._walk()
+
+        self.assertEqual(result, ['res%d' % i for i in range(5)])
+        self.assertEqual(queries, 3)
+
+    def test_single_object(self):
+        usage = self.dbapi.get_usages(self.context)[0]
+        others = self.dbapi.get_usages(self.context, resource=usage.resource)
+        before = len(self.statements)
+
+        self.assertEqual(others[0].resource.name, usage.resource.name)
+        self.assertEqual(len(self.statements), before)
+
+    def test_rollback(self):
+        usages = self.dbapi.get_usages(self.context)
+        self.dbapi.begin(self.context)
+        self.dbapi.rollback(self.context)
+
+        self.assertNotIn('batches', self.context.session.info)
+        self.assertEqual(sorted(usage.resource.name for usage in usages),
+                         ['res%d' % i for i in range(5)])
+
+
+class EagerLoadTestCase(BaseRegistryTestCase):
+    def setUp(self):
+        super(EagerLoadTestCase, self).setUp()
+
+        self.resv = self.dbapi.create_reservation(
+            self.context, datetime.datetime(2012, 1, 1))
+        with self.dbapi.transaction(self.context):
+            for i in range(5):
+                res = self.dbapi.create_resource(self.context, self.svc,
+                                                 self.cat, 'res%d' % i, [])
+                usage = self.dbapi.create_usage(self.context, res, {},
+                                                dict(tenant_id='spam'))
+                self.dbapi.reserve(self.context, self.resv, res, usage, 1)
+
+        # Start over with an empty session
+        self.context.session = None
+
+    def _walk(self, resv):
+        return sorted(item.usage.resource.name
+                      for item in resv.reserved_items)
+
+    def test_no_hints(self):
+        resv = self.dbapi.get_reservation(self.context, self.resv.id)
+        before = len(self.statements)
+
+        result = self._walk(resv)
+
+        self.assertEqual(result, ['res%d' % i for i in range(5)])
+        self.assertEqual(len(self.statements) - before, 3)
+
+    def test_hints(self):
+        before = len(self.statements)
+
+        resv = self.dbapi.get_reservation(
+            self.context, self.resv.id,
+            hints=['reserved_items.usage.resource'])
+        result = self._walk(resv)
+
+        self.assertEqual(result, ['res%d' % i for i in range(5)])
+        self.assertEqual(len(self.statements) - before, 2)
+
+    def test_hints_list(self):
+        before = len(self.statements)
+
+        services = self.dbapi.get_services(
+            self.context, hints=['categories', 'resources.category', 'name'])
+        names = sorted(res.category.name
+                       for svc in services for res in svc.resources)
+        cats = [cat.name for svc in services for cat in svc.categories]
+
+        self.assertEqual(names, ['tenant'] * 6)
+        self.assertEqual(cats, ['tenant'])
+        self.assertEqual(len(self.statements) - before, 3)
@@ -0,0 +1,202 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import sqlalchemy as sa
+
+from boson.db.sqlalchemy import cache
+from boson.db.sqlalchemy import models as sa_models
+
+import tests
+
+
+class SnapshotTestCase(tests.TestCase):
+    def test_snapshot(self):
+        svc = sa_models.Service(id='svc', name='nova',
+                                auth_fields=frozenset(['tenant_id']))
+
+        result = cache.snapshot(svc)
+
+        self.assertIsNot(result, svc)
+        self.assertEqual(result.id, 'svc')
+        self.assertEqual(result.name, 'nova')
+        self.assertEqual(result.auth_fields, frozenset(['tenant_id']))
+        self.assertTrue(sa.inspect(result).detached)
+
+
+class RegistryCacheTestCase(tests.TestCase):
+    def setUp(self):
+        super(RegistryCacheTestCase, self).setUp()
+
+        self.cache = cache.RegistryCache()
+        self.svc = sa_models.Service(id='svc', name='nova',
+                                     auth_fields=frozenset())
+        self.res = sa_models.Resource(id='res', service_id='svc',
+                                      category_id='cat', name='instances',
+                                      parameters=frozenset(),
+                                      absolute=False)
+
+    def test_contains(self):
+        self.assertIn(sa_models.Service, self.cache)
+        self.assertIn(sa_models.Category, self.cache)
+        self.assertIn(sa_models.Resource, self.cache)
+        self.assertNotIn(sa_models.Usage, self.cache)
+
+    def test_get_missing(self):
+        self.assertEqual(self.cache.get(sa_models.Service, id='svc'), None)
+
+    def test_put(self):
+        self.cache.put(self.svc, 0)
+        self.cache.put(self.res, 0)
+
+        by_id = self.cache.get(sa_models.Service, id='svc')
+        by_name = self.cache.get(sa_models.Service, name='nova')
+        res = self.cache.get(sa_models.Resource, service_id='svc',
+                             name='instances')
+
+        self.assertEqual(by_id.name, 'nova')
+        self.assertIs(by_name, by_id)
+        self.assertEqual(res.id, 'res')
+        self.assertEqual(self.cache.get(sa_models.Resource, id='svc'), None)
+
+    def test_put_stale(self):
+        self.cache.invalidate()
+        self.cache.put(self.svc, 0)
+
+        self.assertEqual(self.cache.get(sa_models.Service, id='svc'), None)
+
+    def test_invalidate(self):
+        self.cache.put(self.svc, 0)
+
+        self.cache.invalidate()
+
+        self.assertEqual(self.cache.generation, 1)
+        self.assertEqual(self.cache.get(sa_models.Service, id='svc'), None)
+
+    def test_clear(self):
+        self.cache.put(self.svc, 0)
+
+        self.cache.clear()
+
+        self.assertEqual(self.cache.generation, 1)
+        self.assertEqual(self.cache._entries, {})
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_expired(self, mock_time):
+        self.cache.put(self.svc, 0)
+
+        mock_time.return_value = 1059.0
+        self.assertNotEqual(self.cache.get(sa_models.Service, id='svc'),
+                            None)
+
+        mock_time.return_value = 1061.0
+        self.assertEqual(self.cache.get(sa_models.Service, id='svc'), None)
+
+
+class QuotaKeysTestCase(tests.TestCase):
+    def test_new(self):
+        quota = sa_models.Quota(resource_id='res', auth_data={}, limit=5)
+
+        self.assertEqual(cache.quota_keys(quota),
+                         set([('res', quota.auth_digest)]))
+
+    def test_changed(self):
+        quota = sa_models.Quota(id='quota', resource_id='res',
+                                auth_data={}, limit=5)
+        old_digest = quota.auth_digest
+        sa.orm.make_transient_to_detached(quota)
+
+        quota.auth_data = dict(tenant_id='spam')
+
+        self.assertEqual(cache.quota_keys(quota),
+                         set([('res', quota.auth_digest),
+                              ('res', old_digest)]))
+
+
+class QuotaIndexTestCase(tests.TestCase):
+    def setUp(self):
+        super(QuotaIndexTestCase, self).setUp()
+
+        self.index = cache.QuotaIndex()
+        self.quota = sa_models.Quota(id='quota', resource_id='res',
+                                     auth_data={}, limit=5)
+
+    def test_get_missing(self):
+        self.assertEqual(self.index.get('res', 'digest'), (False, None))
+
+    def test_put(self):
+        self.index.put('res', 'digest', self.quota, 0)
+
+        found, snap = self.index.get('res', 'digest')
+
+        self.assertTrue(found)
+        self.assertIsNot(snap, self.quota)
+        self.assertEqual(snap.limit, 5)
+
+    def test_put_absent(self):
+        self.index.put('res', 'digest', None, 0)
+
+        self.assertEqual(self.index.get('res', 'digest'), (True, None))
+
+    def test_put_stale(self):
+        self.index.discard([])
+        self.index.put('res', 'digest', None, 0)
+
+        self.assertEqual(self.index.get('res', 'digest'), (False, None))
+
+    def test_write(self):
+        self.index.write(self.quota)
+
+        found, snap = self.index.get('res', self.quota.auth_digest)
+
+        self.assertTrue(found)
+        self.assertEqual(snap.id, 'quota')
+
+    def test_write_deleted(self):
+        self.index.write(self.quota, deleted=True)
+
+        self.assertEqual(self.index.get('res', self.quota.auth_digest),
+                         (True, None))
+
+    def test_discard(self):
+        self.index.put('res', 'digest', None, 0)
+        self.index.put('res', 'other', None, 0)
+
+        self.index.discard([('res', 'digest')])
+
+        self.assertEqual(self.index.generation, 1)
+        self.assertEqual(self.index.get('res', 'digest'), (False, None))
+        self.assertEqual(self.index.get('res', 'other'), (True, None))
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_expired(self, mock_time):
+        self.index.put('res', 'digest', None, 0)
+
+        mock_time.return_value = 1061.0
+        self.assertEqual(self.index.get('res', 'digest'), (False, None))
+        self.assertNotIn(('res', 'digest'), self.index._entries)
+
+    @mock.patch.object(cache, 'QUOTA_INDEX_SIZE', 3)
+    def test_bounded(self):
+        for i in range(3):
+            self.index.put('res', 'digest%d' % i, None, 0)
+        self.index.put('res', 'digest0', None, 0)
+        self.assertEqual(len(self.index._entries), 3)
+
+        self.index.put('res', 'digest3', None, 0)
+
+        self.assertEqual(self.index._entries.keys(), [('res', 'digest3')])
@@ -0,0 +1,119 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db.sqlalchemy import models as sa_models
+from boson import utils
+
+import tests
+
+
+class DictSerializedTestCase(tests.TestCase):
+    def test_digest(self):
+        self.assertEqual(sa_models.DictSerialized.digest(dict(a=1)),
+                         utils.dict_digest(dict(a=1)))
+
+    def test_digest_none(self):
+        self.assertEqual(sa_models.DictSerialized.digest(None), None)
+
+    def test_set(self):
+        usage = sa_models.Usage(auth_data=dict(b=2, a='1'))
+
+        self.assertEqual(usage._auth_data, 'a="1"/b=2')
+        self.assertEqual(usage.auth_digest,
+                         utils.dict_digest(dict(a='1', b=2)))
+        self.assertEqual(usage.auth_data, dict(a='1', b=2))
+
+    def test_set_none(self):
+        usage = sa_models.Usage(auth_data=dict(a=1))
+
+        usage.auth_data = None
+
+        self.assertEqual(usage._auth_data, None)
+        self.assertEqual(usage.auth_digest, None)
+        self.assertEqual(usage.auth_data, None)
+
+    def test_lazy_decode(self):
+        usage = sa_models.Usage()
+        usage._auth_data = 'a=1'
+
+        with mock.patch.object(utils, 'dict_deserialize',
+                               wraps=utils.dict_deserialize) as mock_deser:
+            result1 = usage.auth_data
+            result2 = usage.auth_data
+            usage._auth_data = 'a=2'
+            result3 = usage.auth_data
+
+        self.assertEqual(result1, dict(a=1))
+        self.assertIs(result1, result2)
+        self.assertEqual(result3, dict(a=2))
+        self.assertEqual(mock_deser.call_count, 2)
+
+
+class FieldSetTestCase(tests.TestCase):
+    def test_bind(self):
+        col_type = sa_models.FieldSet()
+
+        self.assertEqual(col_type.process_bind_param(set(['b', 'a']), None),
+                         '["a","b"]')
+        self.assertEqual(col_type.process_bind_param(None, None), None)
+
+    def test_result(self):
+        col_type = sa_models.FieldSet()
+
+        result = col_type.process_result_value(u'["a","b"]', None)
+
+        self.assertEqual(result, set(['a', 'b']))
+        self.assertIsInstance(result, frozenset)
+        self.assertEqual(col_type.process_result_value(None, None), None)
+
+    def test_result_cached(self):
+        col_type = sa_models.FieldSet()
+
+        result1 = col_type.process_result_value(u'["a"]', None)
+        result2 = col_type.process_result_value(u'["a"]', None)
+
+        self.assertEqual(id(result1), id(result2))
+
+    def test_result_cache_bounded(self):
+        col_type = sa_models.FieldSet()
+
+        for i in range(sa_models.DECODE_CACHE_SIZE + 10):
+            col_type.process_result_value(u'["f%d"]' % i, None)
+
+        self.assertTrue(len(col_type._cache) <= sa_models.DECODE_CACHE_SIZE)
+
+
+class FieldSetListTestCase(tests.TestCase):
+    def test_bind(self):
+        col_type = sa_models.FieldSetList()
+
+        result = col_type.process_bind_param([set(['b', 'a']), set()], None)
+
+        self.assertEqual(result, '[["a","b"],[]]')
+
+    def test_result(self):
+        col_type = sa_models.FieldSetList()
+
+        result1 = col_type.process_result_value(u'[["a","b"],[]]', None)
+        result2 = col_type.process_result_value(u'[["a","b"],[]]', None)
+
+        self.assertEqual(result1, [set(['a', 'b']), set()])
+        self.assertIsInstance(result1, list)
+        self.assertNotEqual(id(result1), id(result2))
+        self.assertEqual(id(result1[0]), id(result2[0]))
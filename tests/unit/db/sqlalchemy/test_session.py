@@ -0,0 +1,141 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import mock
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import pool as sa_pool
+
+from boson.db.sqlalchemy import session
+from boson.openstack.common import cfg
+
+import tests
+
+
+class PingListenerTestCase(tests.TestCase):
+    def _record(self, idle):
+        return mock.Mock(info=dict(checkin=time.time() - idle))
+
+    def test_checkin(self):
+        rec = mock.Mock(info={})
+
+        session._checkin_listener('conn', rec)
+
+        self.assertAlmostEqual(rec.info['checkin'], time.time(), delta=1)
+
+    def test_alive(self):
+        dbapi_conn = mock.Mock()
+
+        session._ping_listener(dbapi_conn, self._record(60), 'proxy')
+
+        dbapi_conn.cursor.return_value.execute.assert_called_once_with(
+            'SELECT 1')
+
+    def test_dead(self):
+        dbapi_conn = mock.Mock()
+        dbapi_conn.cursor.return_value.execute.side_effect = Exception('gone')
+
+        self.assertRaises(sa_exc.DisconnectionError, session._ping_listener,
+                          dbapi_conn, self._record(60), 'proxy')
+
+    def test_recently_used(self):
+        dbapi_conn = mock.Mock()
+
+        session._ping_listener(dbapi_conn, self._record(1), 'proxy')
+
+        self.assertFalse(dbapi_conn.cursor.called)
+
+    def test_fresh(self):
+        dbapi_conn = mock.Mock()
+
+        session._ping_listener(dbapi_conn, mock.Mock(info={}), 'proxy')
+
+        self.assertFalse(dbapi_conn.cursor.called)
+
+
+class GetEngineTestCase(tests.TestCase):
+    def setUp(self):
+        super(GetEngineTestCase, self).setUp()
+        session.cleanup()
+
+    def tearDown(self):
+        session.cleanup()
+        for opt in ('sql_connection', 'sql_pool_pre_ping'):
+            cfg.CONF.clear_override(opt)
+        super(GetEngineTestCase, self).tearDown()
+
+    @mock.patch.object(sa.event, 'listen')
+    @mock.patch.object(sa, 'create_engine')
+    def test_pooled(self, mock_create_engine, mock_listen):
+        cfg.CONF.set_override('sql_connection', 'mysql://u:p@host/boson')
+
+        result = session.get_engine()
+
+        self.assertEqual(result, mock_create_engine.return_value)
+        kwargs = mock_create_engine.call_args[1]
+        self.assertEqual(kwargs, dict(
+            pool_recycle=3600,
+            pool_size=5,
+            max_overflow=10,
+            pool_timeout=30,
+        ))
+        self.assertEqual(mock_listen.call_args_list, [
+            mock.call(result, 'checkin', session._checkin_listener),
+            mock.call(result, 'checkout', session._ping_listener),
+        ])
+
+        # The engine is only created once
+        self.assertEqual(session.get_engine(), result)
+        self.assertEqual(mock_create_engine.call_count, 1)
+
+    @mock.patch.object(sa.event, 'listen')
+    @mock.patch.object(sa, 'create_engine')
+    def test_no_pre_ping(self, mock_create_engine, mock_listen):
+        cfg.CONF.set_override('sql_connection', 'mysql://u:p@host/boson')
+        cfg.CONF.set_override('sql_pool_pre_ping', False)
+
+        session.get_engine()
+
+        self.assertFalse(mock_listen.called)
+
+    def test_sqlite_memory(self):
+        cfg.CONF.set_override('sql_connection', 'sqlite://')
+
+        engine = session.get_engine()
+
+        self.assertIsInstance(engine.pool, sa_pool.StaticPool)
+
+
+class GetSessionTestCase(tests.TestCase):
+    def setUp(self):
+        super(GetSessionTestCase, self).setUp()
+        cfg.CONF.set_override('sql_connection', 'sqlite://')
+        session.cleanup()
+
+    def tearDown(self):
+        session.cleanup()
+        cfg.CONF.clear_override('sql_connection')
+        super(GetSessionTestCase, self).tearDown()
+
+    def test_get_session(self):
+        sess = session.get_session()
+
+        self.assertTrue(sess.autocommit)
+        self.assertFalse(sess.expire_on_commit)
+        self.assertEqual(sess.bind, session.get_engine())
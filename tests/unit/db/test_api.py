@@ -0,0 +1,210 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+
+import mock
+
+from boson.db import api
+from boson.db import models
+from boson.openstack.common import cfg
+from boson import utils
+
+import tests
+
+
+class FakeAPI(api.API):
+    pass
+
+
+# Allow instantiation without implementing the abstract methods
+FakeAPI.__abstractmethods__ = frozenset()
+
+
+class HintsParserTestCase(tests.TestCase):
+    def setUp(self):
+        super(HintsParserTestCase, self).setUp()
+        self.dbapi = FakeAPI()
+
+    def test_no_hints(self):
+        self.assertEqual(self.dbapi.hints_parser(models.Service, None), {})
+
+    def test_hints(self):
+        result = self.dbapi.hints_parser(models.Reservation, [
+            'reserved_items.usage.resource',
+            'reserved_items.resource',
+            'expire',
+            'spam',
+        ])
+
+        self.assertEqual(result, {
+            'reserved_items': (models.ReservedItem, {
+                'usage': (models.Usage, {
+                    'resource': (models.Resource, {}),
+                }),
+                'resource': (models.Resource, {}),
+            }),
+        })
+
+    def test_cached(self):
+        hints = ['reserved_items.usage', 'reserved_items.resource']
+
+        result = self.dbapi.hints_parser(models.Reservation, hints)
+
+        self.assertIs(self.dbapi.hints_parser(models.Reservation,
+                                              list(reversed(hints))),
+                      result)
+        self.assertIsNot(self.dbapi.hints_parser(models.ReservedItem,
+                                                 ['usage', 'resource']),
+                         result)
+
+    @mock.patch.object(api, 'HINTS_CACHE_SIZE', 2)
+    @mock.patch.object(api, '_PARSED_HINTS', {})
+    @mock.patch.object(api, '_BAD_HINTS', set())
+    @mock.patch.object(api, 'LOG')
+    def test_cache_bounded(self, mock_LOG):
+        for i in range(5):
+            self.dbapi.hints_parser(models.Service, ['spam%d' % i])
+
+        self.assertTrue(len(api._PARSED_HINTS) <= 2)
+        self.assertTrue(len(api._BAD_HINTS) <= 2)
+
+    @mock.patch.object(api, '_BAD_HINTS', set())
+    @mock.patch.object(api, 'LOG')
+    def test_bad_hints_logged_once(self, mock_LOG):
+        self.dbapi.hints_parser(models.Service, ['spam', 'name'])
+        self.dbapi.hints_parser(models.Service, ['spam', 'name'])
+        self.dbapi.hints_parser(models.Service, ['spam', 'categories'])
+
+        self.assertEqual(mock_LOG.warning.call_count, 1)
+        self.assertEqual(mock_LOG.info.call_count, 1)
+
+
+class IterPagesTestCase(tests.TestCase):
+    def test_pages(self):
+        pages = [
+            [mock.Mock(id='a'), mock.Mock(id='b')],
+            [mock.Mock(id='c'), mock.Mock(id='d')],
+            [],
+        ]
+        get_list = mock.Mock(side_effect=pages)
+
+        result = list(FakeAPI()._iter_pages(get_list, 'ctxt', 2,
+                                            hints='hints'))
+
+        self.assertEqual([model.id for model in result], list('abcd'))
+        get_list.assert_has_calls([
+            mock.call('ctxt', marker=None, limit=2, hints='hints'),
+            mock.call('ctxt', marker='b', limit=2, hints='hints'),
+            mock.call('ctxt', marker='d', limit=2, hints='hints'),
+        ])
+
+    def test_short_page(self):
+        get_list = mock.Mock(return_value=[mock.Mock(id='a')])
+
+        result = list(FakeAPI()._iter_pages(get_list, 'ctxt', 2))
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(get_list.call_count, 1)
+
+
+class CountDownTestCase(tests.TestCase):
+    def setUp(self):
+        super(CountDownTestCase, self).setUp()
+        self.dbapi = FakeAPI()
+        cfg.CONF.set_override('usage_refresh_interval', 10)
+
+    def tearDown(self):
+        for opt in ('usage_refresh_interval', 'usage_refresh_jitter'):
+            cfg.CONF.clear_override(opt)
+        super(CountDownTestCase, self).tearDown()
+
+    @mock.patch.object(random, 'randint', return_value=9)
+    def test_refresh_countdown(self, mock_randint):
+        self.assertEqual(self.dbapi._refresh_countdown(), 9)
+        mock_randint.assert_called_once_with(8, 12)
+
+    def test_refresh_countdown_no_jitter(self):
+        cfg.CONF.set_override('usage_refresh_jitter', 0)
+
+        self.assertEqual(self.dbapi._refresh_countdown(), 10)
+
+    def test_disabled(self):
+        cfg.CONF.set_override('usage_refresh_interval', 0)
+
+        self.assertEqual(self.dbapi._count_down(1, None), (1, None, False))
+        self.assertEqual(self.dbapi._count_down(0, 'refresh'),
+                         (0, 'refresh', False))
+
+    @mock.patch.object(random, 'randint', return_value=9)
+    def test_start(self, _mock_randint):
+        self.assertEqual(self.dbapi._count_down(None, None),
+                         (8, None, False))
+        self.assertEqual(self.dbapi._count_down(0, None), (8, None, False))
+
+    def test_count(self):
+        self.assertEqual(self.dbapi._count_down(5, None), (4, None, False))
+
+    @mock.patch.object(utils, 'generate_uuid', return_value='refresh')
+    def test_exhausted(self, _mock_generate_uuid):
+        self.assertEqual(self.dbapi._count_down(1, None),
+                         (0, 'refresh', False))
+
+    def test_stale(self):
+        self.assertEqual(self.dbapi._count_down(0, 'refresh'),
+                         (0, 'refresh', True))
+
+    def test_restart_countdown(self):
+        cfg.CONF.set_override('usage_refresh_jitter', 0)
+        self.assertEqual(self.dbapi._restart_countdown(), 10)
+
+        cfg.CONF.set_override('usage_refresh_interval', 0)
+        self.assertEqual(self.dbapi._restart_countdown(), 0)
+
+
+class APITransactionTestCase(tests.TestCase):
+    def setUp(self):
+        super(APITransactionTestCase, self).setUp()
+        self.dbapi = mock.Mock()
+
+    def test_commit(self):
+        with api.APITransaction(self.dbapi, 'context'):
+            pass
+
+        self.dbapi.begin.assert_called_once_with('context')
+        self.dbapi.commit.assert_called_once_with('context')
+        self.assertFalse(self.dbapi.rollback.called)
+
+    def test_commit_fails(self):
+        self.dbapi.commit.side_effect = ValueError('flush failed')
+        trans = api.APITransaction(self.dbapi, 'context')
+
+        def run():
+            with trans:
+                trans.flush()
+
+        self.assertRaises(ValueError, run)
+        self.dbapi.flush.assert_called_once_with('context')
+        self.dbapi.rollback.assert_called_once_with('context')
+        self.assertTrue(trans._closed)
+
+    def test_commit_fails_no_rollback(self):
+        self.dbapi.commit.side_effect = ValueError('flush failed')
+        trans = api.APITransaction(self.dbapi, 'context', rollback=False)
+
+        self.assertRaises(ValueError, trans.commit)
+        self.assertFalse(self.dbapi.rollback.called)
@@ -0,0 +1,133 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from boson.db import models
+from boson import exceptions
+
+import tests
+
+
+class FakeBase(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_usage(dbapi, **kwargs):
+    fields = dict((fld, None) for fld in models.Usage._fields)
+    fields.update(kwargs)
+    return models.Usage('context', dbapi, FakeBase(**fields))
+
+
+class BaseModelTestCase(tests.TestCase):
+    def setUp(self):
+        super(BaseModelTestCase, self).setUp()
+        self.dbapi = mock.Mock()
+
+    def test_slots(self):
+        usage = make_usage(self.dbapi, id='usage', used=3)
+
+        self.assertFalse(hasattr(usage, '__dict__'))
+        self.assertIn('used', models.Usage.__slots__)
+        self.assertNotIn('id', models.Usage.__slots__)
+        self.assertIn('_ref_resource', models.Usage.__slots__)
+        self.assertEqual(usage.id, 'usage')
+        self.assertEqual(usage.used, 3)
+        self.assertEqual(usage['used'], 3)
+
+    def test_lazy_fields(self):
+        usage = make_usage(self.dbapi, id='usage', used=3)
+        usage._base_obj.used = 5
+
+        self.assertEqual(usage.used, 5)
+        usage._base_obj.used = 7
+        self.assertEqual(usage.used, 5)
+        usage._base_obj.id = 'other'
+        self.assertEqual(usage.id, 'usage')
+
+    def test_unknown(self):
+        usage = make_usage(self.dbapi)
+
+        self.assertRaises(AttributeError, getattr, usage, 'spam')
+        self.assertRaises(KeyError, usage.__getitem__, 'spam')
+        self.assertRaises(AttributeError, setattr, usage, 'spam', 1)
+        self.assertRaises(AttributeError, delattr, usage, 'used')
+
+    def test_ref_cached(self):
+        usage = make_usage(self.dbapi, resource_id='res')
+
+        self.assertEqual(usage.resource, self.dbapi._lazy_get.return_value)
+        self.assertEqual(usage['resource'],
+                         self.dbapi._lazy_get.return_value)
+        self.assertEqual(self.dbapi._lazy_get.call_count, 1)
+        self.assertIsInstance(models.Usage.resource, models.Ref)
+
+    def test_set_field(self):
+        usage = make_usage(self.dbapi, resource_id='res', used=3)
+        usage.resource
+
+        usage.used = 5
+        usage.resource_id = 'other'
+
+        self.assertEqual(usage.used, 5)
+        self.assertEqual(usage._base_obj.used, 5)
+        self.assertEqual(self.dbapi._save.call_count, 2)
+        usage.resource
+        self.assertEqual(self.dbapi._lazy_get.call_count, 2)
+
+    def test_update_ref(self):
+        usage = make_usage(self.dbapi, resource_id='res')
+        res = mock.Mock(id='other')
+
+        usage.update(resource=res, used=2)
+
+        self.assertEqual(usage.resource_id, 'other')
+        self.assertEqual(usage._base_obj.resource_id, 'other')
+        self.assertEqual(usage.resource, res)
+        self.assertEqual(usage.used, 2)
+        self.assertEqual(self.dbapi._save.call_count, 1)
+        self.assertFalse(self.dbapi._lazy_get.called)
+
+    def test_update_ambiguous(self):
+        usage = make_usage(self.dbapi, resource_id='res')
+
+        self.assertRaises(exceptions.AmbiguousFieldUpdate, usage.update,
+                          resource=mock.Mock(id='other'),
+                          resource_id='other')
+        self.assertFalse(self.dbapi._save.called)
+
+    def test_refresh(self):
+        usage = make_usage(self.dbapi, resource_id='res', used=3)
+        resource = usage.resource
+        usage.reserved_items
+
+        usage._base_obj.used = 5
+        usage._refresh(hints='hints')
+
+        self.assertEqual(usage.used, 5)
+        self.assertIs(usage.resource, resource)
+        self.assertEqual(usage._hints, 'hints')
+        usage.reserved_items
+        self.assertEqual(self.dbapi._lazy_get_list.call_count, 2)
+
+        usage._base_obj.resource_id = 'other'
+        usage._refresh()
+
+        usage.resource
+        self.assertEqual(self.dbapi._lazy_get.call_count, 2)
+        self.assertEqual(usage._hints, 'hints')
@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import uuid
 
 import mock
@@ -65,6 +66,15 @@ class DeserializeTestCase(tests.TestCase):
         self.assertEqual(utils._deserialize("'spam%2F%25%3d%22%27spam'"),
                          """spam/%="'spam""")
 
+    def test_str_bad_escape(self):
+        self.assertEqual(utils._deserialize('"100%/%4"'), '100%/%4')
+
+    def test_str_unicode(self):
+        result = utils._deserialize(u'"\u2603%2F"')
+
+        self.assertEqual(result, u'\u2603/')
+        self.assertIsInstance(result, unicode)
+
     def test_error(self):
         self.assertRaises(ValueError, utils._deserialize, '3.14')
 
@@ -83,6 +93,27 @@ class DictSerializeTestCase(tests.TestCase):
 
         self.assertEqual(utils.dict_serialize(test_data), exemplar)
 
+    def test_dict_serialize_cached(self):
+        utils.dict_serialize(dict(a='spam'))
+
+        with mock.patch.object(utils, '_serialize') as mock_serialize:
+            result = utils.dict_serialize(dict(a='spam'))
+
+        self.assertEqual(result, 'a="spam"')
+        self.assertFalse(mock_serialize.called)
+
+    def test_dict_serialize_bool(self):
+        self.assertEqual(utils.dict_serialize(dict(a=1)), 'a=1')
+        self.assertEqual(utils.dict_serialize(dict(a=True)), 'a=true')
+        self.assertEqual(utils.dict_serialize(dict(a=1)), 'a=1')
+
+    def test_dict_serialize_cache_bounded(self):
+        for i in range(utils.CODEC_CACHE_SIZE + 10):
+            utils.dict_serialize(dict(a='a%d' % i))
+
+        self.assertTrue(len(utils._serialize_cache) <=
+                        utils.CODEC_CACHE_SIZE)
+
 
 class DictDeserializeTestCase(tests.TestCase):
     def test_dict_deserialize(self):
@@ -98,6 +129,34 @@ class DictDeserializeTestCase(tests.TestCase):
 
         self.assertEqual(utils.dict_deserialize(test_data), exemplar)
 
+    def test_dict_deserialize_empty(self):
+        self.assertEqual(utils.dict_deserialize(''), {})
+
+    def test_dict_deserialize_cached(self):
+        result1 = utils.dict_deserialize('a="spam"/b=1')
+        result1['c'] = 2
+        result2 = utils.dict_deserialize('a="spam"/b=1')
+
+        self.assertEqual(result2, dict(a='spam', b=1))
+        self.assertIsNot(result1, result2)
+
+
+class DictDigestTestCase(tests.TestCase):
+    def test_dict_digest(self):
+        result = utils.dict_digest(dict(tenant_id='spam', user_id=u'eggs'))
+
+        self.assertEqual(result, hashlib.sha1(
+            'tenant_id="spam"/user_id="eggs"').hexdigest())
+
+    def test_dict_digest_order(self):
+        self.assertEqual(utils.dict_digest(dict(a=1, b=2, c=3)),
+                         utils.dict_digest(dict(c=3, b=2, a=1)))
+
+    def test_dict_digest_unicode(self):
+        result = utils.dict_digest(dict(name=u'\u2603'))
+
+        self.assertEqual(len(result), 40)
+
 
 class GenerateUuidTestCase(tests.TestCase):
     @mock.patch.object(uuid, 'uuid4',